@@ -0,0 +1,58 @@
+"""
+数据库异步访问
+把 Database 的方法放到专用的有界线程池中执行，接口处理函数 await 调用，
+查询不再阻塞事件循环。每个工作线程使用连接池中自己的连接
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class AsyncDatabase:
+    """Database 的异步外观：async_db.get_xxx(...) 返回可 await 的结果"""
+
+    def __init__(self, db, max_workers: int = None):
+        self.db = db
+        self.max_workers = max_workers or int(os.getenv('DB_EXECUTOR_WORKERS', '4'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        self._methods: Dict[str, Callable] = {}
+        self.pending = 0
+        self.call_count = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在数据库线程池中执行任意同步函数"""
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        self.call_count += 1
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        method = self._methods.get(name)
+        if method is None:
+            async def method(*args, **kwargs):
+                return await self.run(attr, *args, **kwargs)
+            method.__name__ = name
+            method.__doc__ = attr.__doc__
+            self._methods[name] = method
+        return method
+
+    def close(self):
+        """等待进行中的查询完成并关闭线程池（不关闭数据库连接）"""
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取线程池统计信息"""
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "calls": self.call_count,
+            "connections": self.db.pool.connection_count()
+        }
@@ -1,10 +1,19 @@
+import os
 import re
 from typing import Optional, Dict, Any
 from database import Database
+from cache import TTLCache
 
 class AuthService:
     def __init__(self, db: Database):
         self.db = db
+        
+        # 会话缓存：session_token -> 用户信息（含level_info）
+        self.session_cache = TTLCache(
+            max_size=int(os.getenv('SESSION_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('SESSION_CACHE_TTL', '60'))
+        )
+        self.db.add_user_change_listener(self.invalidate_user_cache)
     
     def validate_username(self, username: str) -> Dict[str, Any]:
         """验证用户名（已废弃，保留兼容性）"""
@@ -157,6 +166,10 @@ class AuthService:
         if not session_token:
             return None
         
+        cached_user = self.session_cache.get(session_token)
+        if cached_user is not None:
+            return self._copy_user(cached_user)
+        
         user = self.db.get_user_by_session(session_token)
         if user:
             # 获取用户等级信息
@@ -171,9 +184,33 @@ class AuthService:
                     "can_custom_domain": level_info[6],
                     "description": level_info[9]
                 }
+            self.session_cache.set(session_token, user)
+            return self._copy_user(user)
         
         return user
     
+    def _copy_user(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """复制缓存中的用户信息，避免调用方修改缓存内容"""
+        user_copy = dict(user)
+        if "level_info" in user_copy:
+            user_copy["level_info"] = dict(user_copy["level_info"])
+        return user_copy
+    
+    def invalidate_user_cache(self, user_id: int = None, email: str = None, session_token: str = None) -> int:
+        """使会话缓存失效，返回移除的条目数"""
+        removed = 0
+        if session_token:
+            removed += int(self.session_cache.delete(session_token))
+        if user_id is not None:
+            removed += self.session_cache.delete_where(lambda token, user: user["id"] == user_id)
+        if email:
+            removed += self.session_cache.delete_where(lambda token, user: user["email"] == email)
+        return removed
+    
+    def get_session_cache_stats(self) -> Dict[str, Any]:
+        """获取会话缓存命中统计"""
+        return self.session_cache.get_stats()
+    
     def check_user_permission(self, user_id: int, permission: str) -> bool:
         """检查用户权限"""
         user = self.db.get_user_by_id(user_id)  # 修复：直接通过用户ID查询
@@ -193,13 +230,18 @@ class AuthService:
         
         return permissions.get(permission, False)
     
-    def can_create_memorial(self, user_id: int) -> Dict[str, Any]:
+    def get_user_snapshot(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """获取用户资料快照（用户、等级、纪念馆数量、照片总数），一次查询"""
+        return self.db.get_user_profile_snapshot(user_id)
+    
+    def can_create_memorial(self, user_id: int, snapshot: Dict[str, Any] = None) -> Dict[str, Any]:
         """检查用户是否可以创建纪念馆"""
-        user = self.db.get_user_by_id(user_id)  # 修复：直接通过用户ID查询
-        if not user:
+        if snapshot is None:
+            snapshot = self.get_user_snapshot(user_id)
+        if not snapshot:
             return {"can_create": False, "message": "用户未登录"}
         
-        level_info = self.db.get_user_level_info(user["user_level"])
+        level_info = snapshot["level_info"]
         if not level_info:
             return {"can_create": False, "message": "用户等级信息错误"}
         
@@ -207,7 +249,7 @@ class AuthService:
         if max_memorials == -1:  # 无限
             return {"can_create": True, "message": "可以创建纪念馆"}
         
-        current_count = self.db.get_user_memorial_count(user_id)
+        current_count = snapshot["memorial_count"]
         if current_count >= max_memorials:
             return {
                 "can_create": False, 
@@ -250,17 +292,18 @@ class AuthService:
         
         return {"can_upload": True, "message": "可以上传照片"}
     
-    def can_use_ai_feature(self, user_id: int) -> Dict[str, Any]:
+    def can_use_ai_feature(self, user_id: int, snapshot: Dict[str, Any] = None) -> Dict[str, Any]:
         """检查用户是否可以使用AI功能"""
-        user = self.db.get_user_by_id(user_id)
-        if not user:
+        if snapshot is None:
+            snapshot = self.get_user_snapshot(user_id)
+        if not snapshot:
             return {"can_use": False, "message": "用户未登录"}
         
         # 检查邮箱是否已验证
-        if not user.get("email_verified", False):
+        if not snapshot["user"].get("email_verified", False):
             return {"can_use": False, "message": "请先验证邮箱"}
         
-        level_info = self.db.get_user_level_info(user["user_level"])
+        level_info = snapshot["level_info"]
         if not level_info:
             return {"can_use": False, "message": "用户等级信息错误"}
         
@@ -270,17 +313,18 @@ class AuthService:
         else:
             return {"can_use": False, "message": "当前等级不支持AI功能，请升级会员"}
     
-    def can_export_data(self, user_id: int) -> Dict[str, Any]:
+    def can_export_data(self, user_id: int, snapshot: Dict[str, Any] = None) -> Dict[str, Any]:
         """检查用户是否可以导出数据"""
-        user = self.db.get_user_by_id(user_id)
-        if not user:
+        if snapshot is None:
+            snapshot = self.get_user_snapshot(user_id)
+        if not snapshot:
             return {"can_export": False, "message": "用户未登录"}
         
         # 检查邮箱是否已验证
-        if not user.get("email_verified", False):
+        if not snapshot["user"].get("email_verified", False):
             return {"can_export": False, "message": "请先验证邮箱"}
         
-        level_info = self.db.get_user_level_info(user["user_level"])
+        level_info = snapshot["level_info"]
         if not level_info:
             return {"can_export": False, "message": "用户等级信息错误"}
         
@@ -322,25 +366,20 @@ class AuthService:
         else:
             return {"success": False, "message": "升级失败"}
     
-    def get_user_dashboard_data(self, user_id: int) -> Dict[str, Any]:
+    def get_user_dashboard_data(self, user_id: int, snapshot: Dict[str, Any] = None) -> Dict[str, Any]:
         """获取用户仪表板数据"""
-        user = self.db.get_user_by_id(user_id)
-        if not user:
+        if snapshot is None:
+            snapshot = self.get_user_snapshot(user_id)
+        if not snapshot:
             return {"success": False, "message": "用户不存在"}
         
-        # 获取用户等级信息
-        level_info = self.db.get_user_level_info(user["user_level"])
+        user = snapshot["user"]
+        level_info = snapshot["level_info"]
         if not level_info:
             return {"success": False, "message": "用户等级信息错误"}
         
-        # 获取用户纪念馆数量
-        memorial_count = self.db.get_user_memorial_count(user_id)
-        
-        # 获取用户照片总数
-        total_photos = 0
-        user_memorials = self.db.get_user_memorials(user_id)
-        for memorial in user_memorials:
-            total_photos += self.db.get_memorial_photo_count(memorial["id"])
+        memorial_count = snapshot["memorial_count"]
+        total_photos = snapshot["total_photos"]
         
         return {
             "success": True,
@@ -360,3 +399,15 @@ class AuthService:
                 "email_verified": user.get("email_verified", False)
             }
         }
+    
+    def get_user_permissions(self, user_id: int) -> Dict[str, Any]:
+        """基于同一份用户快照获取仪表板数据和各项权限"""
+        snapshot = self.get_user_snapshot(user_id)
+        return {
+            "dashboard": self.get_user_dashboard_data(user_id, snapshot),
+            "permissions": {
+                "can_create_memorial": self.can_create_memorial(user_id, snapshot),
+                "can_use_ai": self.can_use_ai_feature(user_id, snapshot),
+                "can_export": self.can_export_data(user_id, snapshot)
+            }
+        }
@@ -2,17 +2,186 @@ import sqlite3
 import os
 import hashlib
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta
 
+from hyperloglog import HyperLogLog
+
+
+# 二级索引版本号，修改 INDEXES 时需要递增
+INDEX_VERSION = 7
+
+# 热点查询使用的二级索引，列顺序与查询的 WHERE / ORDER BY 保持一致
+INDEXES = [
+    ("idx_messages_pet_created_id", "messages (pet_id, created_at, id)"),
+    ("idx_reminders_pet_date", "reminders (pet_id, reminder_date)"),
+    ("idx_mood_diaries_pet_created_id", "mood_diaries (pet_id, created_at, id)"),
+    ("idx_visit_stats_memorial_time", "visit_stats (memorial_id, visit_time)"),
+    ("idx_visit_stats_time", "visit_stats (visit_time)"),
+    ("idx_memorial_photos_memorial_created", "memorial_photos (memorial_id, created_at)"),
+    ("idx_memorial_stats_memorial", "memorial_stats (memorial_id)"),
+    ("idx_user_memorials_user", "user_memorials (user_id, memorial_id)"),
+    ("idx_user_memorials_memorial", "user_memorials (memorial_id)"),
+    ("idx_user_sessions_user", "user_sessions (user_id)"),
+    ("idx_user_sessions_expires", "user_sessions (expires_at)"),
+    ("idx_payment_orders_user_created_id", "payment_orders (user_id, created_at, id)"),
+    ("idx_payment_orders_user_status_created", "payment_orders (user_id, payment_status, created_at, id)"),
+    ("idx_recharge_records_user", "recharge_records (user_id)"),
+    ("idx_recharge_records_order", "recharge_records (order_id)"),
+    ("idx_payment_orders_status_expires", "payment_orders (payment_status, expires_at)"),
+    ("idx_email_codes_email_type", "email_codes (email, type)"),
+    ("idx_email_codes_expires", "email_codes (expires_at)"),
+    ("idx_password_reset_tokens_email", "password_reset_tokens (email, token)"),
+    ("idx_password_reset_tokens_expires", "password_reset_tokens (expires_at)"),
+    ("idx_password_resets_expires", "password_resets (expires_at)"),
+    ("idx_personality_tests_pet", "personality_tests (pet_id, question_id)"),
+    ("idx_photos_pet", "photos (pet_id)"),
+    ("idx_memorials_pet", "memorials (pet_id)"),
+    ("idx_memorials_user", "memorials (user_id)"),
+    ("idx_pets_user", "pets (user_id)"),
+    ("idx_letter_jobs_memorial", "letter_jobs (memorial_id, created_at DESC)"),
+    ("idx_letter_jobs_status", "letter_jobs (status, updated_at)"),
+    ("idx_mail_queue_status_next", "mail_queue (status, next_attempt_at)"),
+]
+
+# 已被替换的旧索引，升级时删除
+OBSOLETE_INDEXES = [
+    "idx_messages_pet_created",
+    "idx_mood_diaries_pet_created",
+    "idx_payment_orders_user_created",
+]
+
+
+def apply_indexes(conn, force=False):
+    """按版本创建二级索引
+
+    当前索引版本记录在 PRAGMA user_version 中，已是最新版本时直接跳过。
+    返回本次创建（或确认存在）的索引数量。
+    """
+    cursor = conn.cursor()
+    current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if current_version >= INDEX_VERSION and not force:
+        return 0
+    
+    existing_tables = {
+        row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    
+    for name in OBSOLETE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    
+    created = 0
+    for name, definition in INDEXES:
+        table = definition.split()[0]
+        if table not in existing_tables:
+            continue
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+        created += 1
+    
+    cursor.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    conn.commit()
+    # 让查询规划器基于新索引刷新统计信息
+    cursor.execute("PRAGMA optimize")
+    return created
+
+
+class ConnectionPool:
+    """按线程分配的SQLite连接池
+
+    每个线程（事件循环线程、Starlette线程池中的工作线程）持有自己的连接，
+    避免多个线程共用同一个句柄而串行化或触发 "SQLite objects created in a thread" 错误。
+    连接统一开启WAL模式，读请求不会被写请求阻塞。
+    """
+
+    def __init__(self, db_path, busy_timeout_ms=5000, journal_mode="WAL", synchronous="NORMAL"):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connect(self):
+        """创建并配置一个新连接"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        # 新建数据库时启用增量空间回收（必须在写入任何页之前设置），已有数据库不受影响
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if self.journal_mode:
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        if self.synchronous:
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return conn
+
+    def get_connection(self):
+        """获取当前线程的连接，不存在时创建"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def connection_count(self):
+        """当前已打开的连接数量"""
+        with self._lock:
+            return len(self._connections)
+
+    def close_all(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"关闭数据库连接失败: {e}")
+        self._local = threading.local()
+
+
 class Database:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, busy_timeout_ms=None, journal_mode=None):
         if db_path is None:
             # 获取当前文件所在目录
             current_dir = os.path.dirname(os.path.abspath(__file__))
             db_path = os.path.join(current_dir, "pet_memorials.db")
-        self.conn = sqlite3.connect(db_path)
+        if busy_timeout_ms is None:
+            busy_timeout_ms = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+        if journal_mode is None:
+            journal_mode = os.getenv('DB_JOURNAL_MODE', 'WAL')
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, busy_timeout_ms=busy_timeout_ms, journal_mode=journal_mode)
+        self._user_change_listeners = []
         self._create_tables()
     
+    @property
+    def conn(self):
+        """当前线程使用的数据库连接"""
+        return self.pool.get_connection()
+    
+    def add_user_change_listener(self, callback):
+        """注册用户/会话变更回调，用于让上层缓存失效
+        
+        callback(user_id=None, email=None, session_token=None)
+        """
+        self._user_change_listeners.append(callback)
+    
+    def _notify_user_changed(self, user_id=None, email=None, session_token=None):
+        """通知用户/会话数据已变更"""
+        for callback in self._user_change_listeners:
+            try:
+                callback(user_id=user_id, email=email, session_token=session_token)
+            except Exception as e:
+                print(f"用户变更回调执行失败: {e}")
+    
     def _create_tables(self):
         cursor = self.conn.cursor()
         
@@ -86,7 +255,7 @@ class Database:
             amount REAL NOT NULL,
             currency TEXT DEFAULT 'CNY',
             payment_method TEXT,  -- 'wechat', 'alipay', 'bank'
-            payment_status TEXT DEFAULT 'pending',  -- 'pending', 'paid', 'failed', 'cancelled', 'refunded'
+            payment_status TEXT DEFAULT 'pending',  -- 'pending', 'paid', 'failed', 'cancelled', 'refunded', 'expired'
             payment_platform TEXT,  -- 支付平台返回的交易号
             payment_time TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -128,6 +297,28 @@ class Database:
         )
         ''')
         
+        # 支付入账记录表（每笔网关交易、每个订单只入账一次）
+        settlements_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'payment_settlements'"
+        ).fetchone()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_settlements (
+            idempotency_key TEXT PRIMARY KEY,  -- '支付方式:网关交易号'，无交易号时为 'order:订单号'
+            order_id TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES payment_orders(id)
+        )
+        ''')
+        if not settlements_exists:
+            # 升级前已支付的订单视为已入账，避免重复通知再次入账
+            cursor.execute('''
+            INSERT OR IGNORE INTO payment_settlements (idempotency_key, order_id, user_id, amount, created_at)
+            SELECT 'order:' || id, id, user_id, amount, COALESCE(payment_time, updated_at, created_at)
+            FROM payment_orders WHERE payment_status = 'paid'
+            ''')
+        
         # 纪念馆照片表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS memorial_photos (
@@ -139,6 +330,34 @@ class Database:
         )
         ''')
         
+        # 照片文件表（按内容SHA-256寻址，ref_count为memorial_photos中的引用数）
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS photo_blobs (
+            sha256 TEXT PRIMARY KEY,
+            photo_url TEXT NOT NULL UNIQUE,
+            size INTEGER,
+            ref_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # 照片多尺寸版本表（缩略图、中等尺寸）
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS photo_variants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            photo_url TEXT NOT NULL,
+            variant TEXT NOT NULL,  -- 'thumb', 'medium'
+            format TEXT NOT NULL,  -- 'webp', 'jpeg'
+            url TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            bytes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (photo_url, variant, format)
+        )
+        ''')
+        
         # 纪念馆统计表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS memorial_stats (
@@ -325,10 +544,72 @@ class Database:
         )
         ''')
         
+        # AI信件生成任务表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS letter_jobs (
+            id TEXT PRIMARY KEY,
+            memorial_id TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',  -- 'pending', 'running', 'done', 'failed'
+            payload TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (memorial_id) REFERENCES memorials(id)
+        )
+        ''')
+        
+        # 邮件发送队列表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mail_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            html_content TEXT NOT NULL,
+            text_content TEXT,
+            status TEXT DEFAULT 'pending',  -- 'pending', 'sending', 'sent', 'failed'
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        ''')
+        
+        # 访问统计按天汇总表（visitor_sketch为访客IP的HyperLogLog草图）
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visit_daily_rollups (
+            memorial_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            visits INTEGER DEFAULT 0,
+            last_visit TIMESTAMP,
+            visitor_sketch BLOB,
+            PRIMARY KEY (memorial_id, day)
+        )
+        ''')
+        
+        # 访问统计总汇总表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visit_rollups (
+            memorial_id TEXT PRIMARY KEY,
+            total_visits INTEGER DEFAULT 0,
+            last_visit TIMESTAMP,
+            visitor_sketch BLOB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
         # 初始化用户等级数据
         self._init_user_levels()
         
         self.conn.commit()
+        
+        # 创建二级索引
+        apply_indexes(self.conn)
+        
+        # 首次启用汇总表时，用已有的访问记录生成汇总
+        self._init_visit_rollups()
     
     def _init_user_levels(self):
         """初始化用户等级数据"""
@@ -440,6 +721,7 @@ class Database:
             ''', (user[0],))
             
             self.conn.commit()
+            self._notify_user_changed(user_id=user[0])
             return {"user_id": user[0], "email": user[1]}
         except Exception as e:
             print(f"邮箱验证失败: {e}")
@@ -542,6 +824,7 @@ class Database:
             ''', (reset_token,))
             
             self.conn.commit()
+            self._notify_user_changed(user_id=user_id)
             return True
         except Exception as e:
             print(f"重置密码失败: {e}")
@@ -567,8 +850,6 @@ class Database:
         """通过会话令牌获取用户信息"""
         cursor = self.conn.cursor()
         
-        print(f"🔍 查询会话: {session_token[:20]}...")
-        
         cursor.execute('''
         SELECT u.id, u.email, u.user_level, u.is_active, u.email_verified
         FROM users u
@@ -577,8 +858,6 @@ class Database:
         ''', (session_token,))
         
         user = cursor.fetchone()
-        print(f"🔍 数据库查询结果: {user}")
-        
         if user:
             return {
                 'id': user[0],
@@ -615,6 +894,7 @@ class Database:
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
         self.conn.commit()
+        self._notify_user_changed(session_token=session_token)
         return cursor.rowcount > 0
     
     def get_user_level_info(self, level):
@@ -714,10 +994,45 @@ class Database:
         """获取纪念馆的照片数量"""
         cursor = self.conn.cursor()
         cursor.execute('''
-        SELECT COUNT(*) FROM photos WHERE memorial_id = ?
+        SELECT COUNT(*) FROM memorial_photos WHERE memorial_id = ?
         ''', (memorial_id,))
         return cursor.fetchone()[0]
     
+    def get_user_profile_snapshot(self, user_id):
+        """
+        一次查询获取用户信息、等级信息、纪念馆数量和照片总数
+        level_info 与 get_user_level_info 返回的元组格式相同
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT u.id, u.email, u.user_level, u.is_active, u.email_verified,
+               l.level, l.name, l.max_memorials, l.max_photos, l.can_use_ai, l.can_export,
+               l.can_custom_domain, l.price_monthly, l.price_yearly, l.description,
+               (SELECT COUNT(*) FROM user_memorials um WHERE um.user_id = u.id) AS memorial_count,
+               (SELECT COUNT(*) FROM user_memorials um 
+                JOIN memorial_photos mp ON mp.memorial_id = um.memorial_id 
+                WHERE um.user_id = u.id) AS total_photos
+        FROM users u
+        LEFT JOIN user_levels l ON l.level = CAST(u.user_level AS INTEGER)
+        WHERE u.id = ? AND u.is_active = 1
+        ''', (user_id,))
+        
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            'user': {
+                'id': row[0],
+                'email': row[1],
+                'user_level': row[2],
+                'is_active': row[3],
+                'email_verified': row[4]
+            },
+            'level_info': row[5:15] if row[5] is not None else None,
+            'memorial_count': row[15],
+            'total_photos': row[16]
+        }
+    
     def delete_memorial(self, memorial_id, user_id):
         """删除纪念馆"""
         cursor = self.conn.cursor()
@@ -758,6 +1073,7 @@ class Database:
         UPDATE users SET user_level = ? WHERE id = ?
         ''', (new_level, user_id))
         self.conn.commit()
+        self._notify_user_changed(user_id=user_id)
         return cursor.rowcount > 0
 
     # 原有的方法保持不变
@@ -839,13 +1155,25 @@ class Database:
         ''', (pet_id, visitor_name, message))
         self.conn.commit()
     
-    def get_messages(self, pet_id):
-        """获取宠物的所有留言"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        SELECT visitor_name, message, created_at FROM messages 
-        WHERE pet_id = ? ORDER BY created_at DESC
-        ''', (pet_id,))
+    def get_messages(self, pet_id, limit=None, after=None):
+        """
+        获取宠物的留言（按时间倒序），返回 (visitor_name, message, created_at, id)
+        limit 为空时返回全部；after 为上一页最后一条的 (created_at, id)
+        """
+        cursor = self.conn.cursor()
+        sql = '''
+        SELECT visitor_name, message, created_at, id FROM messages 
+        WHERE pet_id = ?
+        '''
+        params = [pet_id]
+        if after:
+            sql += ' AND (created_at, id) < (?, ?)'
+            params.extend(after)
+        sql += ' ORDER BY created_at DESC, id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor.execute(sql, params)
         return cursor.fetchall()
     
     def save_reminder(self, pet_id, reminder_type, reminder_date, custom_name=None, custom_description=None):
@@ -857,13 +1185,25 @@ class Database:
         ''', (pet_id, reminder_type, reminder_date, custom_name, custom_description))
         self.conn.commit()
     
-    def get_reminders(self, pet_id):
-        """获取宠物的所有提醒"""
+    def get_reminders(self, pet_id, limit=None, after=None):
+        """
+        获取宠物的提醒（按提醒日期升序）
+        limit 为空时返回全部；after 为上一页最后一条的 (reminder_date, id)
+        """
         cursor = self.conn.cursor()
-        cursor.execute('''
+        sql = '''
         SELECT id, reminder_type, reminder_date, custom_name, custom_description, is_active FROM reminders 
-        WHERE pet_id = ? ORDER BY reminder_date
-        ''', (pet_id,))
+        WHERE pet_id = ?
+        '''
+        params = [pet_id]
+        if after:
+            sql += ' AND (reminder_date, id) > (?, ?)'
+            params.extend(after)
+        sql += ' ORDER BY reminder_date, id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor.execute(sql, params)
         return cursor.fetchall()
     
     def delete_reminder(self, reminder_id):
@@ -884,38 +1224,193 @@ class Database:
         ''', (pet_id, mood_type, mood_score, diary_content, weather))
         self.conn.commit()
     
-    def get_mood_diaries(self, pet_id, limit=10):
-        """获取宠物的心情日记"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        SELECT mood_type, mood_score, diary_content, weather, created_at 
+    def get_mood_diaries(self, pet_id, limit=10, after=None):
+        """
+        获取宠物的心情日记（按时间倒序），返回 (mood_type, mood_score, diary_content, weather, created_at, id)
+        after 为上一页最后一条的 (created_at, id)
+        """
+        cursor = self.conn.cursor()
+        sql = '''
+        SELECT mood_type, mood_score, diary_content, weather, created_at, id 
         FROM mood_diaries 
-        WHERE pet_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT ?
-        ''', (pet_id, limit))
+        WHERE pet_id = ?
+        '''
+        params = [pet_id]
+        if after:
+            sql += ' AND (created_at, id) < (?, ?)'
+            params.extend(after)
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit)
+        cursor.execute(sql, params)
         return cursor.fetchall()
     
     def save_visit_stat(self, memorial_id, visitor_ip, user_agent):
         """保存访问统计"""
+        visit_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self.flush_visit_stats([(memorial_id, visitor_ip, user_agent, visit_time)])
+    
+    def flush_visit_stats(self, visits):
+        """
+        批量写入访问记录和访问汇总（一个事务）
+        visits: [(memorial_id, visitor_ip, user_agent, visit_time), ...]
+        """
         cursor = self.conn.cursor()
-        cursor.execute('''
-        INSERT INTO visit_stats (memorial_id, visitor_ip, user_agent)
-        VALUES (?, ?, ?)
-        ''', (memorial_id, visitor_ip, user_agent))
-        self.conn.commit()
+        try:
+            if visits:
+                cursor.executemany('''
+                INSERT INTO visit_stats (memorial_id, visitor_ip, user_agent, visit_time)
+                VALUES (?, ?, ?, ?)
+                ''', visits)
+                self._apply_visit_rollups(cursor, visits)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def _apply_visit_rollups(self, cursor, visits):
+        """把一批访问记录累加到汇总表，由调用方提交事务"""
+        daily = {}
+        totals = {}
+        for memorial_id, visitor_ip, _, visit_time in visits:
+            for bucket in (daily.setdefault((memorial_id, visit_time[:10]), [0, None, set()]),
+                           totals.setdefault(memorial_id, [0, None, set()])):
+                bucket[0] += 1
+                if bucket[1] is None or visit_time > bucket[1]:
+                    bucket[1] = visit_time
+                bucket[2].add(visitor_ip or "")
+        
+        def merged_sketch(row, visitor_ips):
+            sketch = HyperLogLog.from_bytes(row[0] if row else None)
+            for visitor_ip in visitor_ips:
+                sketch.add(visitor_ip)
+            return sketch.to_bytes()
+        
+        for (memorial_id, day), (count, last_visit, visitor_ips) in daily.items():
+            cursor.execute('''
+            SELECT visitor_sketch FROM visit_daily_rollups WHERE memorial_id = ? AND day = ?
+            ''', (memorial_id, day))
+            sketch = merged_sketch(cursor.fetchone(), visitor_ips)
+            cursor.execute('''
+            INSERT INTO visit_daily_rollups (memorial_id, day, visits, last_visit, visitor_sketch)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(memorial_id, day) DO UPDATE SET 
+                visits = visits + excluded.visits,
+                last_visit = MAX(COALESCE(last_visit, ''), excluded.last_visit),
+                visitor_sketch = excluded.visitor_sketch
+            ''', (memorial_id, day, count, last_visit, sketch))
+        
+        for memorial_id, (count, last_visit, visitor_ips) in totals.items():
+            cursor.execute('''
+            SELECT visitor_sketch FROM visit_rollups WHERE memorial_id = ?
+            ''', (memorial_id,))
+            sketch = merged_sketch(cursor.fetchone(), visitor_ips)
+            cursor.execute('''
+            INSERT INTO visit_rollups (memorial_id, total_visits, last_visit, visitor_sketch)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(memorial_id) DO UPDATE SET 
+                total_visits = total_visits + excluded.total_visits,
+                last_visit = MAX(COALESCE(last_visit, ''), excluded.last_visit),
+                visitor_sketch = excluded.visitor_sketch,
+                updated_at = CURRENT_TIMESTAMP
+            ''', (memorial_id, count, last_visit, sketch))
+    
+    def _init_visit_rollups(self):
+        """汇总表为空而已有访问记录时，重建汇总表"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT 1 FROM visit_rollups LIMIT 1')
+        if cursor.fetchone():
+            return
+        cursor.execute('SELECT 1 FROM visit_stats LIMIT 1')
+        if not cursor.fetchone():
+            return
+        count = self.rebuild_visit_rollups()
+        print(f"📊 已根据 {count} 条访问记录生成访问统计汇总")
+    
+    def rebuild_visit_rollups(self, batch_size: int = 5000):
+        """
+        根据 visit_stats 原始记录重建汇总表，返回处理的记录数
+        注意：超过保留期的原始记录已被压缩删除，只应在汇总表丢失时使用
+        """
+        conn = self.conn
+        cursor = conn.cursor()
+        processed = 0
+        try:
+            # 加写锁后再读取原始记录，避免与并发写入交错
+            if conn.in_transaction:
+                conn.commit()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM visit_daily_rollups')
+            cursor.execute('DELETE FROM visit_rollups')
+            reader = conn.cursor()
+            reader.execute('''
+            SELECT memorial_id, visitor_ip, user_agent, visit_time FROM visit_stats ORDER BY id
+            ''')
+            while True:
+                rows = reader.fetchmany(batch_size)
+                if not rows:
+                    break
+                self._apply_visit_rollups(cursor, [
+                    (row[0], row[1], row[2], str(row[3])) for row in rows
+                ])
+                processed += len(rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return processed
+    
+    def compact_visit_stats(self, retention_days: int, batch_size: int = 5000):
+        """删除超过保留期的原始访问记录（已计入汇总表），返回删除的行数"""
+        cursor = self.conn.cursor()
+        deleted = 0
+        while True:
+            cursor.execute('''
+            DELETE FROM visit_stats 
+            WHERE id IN (
+                SELECT id FROM visit_stats 
+                WHERE visit_time < datetime('now', ?)
+                LIMIT ?
+            )
+            ''', (f"-{int(retention_days)} days", batch_size))
+            self.conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+            # 批次之间让出写锁
+            time.sleep(0.01)
+        return deleted
     
     def get_visit_stats(self, memorial_id):
-        """获取纪念馆访问统计"""
+        """获取纪念馆访问统计（总访问数、独立访客数估计值、最后访问时间）"""
         cursor = self.conn.cursor()
         cursor.execute('''
-        SELECT COUNT(*) as total_visits, 
-               COUNT(DISTINCT visitor_ip) as unique_visitors,
-               MAX(visit_time) as last_visit
-        FROM visit_stats 
+        SELECT total_visits, visitor_sketch, last_visit 
+        FROM visit_rollups 
         WHERE memorial_id = ?
         ''', (memorial_id,))
-        return cursor.fetchone()
+        row = cursor.fetchone()
+        if not row:
+            return (0, 0, None)
+        return (row[0], HyperLogLog.from_bytes(row[1]).count(), row[2])
+    
+    def get_visit_daily_stats(self, memorial_id, days: int = 30):
+        """获取纪念馆最近若干天的每日访问统计"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT day, visits, visitor_sketch, last_visit 
+        FROM visit_daily_rollups 
+        WHERE memorial_id = ? AND day >= date('now', ?)
+        ORDER BY day ASC
+        ''', (memorial_id, f"-{int(days) - 1} days"))
+        return [
+            {
+                'date': row[0],
+                'visits': row[1],
+                'unique_visitors': HyperLogLog.from_bytes(row[2]).count(),
+                'last_visit': row[3]
+            }
+            for row in cursor.fetchall()
+        ]
     
     def get_pet_by_memorial_id(self, memorial_id):
         """通过纪念馆ID获取宠物信息"""
@@ -1026,6 +1521,7 @@ class Database:
         ''', (password_hash, salt, email))
         
         self.conn.commit()
+        self._notify_user_changed(email=email)
         return cursor.rowcount > 0
     
     def user_exists(self, email):
@@ -1185,7 +1681,7 @@ class Database:
         try:
             cursor.execute('''
             UPDATE users 
-            SET user_level = ?, updated_at = CURRENT_TIMESTAMP
+            SET user_level = ?
             WHERE id = ?
             ''', (new_level, user_id))
             
@@ -1197,22 +1693,133 @@ class Database:
                 ''', (user_id, order_id))
             
             self.conn.commit()
+            self._notify_user_changed(user_id=user_id)
             return True
         except Exception as e:
             print(f"升级用户等级失败: {e}")
             return False
     
-    def get_user_payment_orders(self, user_id: int, limit: int = 20):
-        """获取用户支付订单列表"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
+    def settle_payment_order(self, order_id: str, transaction_id: str = None, payment_method: str = None):
+        """
+        支付成功入账：更新订单状态、升级用户等级、增加余额并记录充值，在一个事务中完成
+        幂等键为网关交易号，同一交易或同一订单重复通知时直接返回
+        返回 'settled'（本次入账）、'duplicate'（已入账）、'not_found'（订单不存在）
+        或 'conflict'（交易号已用于其他订单）
+        """
+        method = payment_method or 'unknown'
+        idempotency_key = f"{method}:{transaction_id}" if transaction_id else f"order:{order_id}"
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        def check_existing():
+            row = cursor.execute('''
+            SELECT order_id FROM payment_settlements WHERE idempotency_key = ? OR order_id = ?
+            ''', (idempotency_key, order_id)).fetchone()
+            if row is None:
+                return None
+            return 'duplicate' if row[0] == order_id else 'conflict'
+        
+        # 已入账时不需要写锁，网关重试可以很快返回
+        existing = check_existing()
+        if existing:
+            return existing
+        
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            existing = check_existing()
+            if existing:
+                conn.rollback()
+                return existing
+            
+            order = cursor.execute('''
+            SELECT user_id, order_type, amount FROM payment_orders WHERE id = ?
+            ''', (order_id,)).fetchone()
+            if not order:
+                conn.rollback()
+                return 'not_found'
+            user_id, order_type, amount = order
+            
+            cursor.execute('''
+            INSERT INTO payment_settlements (idempotency_key, order_id, user_id, amount)
+            VALUES (?, ?, ?, ?)
+            ''', (idempotency_key, order_id, user_id, amount))
+            
+            cursor.execute('''
+            UPDATE payment_orders 
+            SET payment_status = 'paid', payment_platform = ?, payment_time = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (transaction_id, order_id))
+            
+            # 根据订单类型升级用户等级
+            if order_type in ('upgrade_monthly', 'upgrade_yearly'):
+                cursor.execute('''
+                UPDATE users 
+                SET user_level = 1
+                WHERE id = ?
+                ''', (user_id,))
+                cursor.execute('''
+                INSERT INTO recharge_records (user_id, order_id, amount, balance_before, balance_after, recharge_type)
+                VALUES (?, ?, 0, 0, 0, 'upgrade')
+                ''', (user_id, order_id))
+            
+            # 记录充值
+            cursor.execute('''
+            INSERT OR IGNORE INTO user_balance (user_id, balance, frozen_balance, total_recharged, total_consumed)
+            VALUES (?, 0.0, 0.0, 0.0, 0.0)
+            ''', (user_id,))
+            balance_before = cursor.execute(
+                'SELECT balance FROM user_balance WHERE user_id = ?', (user_id,)
+            ).fetchone()[0]
+            balance_after = balance_before + amount
+            cursor.execute('''
+            UPDATE user_balance 
+            SET balance = ?, total_recharged = total_recharged + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+            ''', (balance_after, amount, user_id))
+            cursor.execute('''
+            INSERT INTO recharge_records (user_id, order_id, amount, balance_before, balance_after, recharge_type)
+            VALUES (?, ?, ?, ?, ?, 'upgrade')
+            ''', (user_id, order_id, amount, balance_before, balance_after))
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        self._notify_user_changed(user_id=user_id)
+        return 'settled'
+    
+    def get_user_payment_orders(self, user_id: int, limit: int = 20, status: str = None,
+                                offset: int = 0, after=None):
+        """
+        获取用户支付订单列表，按创建时间倒序
+        status 为空时不按状态筛选；after 为上一页最后一条的 (created_at, id)，
+        传入时按游标翻页，忽略 offset
+        """
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if status:
+            conditions.append("payment_status = ?")
+            params.append(status)
+        if after:
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend(after)
+            offset = 0
+        params.extend([limit, max(offset, 0)])
+        
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
         SELECT id, order_type, amount, payment_method, payment_status, 
                payment_time, created_at, description
         FROM payment_orders 
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT ?
-        ''', (user_id, limit))
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ? OFFSET ?
+        ''', params)
         
         results = cursor.fetchall()
         orders = []
@@ -1229,6 +1836,17 @@ class Database:
             })
         return orders
     
+    def get_user_payment_order_stats(self, user_id: int):
+        """按支付状态汇总用户订单，返回 {状态: {'count': 数量, 'amount': 金额}}"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT payment_status, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM payment_orders
+        WHERE user_id = ?
+        GROUP BY payment_status
+        ''', (user_id,))
+        return {row[0]: {'count': row[1], 'amount': row[2]} for row in cursor.fetchall()}
+    
     def get_memorial_by_id(self, memorial_id: str):
         """根据ID获取纪念馆详情"""
         cursor = self.conn.cursor()
@@ -1312,15 +1930,109 @@ class Database:
             )
             ''', (memorial_id,))
             
-            # 删除纪念馆照片
+            # 删除纪念馆照片，并减少照片文件引用计数
+            cursor.execute('''
+            UPDATE photo_blobs 
+            SET ref_count = MAX(0, ref_count - (
+                SELECT COUNT(*) FROM memorial_photos 
+                WHERE memorial_id = ? AND photo_url = photo_blobs.photo_url
+            )), updated_at = CURRENT_TIMESTAMP
+            WHERE photo_url IN (SELECT photo_url FROM memorial_photos WHERE memorial_id = ?)
+            ''', (memorial_id, memorial_id))
             cursor.execute('DELETE FROM memorial_photos WHERE memorial_id = ?', (memorial_id,))
             
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             print(f"删除纪念馆失败: {e}")
             return False
     
+    MEMORIAL_RENDER_COLUMNS = '''
+        m.id, COALESCE(m.pet_name, p.name), COALESCE(m.species, p.species),
+        COALESCE(m.breed, p.breed), COALESCE(m.color, p.color),
+        COALESCE(m.gender, p.gender), COALESCE(m.birth_date, p.birth_date),
+        COALESCE(m.memorial_date, p.memorial_date), COALESCE(m.weight, p.weight),
+        p.status, p.personality_type, m.personality, m.ai_letter
+    '''
+    
+    @staticmethod
+    def _memorial_render_row(row, photos):
+        return {
+            'pet_info': {
+                'name': row[1] or '',
+                'species': row[2] or '',
+                'breed': row[3] or '',
+                'color': row[4] or '',
+                'gender': row[5] or '',
+                'birth_date': row[6] or '',
+                'memorial_date': row[7] or '',
+                'weight': row[8] if row[8] is not None else '',
+                'status': row[9] or 'alive'
+            },
+            'personality_type': row[10] or '',
+            'personality': row[11],
+            'ai_letter': row[12] or '',
+            'photos': photos
+        }
+    
+    def get_memorial_render_data(self, memorial_id: str):
+        """
+        获取重新生成纪念馆页面所需的数据，纪念馆中编辑过的字段优先于宠物档案
+        返回 {'pet_info', 'personality_type', 'personality', 'ai_letter', 'photos'}，纪念馆不存在时返回None
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+        SELECT {self.MEMORIAL_RENDER_COLUMNS}
+        FROM memorials m
+        LEFT JOIN pets p ON p.id = m.pet_id
+        WHERE m.id = ?
+        ''', (memorial_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        
+        return self._memorial_render_row(row, self.get_memorial_photos(memorial_id))
+    
+    def get_memorial_render_batch(self, after_id: str = None, limit: int = 200):
+        """
+        按ID顺序批量获取纪念馆渲染数据，用于批量重新生成页面
+        返回 [(memorial_id, data)]，data 在 get_memorial_render_data 的基础上包含 photo_variants，
+        下一批从本批最后一个ID之后继续
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+        SELECT {self.MEMORIAL_RENDER_COLUMNS}
+        FROM memorials m
+        LEFT JOIN pets p ON p.id = m.pet_id
+        WHERE m.id > ?
+        ORDER BY m.id
+        LIMIT ?
+        ''', (after_id or '', limit))
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+        
+        memorial_ids = [row[0] for row in rows]
+        placeholders = ','.join('?' * len(memorial_ids))
+        cursor.execute(f'''
+        SELECT memorial_id, photo_url FROM memorial_photos 
+        WHERE memorial_id IN ({placeholders})
+        ORDER BY created_at ASC
+        ''', memorial_ids)
+        photos = {}
+        for memorial_id, photo_url in cursor.fetchall():
+            photos.setdefault(memorial_id, []).append(photo_url)
+        variants = self.get_photo_variants([url for urls in photos.values() for url in urls])
+        
+        batch = []
+        for row in rows:
+            memorial_photos = photos.get(row[0], [])
+            data = self._memorial_render_row(row, memorial_photos)
+            data['photo_variants'] = {url: variants[url] for url in memorial_photos if url in variants}
+            batch.append((row[0], data))
+        return batch
+    
     def get_memorial_photos(self, memorial_id: str):
         """获取纪念馆照片列表"""
         cursor = self.conn.cursor()
@@ -1333,6 +2045,23 @@ class Database:
         results = cursor.fetchall()
         return [result[0] for result in results]
     
+    def get_photo_memorial_ids(self, photo_urls: list):
+        """获取使用了这些照片的纪念馆ID列表"""
+        if not photo_urls:
+            return []
+        cursor = self.conn.cursor()
+        memorial_ids = set()
+        photo_urls = list(photo_urls)
+        for start in range(0, len(photo_urls), 500):
+            chunk = photo_urls[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+            SELECT DISTINCT memorial_id FROM memorial_photos 
+            WHERE photo_url IN ({placeholders})
+            ''', chunk)
+            memorial_ids.update(row[0] for row in cursor.fetchall())
+        return sorted(memorial_ids)
+    
     def add_memorial_photo(self, memorial_id: str, photo_url: str):
         """添加纪念馆照片"""
         cursor = self.conn.cursor()
@@ -1342,10 +2071,16 @@ class Database:
             INSERT INTO memorial_photos (memorial_id, photo_url, created_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
             ''', (memorial_id, photo_url))
+            cursor.execute('''
+            UPDATE photo_blobs 
+            SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE photo_url = ?
+            ''', (photo_url,))
             
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             print(f"添加纪念馆照片失败: {e}")
             return False
     
@@ -1358,13 +2093,115 @@ class Database:
             DELETE FROM memorial_photos 
             WHERE memorial_id = ? AND photo_url = ?
             ''', (memorial_id, photo_url))
+            cursor.execute('''
+            UPDATE photo_blobs 
+            SET ref_count = MAX(0, ref_count - ?), updated_at = CURRENT_TIMESTAMP
+            WHERE photo_url = ?
+            ''', (cursor.rowcount, photo_url))
             
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             print(f"删除纪念馆照片失败: {e}")
             return False
     
+    def register_photo_blob(self, sha256: str, photo_url: str, size: int):
+        """登记照片文件，已存在时刷新更新时间（防止刚上传的文件被清理）"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        INSERT INTO photo_blobs (sha256, photo_url, size)
+        VALUES (?, ?, ?)
+        ON CONFLICT(sha256) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+        ''', (sha256, photo_url, size))
+        self.conn.commit()
+    
+    def reconcile_photo_refcounts(self):
+        """按memorial_photos重新计算照片文件引用计数，返回修正的行数"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE photo_blobs 
+        SET ref_count = (
+            SELECT COUNT(*) FROM memorial_photos WHERE memorial_photos.photo_url = photo_blobs.photo_url
+        )
+        WHERE ref_count != (
+            SELECT COUNT(*) FROM memorial_photos WHERE memorial_photos.photo_url = photo_blobs.photo_url
+        )
+        ''')
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def get_orphan_photo_blobs(self, grace_seconds: int = 86400, limit: int = 500):
+        """获取超过宽限期仍无引用的照片文件"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT sha256, photo_url, size FROM photo_blobs 
+        WHERE ref_count <= 0 AND updated_at < datetime('now', ?)
+        LIMIT ?
+        ''', (f"-{int(grace_seconds)} seconds", limit))
+        return [{'sha256': row[0], 'photo_url': row[1], 'size': row[2]} for row in cursor.fetchall()]
+    
+    def delete_photo_blob(self, sha256: str, grace_seconds: int = 86400):
+        """删除无引用的照片文件记录及其版本记录，返回是否删除"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('''
+            DELETE FROM photo_variants 
+            WHERE photo_url IN (
+                SELECT photo_url FROM photo_blobs 
+                WHERE sha256 = ? AND ref_count <= 0 AND updated_at < datetime('now', ?)
+            )
+            ''', (sha256, f"-{int(grace_seconds)} seconds"))
+            cursor.execute('''
+            DELETE FROM photo_blobs 
+            WHERE sha256 = ? AND ref_count <= 0 AND updated_at < datetime('now', ?)
+            ''', (sha256, f"-{int(grace_seconds)} seconds"))
+            deleted = cursor.rowcount > 0
+            self.conn.commit()
+            return deleted
+        except Exception as e:
+            self.conn.rollback()
+            print(f"删除照片文件记录失败: {e}")
+            return False
+    
+    def save_photo_variants(self, photo_url: str, variants: list):
+        """记录照片的各尺寸版本"""
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+        INSERT OR REPLACE INTO photo_variants (photo_url, variant, format, url, width, height, bytes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (photo_url, item['variant'], item['format'], item['url'],
+             item.get('width'), item.get('height'), item.get('bytes'))
+            for item in variants
+        ])
+        self.conn.commit()
+    
+    def get_photo_variants(self, photo_urls: list):
+        """批量获取照片的各尺寸版本，返回 {photo_url: {variant: {format: url}}}"""
+        if not photo_urls:
+            return {}
+        cursor = self.conn.cursor()
+        result = {}
+        photo_urls = list(photo_urls)
+        # 分批查询，避免超过SQLite参数个数上限
+        for start in range(0, len(photo_urls), 500):
+            chunk = photo_urls[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+            SELECT photo_url, variant, format, url FROM photo_variants 
+            WHERE photo_url IN ({placeholders})
+            ''', chunk)
+            for photo_url, variant, fmt, url in cursor.fetchall():
+                result.setdefault(photo_url, {}).setdefault(variant, {})[fmt] = url
+        return result
+    
+    def get_photo_urls_with_variants(self):
+        """获取已生成版本的照片URL集合"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT DISTINCT photo_url FROM photo_variants')
+        return {row[0] for row in cursor.fetchall()}
+    
     def get_memorial_views(self, memorial_id: str):
         """获取纪念馆访问次数"""
         cursor = self.conn.cursor()
@@ -1387,55 +2224,256 @@ class Database:
         result = cursor.fetchone()
         return result[0] if result else 0
     
-    def increment_memorial_views(self, memorial_id: str):
-        """增加纪念馆访问次数"""
+    # AI信件任务相关方法
+    def create_letter_job(self, memorial_id: str, payload: str) -> str:
+        """创建AI信件生成任务"""
         cursor = self.conn.cursor()
         
-        try:
-            # 尝试更新现有记录
-            cursor.execute('''
-            UPDATE memorial_stats 
-            SET views = views + 1 
-            WHERE memorial_id = ?
-            ''', (memorial_id,))
-            
-            # 如果没有记录，则插入新记录
-            if cursor.rowcount == 0:
-                cursor.execute('''
-                INSERT INTO memorial_stats (memorial_id, views, likes, created_at)
-                VALUES (?, 1, 0, CURRENT_TIMESTAMP)
-                ''', (memorial_id,))
-            
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"增加访问次数失败: {e}")
-            return False
+        import uuid
+        job_id = uuid.uuid4().hex
+        
+        cursor.execute('''
+        INSERT INTO letter_jobs (id, memorial_id, payload)
+        VALUES (?, ?, ?)
+        ''', (job_id, memorial_id, payload))
+        
+        self.conn.commit()
+        return job_id
     
-    def increment_memorial_likes(self, memorial_id: str):
-        """增加纪念馆点赞次数"""
+    def claim_letter_job(self, job_id: str):
+        """领取待处理的任务（pending -> running），已被其他进程领取时返回None"""
         cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE letter_jobs 
+        SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'pending'
+        ''', (job_id,))
+        self.conn.commit()
         
-        try:
-            # 尝试更新现有记录
+        if cursor.rowcount == 0:
+            return None
+        return self.get_letter_job(job_id)
+    
+    def get_letter_job(self, job_id: str):
+        """获取任务详情"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT id, memorial_id, status, payload, attempts, last_error, created_at, updated_at
+        FROM letter_jobs WHERE id = ?
+        ''', (job_id,))
+        
+        result = cursor.fetchone()
+        if result:
+            return {
+                'id': result[0],
+                'memorial_id': result[1],
+                'status': result[2],
+                'payload': result[3],
+                'attempts': result[4],
+                'last_error': result[5],
+                'created_at': result[6],
+                'updated_at': result[7]
+            }
+        return None
+    
+    def get_latest_letter_job(self, memorial_id: str):
+        """获取纪念馆最近一次AI信件任务"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT id FROM letter_jobs 
+        WHERE memorial_id = ?
+        ORDER BY created_at DESC
+        LIMIT 1
+        ''', (memorial_id,))
+        
+        result = cursor.fetchone()
+        return self.get_letter_job(result[0]) if result else None
+    
+    def update_letter_job_status(self, job_id: str, status: str, last_error: str = None):
+        """更新任务状态"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE letter_jobs 
+        SET status = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (status, last_error, job_id))
+        self.conn.commit()
+    
+    def get_pending_letter_job_ids(self, stale_seconds: int = 600):
+        """获取待处理任务ID，并把超时未完成的running任务重置为pending"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE letter_jobs 
+        SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND updated_at < datetime('now', ?)
+        ''', (f"-{int(stale_seconds)} seconds",))
+        self.conn.commit()
+        
+        cursor.execute('''
+        SELECT id FROM letter_jobs WHERE status = 'pending' ORDER BY created_at
+        ''')
+        return [row[0] for row in cursor.fetchall()]
+    
+    # 邮件队列相关方法
+    def enqueue_mail(self, to_email: str, subject: str, html_content: str, text_content: str = None) -> int:
+        """邮件加入发送队列"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        INSERT INTO mail_queue (to_email, subject, html_content, text_content)
+        VALUES (?, ?, ?, ?)
+        ''', (to_email, subject, html_content, text_content))
+        self.conn.commit()
+        return cursor.lastrowid
+    
+    def claim_mail_batch(self, limit: int = 20):
+        """领取一批到期的待发送邮件（pending -> sending）"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT id FROM mail_queue 
+        WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+        ORDER BY id
+        LIMIT ?
+        ''', (limit,))
+        candidate_ids = [row[0] for row in cursor.fetchall()]
+        
+        claimed_ids = []
+        for mail_id in candidate_ids:
             cursor.execute('''
-            UPDATE memorial_stats 
-            SET likes = likes + 1 
-            WHERE memorial_id = ?
-            ''', (memorial_id,))
-            
-            # 如果没有记录，则插入新记录
-            if cursor.rowcount == 0:
-                cursor.execute('''
-                INSERT INTO memorial_stats (memorial_id, views, likes, created_at)
-                VALUES (?, 0, 1, CURRENT_TIMESTAMP)
-                ''', (memorial_id,))
-            
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"增加点赞次数失败: {e}")
-            return False
+            UPDATE mail_queue 
+            SET status = 'sending', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+            ''', (mail_id,))
+            if cursor.rowcount > 0:
+                claimed_ids.append(mail_id)
+        self.conn.commit()
+        
+        if not claimed_ids:
+            return []
+        
+        placeholders = ','.join('?' * len(claimed_ids))
+        cursor.execute(f'''
+        SELECT id, to_email, subject, html_content, text_content, attempts
+        FROM mail_queue WHERE id IN ({placeholders})
+        ORDER BY id
+        ''', claimed_ids)
+        
+        mails = []
+        for row in cursor.fetchall():
+            mails.append({
+                'id': row[0],
+                'to_email': row[1],
+                'subject': row[2],
+                'html_content': row[3],
+                'text_content': row[4],
+                'attempts': row[5]
+            })
+        return mails
+    
+    def mark_mail_sent(self, mail_id: int):
+        """标记邮件已发送"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE mail_queue 
+        SET status = 'sent', last_error = NULL, sent_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (mail_id,))
+        self.conn.commit()
+    
+    def mark_mail_retry(self, mail_id: int, delay_seconds: float, last_error: str = None):
+        """邮件发送失败，延迟后重试"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE mail_queue 
+        SET status = 'pending', last_error = ?, 
+            next_attempt_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (last_error, f"+{int(delay_seconds)} seconds", mail_id))
+        self.conn.commit()
+    
+    def mark_mail_failed(self, mail_id: int, last_error: str = None):
+        """邮件发送失败，不再重试"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE mail_queue 
+        SET status = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (last_error, mail_id))
+        self.conn.commit()
+    
+    def reset_stale_mail(self, stale_seconds: int = 600):
+        """把进程异常退出时遗留的sending邮件重置为pending"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE mail_queue 
+        SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'sending' AND updated_at < datetime('now', ?)
+        ''', (f"-{int(stale_seconds)} seconds",))
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def get_mail_queue_stats(self):
+        """按状态统计邮件队列"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        SELECT status, COUNT(*) FROM mail_queue GROUP BY status
+        ''')
+        stats = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        for status, count in cursor.fetchall():
+            stats[status] = count
+        return stats
+    
+    # 可按 expires_at 清理的表
+    EXPIRING_TABLES = ('user_sessions', 'email_codes', 'password_reset_tokens', 'password_resets')
+    
+    def delete_expired_rows(self, table: str, batch_size: int = 500, grace_seconds: int = 0):
+        """删除一批已过期的记录，返回删除的行数（每批单独提交，避免长时间占用写锁）"""
+        if table not in self.EXPIRING_TABLES:
+            raise ValueError(f"不支持清理的表: {table}")
+        cursor = self.conn.cursor()
+        token_column = ', session_token' if table == 'user_sessions' else ''
+        cursor.execute(f'''
+        SELECT id{token_column} FROM {table}
+        WHERE expires_at < datetime('now', ?)
+        LIMIT ?
+        ''', (f'-{int(grace_seconds)} seconds', batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+        
+        cursor.executemany(f'DELETE FROM {table} WHERE id = ?', [(row[0],) for row in rows])
+        self.conn.commit()
+        if token_column:
+            for row in rows:
+                self._notify_user_changed(session_token=row[1])
+        return len(rows)
+    
+    def expire_stale_payment_orders(self, batch_size: int = 500, grace_seconds: int = 0):
+        """把超过支付期限仍未支付的订单标记为expired，返回更新的行数"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        UPDATE payment_orders
+        SET payment_status = 'expired', updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM payment_orders
+            WHERE payment_status = 'pending' AND expires_at < datetime('now', ?)
+            LIMIT ?
+        )
+        ''', (f'-{int(grace_seconds)} seconds', batch_size))
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def optimize_database(self, vacuum_pages: int = 1000):
+        """更新查询规划器统计信息，并增量回收空闲页，返回回收的页数"""
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA optimize")
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # executescript 会把语句执行完，execute 每次只回收一页
+            self.conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+        after = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
     
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self.pool.close_all()
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+数据库定期维护
+分批删除过期的会话、验证码和密码重置令牌，把超时未支付的订单标记为expired，
+最后执行 PRAGMA optimize 和增量空间回收
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class DatabaseReaper:
+    """过期数据清理任务"""
+
+    def __init__(self, db, interval: float = None, batch_size: int = None,
+                 max_batches: int = None, grace_seconds: int = None, vacuum_pages: int = None):
+        self.db = db
+        self.interval = interval or float(os.getenv('DB_MAINTENANCE_INTERVAL', '3600'))
+        self.batch_size = batch_size or int(os.getenv('DB_MAINTENANCE_BATCH_SIZE', '500'))
+        # 单次运行每张表最多处理的批数，剩余的下次继续
+        self.max_batches = max_batches or int(os.getenv('DB_MAINTENANCE_MAX_BATCHES', '200'))
+        self.grace_seconds = grace_seconds if grace_seconds is not None else int(os.getenv('DB_EXPIRED_GRACE', '3600'))
+        self.vacuum_pages = vacuum_pages or int(os.getenv('DB_INCREMENTAL_VACUUM_PAGES', '1000'))
+
+        self._worker = None
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.totals: Dict[str, int] = {}
+
+    async def start(self):
+        """启动定时维护协程"""
+        if self._worker:
+            return
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止维护协程"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                print(f"❌ 数据库维护失败: {e}")
+
+    def _drain(self, step) -> int:
+        """重复执行 step 直到没有可处理的行或达到批数上限"""
+        total = 0
+        for _ in range(self.max_batches):
+            count = step()
+            total += count
+            if count < self.batch_size:
+                break
+            # 批次之间让出写锁
+            time.sleep(0.01)
+        return total
+
+    def run_once(self) -> Dict[str, Any]:
+        """执行一次维护，返回各表处理的行数"""
+        started = time.monotonic()
+        stats: Dict[str, Any] = {}
+        for table in self.db.EXPIRING_TABLES:
+            stats[table] = self._drain(
+                lambda table=table: self.db.delete_expired_rows(table, self.batch_size, self.grace_seconds)
+            )
+        stats["expired_orders"] = self._drain(
+            lambda: self.db.expire_stale_payment_orders(self.batch_size, self.grace_seconds)
+        )
+        stats["vacuumed_pages"] = self.db.optimize_database(self.vacuum_pages)
+
+        for key, value in stats.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        self.last_run = stats
+
+        reclaimed = sum(stats[table] for table in self.db.EXPIRING_TABLES)
+        if reclaimed or stats["expired_orders"]:
+            print(f"🧹 数据库维护: 删除 {reclaimed} 条过期记录，{stats['expired_orders']} 个订单已过期")
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取维护统计信息"""
+        return {
+            "interval": self.interval,
+            "batch_size": self.batch_size,
+            "last_run": self.last_run,
+            "totals": self.totals
+        }
@@ -0,0 +1,187 @@
+"""
+对外HTTP请求客户端
+DeepSeek、微信支付、支付宝等外部接口共用，按目标站点（scheme://host:port）
+各自维护一个长连接池，统一设置超时、连接数上限和失败重试策略
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+# 服务端暂时不可用时值得重试的状态码
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# 请求尚未发出的错误，任何方法都可以安全重试
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class HttpClient:
+    """共享HTTP客户端"""
+
+    def __init__(self, timeout: float = None, connect_timeout: float = None,
+                 max_connections_per_host: int = None, max_keepalive_per_host: int = None,
+                 keepalive_expiry: float = None, max_retries: int = None,
+                 retry_backoff: float = None, transport=None):
+        self.timeout = httpx.Timeout(
+            timeout or float(os.getenv('HTTP_TIMEOUT', '30')),
+            connect=connect_timeout or float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections_per_host or int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', '10')),
+            max_keepalive_connections=max_keepalive_per_host or int(os.getenv('HTTP_MAX_KEEPALIVE_PER_HOST', '5')),
+            keepalive_expiry=keepalive_expiry or float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('HTTP_MAX_RETRIES', '2'))
+        self.retry_backoff = retry_backoff or float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+        # 测试时可传入 httpx.MockTransport 等自定义传输层
+        self.transport = transport
+
+        self._lock = threading.Lock()
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._sync_clients: Dict[str, httpx.Client] = {}
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _async_client(self, url: str) -> httpx.AsyncClient:
+        origin = self._origin(url)
+        client = self._async_clients.get(origin)
+        if client is None:
+            with self._lock:
+                client = self._async_clients.get(origin)
+                if client is None:
+                    client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, transport=self.transport)
+                    self._async_clients[origin] = client
+        return client
+
+    def _sync_client(self, url: str) -> httpx.Client:
+        origin = self._origin(url)
+        client = self._sync_clients.get(origin)
+        if client is None:
+            with self._lock:
+                client = self._sync_clients.get(origin)
+                if client is None:
+                    client = httpx.Client(timeout=self.timeout, limits=self.limits, transport=self.transport)
+                    self._sync_clients[origin] = client
+        return client
+
+    def _should_retry(self, method: str, attempt: int, retries: int, retry_unsafe: bool,
+                      error: Optional[Exception] = None, response: Optional[httpx.Response] = None) -> bool:
+        if attempt >= retries:
+            return False
+        safe = method.upper() in IDEMPOTENT_METHODS or retry_unsafe
+        if error is not None:
+            # 非幂等请求只在请求确定没有发出时重试
+            return safe or isinstance(error, CONNECT_ERRORS)
+        return safe and response is not None and response.status_code in RETRY_STATUS_CODES
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30.0)
+        return self.retry_backoff * (2 ** attempt) + random.uniform(0, self.retry_backoff)
+
+    async def request(self, method: str, url: str, retries: int = None,
+                      retry_unsafe: bool = False, **kwargs) -> httpx.Response:
+        """
+        发送请求并返回响应，不检查状态码
+        retries 为最多重试次数；POST 等非幂等请求默认只在连接失败时重试，retry_unsafe=True 时与 GET 相同
+        """
+        retries = self.max_retries if retries is None else retries
+        client = self._async_client(url)
+        attempt = 0
+        while True:
+            self.request_count += 1
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if not self._should_retry(method, attempt, retries, retry_unsafe, error=e):
+                    self.error_count += 1
+                    raise
+                delay = self._retry_delay(attempt)
+            else:
+                if not self._should_retry(method, attempt, retries, retry_unsafe, response=response):
+                    return response
+                delay = self._retry_delay(attempt, response)
+                await response.aclose()
+            attempt += 1
+            self.retry_count += 1
+            await asyncio.sleep(delay)
+
+    def request_sync(self, method: str, url: str, retries: int = None,
+                     retry_unsafe: bool = False, **kwargs) -> httpx.Response:
+        """同步版本，供运行在线程中的同步代码使用，参数与 request 相同"""
+        retries = self.max_retries if retries is None else retries
+        client = self._sync_client(url)
+        attempt = 0
+        while True:
+            self.request_count += 1
+            try:
+                response = client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if not self._should_retry(method, attempt, retries, retry_unsafe, error=e):
+                    self.error_count += 1
+                    raise
+                delay = self._retry_delay(attempt)
+            else:
+                if not self._should_retry(method, attempt, retries, retry_unsafe, response=response):
+                    return response
+                delay = self._retry_delay(attempt, response)
+                response.close()
+            attempt += 1
+            self.retry_count += 1
+            time.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            async_clients, self._async_clients = list(self._async_clients.values()), {}
+            sync_clients, self._sync_clients = list(self._sync_clients.values()), {}
+        for client in async_clients:
+            await client.aclose()
+        for client in sync_clients:
+            client.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取请求统计信息"""
+        return {
+            "hosts": len(set(self._async_clients) | set(self._sync_clients)),
+            "requests": self.request_count,
+            "retries": self.retry_count,
+            "errors": self.error_count
+        }
+
+
+# 进程内共享的默认客户端
+_shared_client: Optional[HttpClient] = None
+_shared_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """获取共享的HTTP客户端"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_lock:
+            if _shared_client is None:
+                _shared_client = HttpClient()
+    return _shared_client
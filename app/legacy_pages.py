@@ -0,0 +1,36 @@
+"""
+早期版本的纪念馆页面
+早期页面的照片墙直接使用原图<img>（没有<picture>），创建时上传的照片只记录在页面中，
+运行 migrate_memorial_tables.py 回填到 memorial_photos 之前，重新生成页面和下载包都要参考页面中的照片
+"""
+import html
+import os
+import re
+from typing import List
+
+MEMORIALS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "memorials")
+
+# 早期页面照片墙中的原图<img>
+LEGACY_GALLERY_PATTERN = re.compile(r'<div class="photo-item">\s*<img[^>]*?\ssrc="([^"]+)"')
+
+
+def legacy_page_photos(memorial_id: str, memorials_dir: str = MEMORIALS_DIR) -> List[str]:
+    """
+    早期版本页面照片墙中的照片URL（按页面顺序），只包含文件仍然存在的照片
+    页面不存在或不是早期版本时返回空列表
+    """
+    path = os.path.join(memorials_dir, f"{memorial_id}.html")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            page_html = f.read()
+    except FileNotFoundError:
+        return []
+    photos_dir = os.path.join(os.path.dirname(memorials_dir), "photos")
+    photos = []
+    for src in LEGACY_GALLERY_PATTERN.findall(page_html):
+        url = html.unescape(src)
+        if not url.startswith("/storage/photos/") or url in photos:
+            continue
+        if os.path.exists(os.path.join(photos_dir, url[len("/storage/photos/"):])):
+            photos.append(url)
+    return photos
@@ -0,0 +1,128 @@
+"""
+AI信件后台任务
+纪念馆创建时先使用模板信件，AI信件在后台异步生成，
+完成后写回数据库并重新生成纪念馆页面
+"""
+import asyncio
+import json
+import os
+import random
+from typing import Any, Dict, Optional
+
+
+class LetterJobQueue:
+    """AI信件生成任务队列（有并发上限，失败按指数退避重试）"""
+
+    def __init__(self, db, memorial_service, concurrency: int = None,
+                 max_attempts: int = None, retry_base_delay: float = None):
+        self.db = db
+        self.memorial_service = memorial_service
+        self.concurrency = concurrency or int(os.getenv('LETTER_JOB_CONCURRENCY', '2'))
+        self.max_attempts = max_attempts or int(os.getenv('LETTER_JOB_MAX_ATTEMPTS', '3'))
+        self.retry_base_delay = retry_base_delay or float(os.getenv('LETTER_JOB_RETRY_BASE', '5'))
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+
+    async def start(self):
+        """启动工作协程，并恢复上次未完成的任务"""
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+        pending_ids = await asyncio.to_thread(self.db.get_pending_letter_job_ids)
+        for job_id in pending_ids:
+            self._queue.put_nowait(job_id)
+        if pending_ids:
+            print(f"📝 恢复 {len(pending_ids)} 个未完成的AI信件任务")
+
+    async def stop(self):
+        """停止工作协程，未完成的任务保留为pending，下次启动时恢复"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enqueue(self, memorial_id: str, pet_info: Dict, personality_type: str,
+                answers: Dict, photos: list) -> str:
+        """提交AI信件任务，返回任务ID"""
+        payload = json.dumps({
+            "pet_info": pet_info,
+            "personality_type": personality_type,
+            "answers": answers,
+            "photos": photos
+        }, ensure_ascii=False)
+        job_id = self.db.create_letter_job(memorial_id, payload)
+        self._submit(job_id)
+        return job_id
+
+    def _submit(self, job_id: str, delay: float = 0):
+        """把任务放入队列，可在任意线程调用"""
+        if self._loop is None or self._queue is None:
+            # 队列尚未启动，任务保留在数据库中，启动时恢复
+            return
+        if delay > 0:
+            self._loop.call_soon_threadsafe(self._loop.call_later, delay, self._queue.put_nowait, job_id)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                print(f"❌ AI信件任务异常 {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str):
+        # 数据库读写都放到线程中执行，不阻塞事件循环
+        job = await asyncio.to_thread(self.db.claim_letter_job, job_id)
+        if not job:
+            return
+
+        payload = json.loads(job["payload"])
+        pet_info = payload["pet_info"]
+        personality_type = payload["personality_type"]
+
+        try:
+            ai_letter = await self.memorial_service.personality_service.request_ai_letter(
+                pet_info, personality_type, payload.get("answers") or {}
+            )
+        except Exception as e:
+            if job["attempts"] >= self.max_attempts:
+                print(f"❌ AI信件生成失败，已放弃 {job_id}: {e}")
+                await asyncio.to_thread(self.db.update_letter_job_status, job_id, "failed", str(e))
+                return
+            delay = self.retry_base_delay * (2 ** (job["attempts"] - 1))
+            delay += random.uniform(0, self.retry_base_delay)
+            print(f"⚠️ AI信件生成失败，{delay:.1f}秒后重试 {job_id}: {e}")
+            await asyncio.to_thread(self.db.update_letter_job_status, job_id, "pending", str(e))
+            self._submit(job_id, delay)
+            return
+
+        memorial_id = job["memorial_id"]
+        await asyncio.to_thread(self.db.update_memorial_ai_letter, memorial_id, ai_letter)
+        # 按数据库中的最新数据生成页面，不会覆盖期间的编辑
+        await asyncio.to_thread(self.memorial_service.rerender_memorial, memorial_id)
+        await asyncio.to_thread(self.db.update_letter_job_status, job_id, "done")
+        print(f"✅ AI信件已生成: {memorial_id}")
+
+    def get_status(self, memorial_id: str) -> Optional[Dict[str, Any]]:
+        """获取纪念馆AI信件的生成状态"""
+        job = self.db.get_latest_letter_job(memorial_id)
+        if not job:
+            return None
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "last_error": job["last_error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"]
+        }
@@ -0,0 +1,206 @@
+"""
+邮件发送队列
+HTTP接口只负责把邮件写入 mail_queue 表，后台协程批量取出，
+通过长连接的SMTP会话发送，失败按指数退避重试
+"""
+import asyncio
+import os
+import smtplib
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Dict, Optional
+
+
+class SMTPSender:
+    """保持登录状态的SMTP长连接，断开后自动重连"""
+
+    def __init__(self, smtp_server: str, smtp_port: int, sender_email: str,
+                 sender_password: str = None, security: str = None,
+                 timeout: float = 30, keepalive: float = 60):
+        self.smtp_server = smtp_server
+        self.smtp_port = int(smtp_port)
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        # 'starttls' | 'ssl' | 'none'，默认根据端口判断
+        if security is None:
+            security = os.getenv('SMTP_SECURITY') or {587: 'starttls', 465: 'ssl'}.get(self.smtp_port, 'none')
+        self.security = security
+        self.timeout = timeout
+        self.keepalive = keepalive
+
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connect_count = 0
+
+    def _connect(self):
+        print(f"📧 建立SMTP连接: {self.smtp_server}:{self.smtp_port} ({self.security})")
+        if self.security == 'ssl':
+            server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port, timeout=self.timeout,
+                                      context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+            if self.security == 'starttls':
+                server.starttls(context=ssl.create_default_context())
+        if self.sender_password:
+            server.login(self.sender_email, self.sender_password)
+        self._server = server
+        self.connect_count += 1
+
+    def _ensure_connected(self):
+        if self._server is None:
+            self._connect()
+            return
+
+        # 空闲较久的连接可能已被服务器关闭，先探测一下
+        if time.monotonic() - self._last_used > self.keepalive:
+            try:
+                status = self._server.noop()[0]
+            except smtplib.SMTPException:
+                status = -1
+            except OSError:
+                status = -1
+            if status != 250:
+                self.close()
+                self._connect()
+
+    def send(self, to_email: str, message: str):
+        """发送一封邮件，连接断开时重连一次"""
+        self._ensure_connected()
+        try:
+            self._server.sendmail(self.sender_email, [to_email], message)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connect()
+            self._server.sendmail(self.sender_email, [to_email], message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        """关闭连接"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            try:
+                self._server.close()
+            except Exception:
+                pass
+        self._server = None
+
+
+class MailDispatcher:
+    """基于SQLite的持久化邮件队列"""
+
+    def __init__(self, db, sender: SMTPSender, batch_size: int = None,
+                 rate_per_second: float = None, max_attempts: int = None,
+                 retry_base_delay: float = None, poll_interval: float = 5):
+        self.db = db
+        self.sender = sender
+        self.batch_size = batch_size or int(os.getenv('MAIL_BATCH_SIZE', '20'))
+        self.rate_per_second = rate_per_second or float(os.getenv('MAIL_RATE_PER_SECOND', '5'))
+        self.max_attempts = max_attempts or int(os.getenv('MAIL_MAX_ATTEMPTS', '5'))
+        self.retry_base_delay = retry_base_delay or float(os.getenv('MAIL_RETRY_BASE', '30'))
+        self.poll_interval = poll_interval
+
+        # SMTP会话只在这个线程中使用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mail-sender")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker = None
+        self._last_send = 0.0
+
+    async def start(self):
+        """启动发送协程"""
+        if self._worker:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.db.reset_stale_mail()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止发送协程并关闭SMTP连接"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.sender.close)
+
+    def enqueue(self, to_email: str, subject: str, html_content: str, text_content: str = None) -> int:
+        """把邮件写入发送队列，可在任意线程调用"""
+        mail_id = self.db.enqueue_mail(to_email, subject, html_content, text_content)
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return mail_id
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await asyncio.to_thread(self.db.claim_mail_batch, self.batch_size)
+                if not batch:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                results = await self._loop.run_in_executor(self._executor, self._send_batch, batch)
+                await asyncio.to_thread(self._record_results, batch, results)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ 邮件队列处理异常: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _send_batch(self, batch):
+        """在发送线程中依次发送一批邮件，按速率限制间隔"""
+        results = []
+        min_interval = 1.0 / self.rate_per_second if self.rate_per_second > 0 else 0
+        for mail in batch:
+            wait = self._last_send + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.sender.send(mail["to_email"], self._build_message(mail))
+                results.append((True, None, False))
+            except smtplib.SMTPRecipientsRefused as e:
+                # 收件人地址无效，重试没有意义
+                results.append((False, f"收件人地址被拒绝: {e}", True))
+            except Exception as e:
+                self.sender.close()
+                results.append((False, f"{type(e).__name__}: {e}", False))
+            self._last_send = time.monotonic()
+        return results
+
+    def _record_results(self, batch, results):
+        for mail, (success, error, permanent) in zip(batch, results):
+            if success:
+                self.db.mark_mail_sent(mail["id"])
+            elif permanent or mail["attempts"] >= self.max_attempts:
+                print(f"❌ 邮件发送失败，已放弃: {mail['to_email']} - {error}")
+                self.db.mark_mail_failed(mail["id"], error)
+            else:
+                delay = self.retry_base_delay * (2 ** (mail["attempts"] - 1))
+                print(f"⚠️ 邮件发送失败，{delay:.0f}秒后重试: {mail['to_email']} - {error}")
+                self.db.mark_mail_retry(mail["id"], delay, error)
+
+    def _build_message(self, mail: Dict[str, Any]) -> str:
+        message = MIMEMultipart('alternative')
+        message['From'] = self.sender.sender_email
+        message['To'] = mail["to_email"]
+        message['Subject'] = Header(mail["subject"], 'utf-8')
+        if mail.get("text_content"):
+            message.attach(MIMEText(mail["text_content"], 'plain', 'utf-8'))
+        message.attach(MIMEText(mail["html_content"], 'html', 'utf-8'))
+        return message.as_string()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        stats = self.db.get_mail_queue_stats()
+        stats["smtp_connects"] = self.sender.connect_count
+        return stats
@@ -7,6 +7,20 @@ from database import Database
 from services import MemorialService, EmailService
 from auth_service import AuthService
 from payment_service import PaymentService
+from page_cache import MemorialPageCache, StaticPageRegistry
+from static_assets import StaticAssets
+from template_env import get_template_env, precompile_templates
+from letter_jobs import LetterJobQueue
+from mail_dispatcher import MailDispatcher, SMTPSender
+from uploads import PhotoUploader
+from photo_variants import PhotoVariantGenerator
+from photo_sweeper import PhotoSweeper
+from stats_buffer import StatsBuffer, VisitStatsCompactor
+from db_maintenance import DatabaseReaper
+from async_db import AsyncDatabase
+from rerender_queue import MemorialRerenderQueue
+from http_client import get_http_client
+from pagination import DEFAULT_PAGE_SIZE, clamp_limit, decode_cursor, paginate
 import os
 import uuid
 import uvicorn
@@ -22,7 +36,19 @@ async def health_check():
     return {
         "status": "healthy",
         "message": "服务器运行正常",
-        "timestamp": "2025-09-18T13:36:23Z"
+        "timestamp": "2025-09-18T13:36:23Z",
+        "session_cache": auth_service.get_session_cache_stats(),
+        "memorial_page_cache": page_cache.get_stats(),
+        "static_pages": static_pages.get_stats(),
+        "static_assets": static_assets.get_stats(),
+        "memorial_export": memorial_service.exporter.get_stats(),
+        "memorial_rerender": rerender_queue.get_stats(),
+        "mail_queue": mail_dispatcher.get_stats(),
+        "photo_sweeper": photo_sweeper.get_stats(),
+        "stats_buffer": stats_buffer.get_stats(),
+        "db_maintenance": db_reaper.get_stats(),
+        "db_executor": async_db.get_stats(),
+        "http_client": http_client.get_stats()
     }
 
 # 添加session_token中间件
@@ -48,15 +74,80 @@ if os.path.exists(storage_path):
 else:
     print(f"❌ 静态文件目录不存在: {storage_path}")
 
-# 初始化模板
+# 初始化模板：与纪念馆页面生成共用同一个带字节码缓存的 Environment
+template_env = get_template_env()
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
+template_env.globals.setdefault("url_for", templates.env.globals["url_for"])
+templates.env = template_env
 
 # 初始化服务
 db = Database()
-memorial_service = MemorialService(db)
+async_db = AsyncDatabase(db)
+http_client = get_http_client()
+page_cache = MemorialPageCache(os.path.join(storage_path, "memorials"))
+static_pages = StaticPageRegistry(os.path.join(os.path.dirname(__file__), "templates"))
+static_pages.load([
+    "index.html", "login.html", "register.html", "dashboard.html", "personality_test.html",
+    "theme_selector.html", "reminder_setup.html", "forgot_password.html", "email_config.html",
+    "test_photo.html", "payment.html", "memorials.html", "memorial_edit.html", "orders.html",
+    "photo_manager.html"
+])
+# 纪念馆页面共用的CSS/JS，按内容生成带指纹的文件
+static_assets = StaticAssets()
+static_assets.build()
+memorial_service = MemorialService(db, page_cache=page_cache, assets=static_assets, env=template_env)
+letter_jobs = LetterJobQueue(db, memorial_service)
+memorial_service.letter_jobs = letter_jobs
+rerender_queue = MemorialRerenderQueue(memorial_service)
 email_service = EmailService()
+mail_dispatcher = MailDispatcher(db, SMTPSender(
+    email_service.smtp_server,
+    email_service.smtp_port,
+    email_service.sender_email,
+    email_service.sender_password
+))
+email_service.dispatcher = mail_dispatcher
 auth_service = AuthService(db)
-payment_service = PaymentService()
+photo_uploader = PhotoUploader(os.path.join(storage_path, "photos"), db=db)
+photo_variants = PhotoVariantGenerator(db, os.path.join(storage_path, "photos"))
+photo_variants.rerender_queue = rerender_queue
+photo_sweeper = PhotoSweeper(db, os.path.join(storage_path, "photos"))
+stats_buffer = StatsBuffer(db)
+visit_compactor = VisitStatsCompactor(db)
+db_reaper = DatabaseReaper(db)
+payment_service = PaymentService(http_client)
+
+@app.on_event("startup")
+async def start_background_jobs():
+    """启动后台任务"""
+    # 部署后第一次创建纪念馆不再等待模板编译
+    precompile_templates(template_env)
+    await letter_jobs.start()
+    await mail_dispatcher.start()
+    await photo_sweeper.start()
+    await stats_buffer.start()
+    await visit_compactor.start()
+    await db_reaper.start()
+    await static_pages.start()
+    await rerender_queue.start()
+    payment_service.preload_keys()
+
+@app.on_event("shutdown")
+async def close_database():
+    """停止后台任务并关闭所有数据库连接"""
+    await letter_jobs.stop()
+    await mail_dispatcher.stop()
+    await photo_sweeper.stop()
+    await visit_compactor.stop()
+    await db_reaper.stop()
+    await static_pages.stop()
+    await rerender_queue.stop()
+    await stats_buffer.stop()
+    await photo_variants.stop()
+    await http_client.close()
+    payment_service.close()
+    async_db.close()
+    db.close()
 
 # 依赖函数：获取当前用户
 async def get_current_user(authorization: Optional[str] = Header(None)):
@@ -64,7 +155,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="未提供有效的认证令牌")
     
     session_token = authorization.replace("Bearer ", "")
-    user = auth_service.get_current_user(session_token)
+    user = await async_db.run(auth_service.get_current_user, session_token)
     
     if not user:
         raise HTTPException(status_code=401, detail="认证令牌无效或已过期")
@@ -72,82 +163,39 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     return user
 
 @app.get("/", response_class=HTMLResponse)
-async def index():
+async def index(request: Request):
     """首页"""
-    try:
-        # 使用绝对路径读取模板文件
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "index.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("index.html", request.headers)
 
 @app.get("/login", response_class=HTMLResponse)
-async def login_page():
+async def login_page(request: Request):
     """登录页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "login.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("login.html", request.headers)
 
 @app.get("/register", response_class=HTMLResponse)
-async def register_page():
+async def register_page(request: Request):
     """注册页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "register.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("register.html", request.headers)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard_page():
+async def dashboard_page(request: Request):
     """用户中心页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "dashboard.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("dashboard.html", request.headers)
 
 @app.get("/personality-test", response_class=HTMLResponse)
-async def personality_test_page():
+async def personality_test_page(request: Request):
     """性格测试页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "personality_test.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("personality_test.html", request.headers)
 
 @app.get("/theme-selector", response_class=HTMLResponse)
-async def theme_selector_page():
+async def theme_selector_page(request: Request):
     """主题选择页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "theme_selector.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("theme_selector.html", request.headers)
 
 @app.get("/reminder-setup", response_class=HTMLResponse)
-async def reminder_setup_page():
+async def reminder_setup_page(request: Request):
     """纪念日提醒设置页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "reminder_setup.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("reminder_setup.html", request.headers)
 
 # 认证相关API
 @app.post("/api/auth/register")
@@ -158,7 +206,7 @@ async def register_user(request: Request):
         email = data.get("email")
         password = data.get("password")
         
-        result = auth_service.register_user(email, password)
+        result = await async_db.run(auth_service.register_user, email, password)
         return JSONResponse(content=result)
     except Exception as e:
         return JSONResponse(
@@ -178,7 +226,7 @@ async def login_user(request: Request):
         client_ip = request.client.host if request.client else None
         user_agent = request.headers.get("user-agent")
         
-        result = auth_service.login_user(email, password, client_ip, user_agent)
+        result = await async_db.run(auth_service.login_user, email, password, client_ip, user_agent)
         return JSONResponse(content=result)
     except Exception as e:
         return JSONResponse(
@@ -194,7 +242,7 @@ async def logout_user(request: Request, current_user: dict = Depends(get_current
         authorization = request.headers.get("authorization")
         if authorization and authorization.startswith("Bearer "):
             session_token = authorization.replace("Bearer ", "")
-            result = auth_service.logout_user(session_token)
+            result = await async_db.run(auth_service.logout_user, session_token)
             return JSONResponse(content=result)
         else:
             return JSONResponse(content={"success": True, "message": "登出成功"})
@@ -209,7 +257,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """获取当前用户信息API"""
     try:
         # 获取用户仪表板数据
-        dashboard_data = auth_service.get_user_dashboard_data(current_user["id"])
+        dashboard_data = await async_db.run(auth_service.get_user_dashboard_data, current_user["id"])
         
         return JSONResponse(content={
             "success": True,
@@ -226,7 +274,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 async def check_can_create_memorial(current_user: dict = Depends(get_current_user)):
     """检查用户是否可以创建纪念馆"""
     try:
-        result = auth_service.can_create_memorial(current_user["id"])
+        result = await async_db.run(auth_service.can_create_memorial, current_user["id"])
         return JSONResponse(content=result)
     except Exception as e:
         return JSONResponse(
@@ -239,7 +287,7 @@ async def delete_memorial(memorial_id: str, current_user: dict = Depends(get_cur
     """删除纪念馆"""
     try:
         # 检查纪念馆是否属于当前用户
-        user_memorials = db.get_user_memorials(current_user["id"])
+        user_memorials = await async_db.get_user_memorials(current_user["id"])
         memorial_belongs_to_user = any(memorial[0] == memorial_id for memorial in user_memorials)
         
         if not memorial_belongs_to_user:
@@ -253,9 +301,10 @@ async def delete_memorial(memorial_id: str, current_user: dict = Depends(get_cur
         memorial_path = os.path.join(storage_base, "memorials", f"{memorial_id}.html")
         if os.path.exists(memorial_path):
             os.remove(memorial_path)
+        page_cache.invalidate(memorial_id)
         
         # 从数据库中删除纪念馆记录
-        if db.delete_memorial(memorial_id, current_user["id"]):
+        if await async_db.delete_memorial(memorial_id, current_user["id"]):
             return JSONResponse(content={"success": True, "message": "纪念馆删除成功"})
         else:
             return JSONResponse(
@@ -301,7 +350,7 @@ async def create_memorial_advanced(
     try:
         # 检查用户权限
         user_id = current_user["id"]
-        permission_check = auth_service.can_create_memorial(user_id)
+        permission_check = await async_db.run(auth_service.can_create_memorial, user_id)
         if not permission_check["can_create"]:
             return templates.TemplateResponse("error.html", {
                 "request": request,
@@ -311,7 +360,7 @@ async def create_memorial_advanced(
             })
         
         # 检查照片数量限制
-        level_info = database.get_user_level_info(current_user["user_level"])
+        level_info = await async_db.get_user_level_info(current_user["user_level"])
         if level_info and level_info[3] != -1:  # 如果不是无限照片
             max_photos = level_info[3]
             if len(photos) > max_photos:
@@ -328,15 +377,8 @@ async def create_memorial_advanced(
             personality_answers_dict = {}
         
         # 保存上传的图片
-        photo_paths = []
-        for photo in photos:
-            filename = f"{uuid.uuid4().hex}.jpg"
-            # 使用绝对路径保存照片
-            storage_base = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
-            path = os.path.join(storage_base, "photos", filename)
-            with open(path, "wb") as f:
-                f.write(await photo.read())
-            photo_paths.append(f"/storage/photos/{filename}")
+        photo_paths = await photo_uploader.save_photos(photos)
+        photo_variants.schedule(photo_paths)
         
         # 构建宠物信息
         pet_info = {
@@ -352,7 +394,8 @@ async def create_memorial_advanced(
         }
         
         # 创建纪念馆
-        memorial_url, personality_type, ai_letter = memorial_service.create_memorial_advanced(
+        memorial_url, personality_type, ai_letter = await async_db.run(
+            memorial_service.create_memorial_advanced,
             email=email,
             pet_info=pet_info,
             photos=photo_paths,
@@ -361,7 +404,8 @@ async def create_memorial_advanced(
         )
         
         # 发送通知邮件
-        email_service.send_creation_email(
+        await async_db.run(
+            email_service.send_creation_email,
             email=email, 
             pet_name=pet_name, 
             memorial_url=memorial_url,
@@ -369,36 +413,60 @@ async def create_memorial_advanced(
             ai_letter=ai_letter
         )
         
+        memorial_id = memorial_url.rsplit("/", 1)[-1]
         return {
             "success": True, 
             "memorial_url": memorial_url,
             "personality_type": personality_type,
-            "ai_letter": ai_letter
+            "ai_letter": ai_letter,
+            "ai_letter_status": "pending",
+            "ai_letter_status_url": f"/api/memorial/letter-status/{memorial_id}"
         }
     
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/api/memorial/letter-status/{memorial_id}")
+async def get_letter_status(memorial_id: str):
+    """查询AI信件生成状态"""
+    try:
+        status = await async_db.run(letter_jobs.get_status, memorial_id)
+        if not status:
+            return {"success": False, "message": "没有AI信件任务"}
+        
+        result = {"success": True, "job": status}
+        if status["status"] == "done":
+            memorial = await async_db.get_memorial_by_id(memorial_id)
+            result["ai_letter"] = memorial["ai_letter"] if memorial else None
+        return result
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 
 
 @app.get("/memorial/{memorial_id}", response_class=HTMLResponse)
-def view_memorial(memorial_id: str):
+def view_memorial(memorial_id: str, request: Request):
     """查看纪念馆页面"""
-    # 使用绝对路径读取纪念馆文件
-    storage_base = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
-    memorial_path = os.path.join(storage_base, "memorials", f"{memorial_id}.html")
-    if not os.path.exists(memorial_path):
+    # 优先从内存缓存读取，文件变化时自动重新加载
+    page = page_cache.get(memorial_id)
+    if page is None:
         return HTMLResponse(content="<h1>纪念馆不存在</h1>", status_code=404)
     
-    with open(memorial_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    return HTMLResponse(content=content)
+    return page_cache.build_response(page, request.headers)
+
+@app.get("/static/assets/{filename}")
+def static_asset(filename: str, request: Request):
+    """纪念馆页面的带指纹CSS/JS，内容不变可长期缓存"""
+    response = static_assets.response(filename, request.headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="资源不存在")
+    return response
 
 @app.get("/api/test-email")
 async def test_email(email: str):
     """测试邮件发送功能"""
     try:
-        success = email_service.send_test_email(email)
+        success = await async_db.run(email_service.send_test_email, email)
         if success:
             return {"success": True, "message": "测试邮件发送成功，请检查邮箱"}
         else:
@@ -419,15 +487,9 @@ async def get_email_config():
 
 # 密码找回相关API
 @app.get("/forgot-password", response_class=HTMLResponse)
-async def forgot_password_page():
+async def forgot_password_page(request: Request):
     """忘记密码页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "forgot_password.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("forgot_password.html", request.headers)
 
 @app.post("/api/auth/send-verification-code")
 async def send_verification_code(request: Request):
@@ -449,19 +511,19 @@ async def send_verification_code(request: Request):
             return {"success": False, "message": "邮箱格式不正确"}
         
         # 检查用户是否存在
-        if not db.user_exists(email):
+        if not await async_db.user_exists(email):
             print("❌ 用户不存在")
             return {"success": False, "message": "该邮箱未注册，请先注册账户"}
         
         print("✅ 用户存在，生成验证码")
         
         # 生成验证码
-        code = db.create_email_code(email, "password_reset")
+        code = await async_db.create_email_code(email, "password_reset")
         print(f"🔍 生成的验证码: {code}")
         
         # 发送验证码邮件
         print("📧 开始发送验证码邮件")
-        success = email_service.send_verification_code(email, code)
+        success = await async_db.run(email_service.send_verification_code, email, code)
         print(f"📧 邮件发送结果: {success}")
         
         if success:
@@ -492,11 +554,11 @@ async def reset_password(request: Request):
             return {"success": False, "message": "密码长度至少6位"}
         
         # 验证验证码
-        if not db.verify_email_code(email, verification_code, "password_reset"):
+        if not await async_db.verify_email_code(email, verification_code, "password_reset"):
             return {"success": False, "message": "验证码错误或已过期"}
         
         # 重置密码
-        success = db.reset_user_password(email, new_password)
+        success = await async_db.reset_user_password(email, new_password)
         
         if success:
             return {"success": True, "message": "密码重置成功"}
@@ -508,26 +570,14 @@ async def reset_password(request: Request):
         return {"success": False, "message": "密码重置失败，请稍后重试"}
 
 @app.get("/email-config", response_class=HTMLResponse)
-async def email_config_page():
+async def email_config_page(request: Request):
     """邮件配置页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "email_config.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("email_config.html", request.headers)
 
 @app.get("/test-photo", response_class=HTMLResponse)
-async def test_photo_page():
+async def test_photo_page(request: Request):
     """照片测试页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "test_photo.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("test_photo.html", request.headers)
 
 # 新增功能API端点
 @app.post("/api/message")
@@ -539,38 +589,41 @@ async def add_message(
     """添加访客留言"""
     try:
         # 通过纪念馆ID获取宠物ID
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]  # 第一列是id
-        db.save_message(pet_id, visitor_name, message)
+        await async_db.save_message(pet_id, visitor_name, message)
         
         return {"success": True, "message": "留言添加成功"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/api/messages/{memorial_id}")
-async def get_messages(memorial_id: str):
-    """获取纪念馆的所有留言"""
+async def get_messages(memorial_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None):
+    """获取纪念馆的留言（游标分页，next_cursor为空表示没有更多）"""
     try:
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]
-        messages = db.get_messages(pet_id)
+        limit = clamp_limit(limit)
+        rows = await async_db.get_messages(pet_id, limit=limit + 1, after=decode_cursor(cursor))
+        messages, next_cursor = paginate(rows, limit, sort_index=2, id_index=3)
         
         # 格式化留言数据
         formatted_messages = []
         for msg in messages:
             formatted_messages.append({
+                "id": msg[3],
                 "visitor_name": msg[0],
                 "message": msg[1],
                 "created_at": msg[2]
             })
         
-        return {"success": True, "messages": formatted_messages}
+        return {"success": True, "messages": formatted_messages, "next_cursor": next_cursor}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -584,27 +637,29 @@ async def add_reminder(
 ):
     """添加纪念日提醒"""
     try:
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]
-        db.save_reminder(pet_id, reminder_type, reminder_date, custom_name, custom_description)
+        await async_db.save_reminder(pet_id, reminder_type, reminder_date, custom_name, custom_description)
         
         return {"success": True, "message": "提醒添加成功"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/api/reminders/{memorial_id}")
-async def get_reminders(memorial_id: str):
-    """获取纪念馆的所有提醒"""
+async def get_reminders(memorial_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None):
+    """获取纪念馆的提醒（游标分页，next_cursor为空表示没有更多）"""
     try:
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]
-        reminders = db.get_reminders(pet_id)
+        limit = clamp_limit(limit)
+        rows = await async_db.get_reminders(pet_id, limit=limit + 1, after=decode_cursor(cursor))
+        reminders, next_cursor = paginate(rows, limit, sort_index=2, id_index=0)
         
         formatted_reminders = []
         for reminder in reminders:
@@ -617,7 +672,7 @@ async def get_reminders(memorial_id: str):
                 "is_active": reminder[5]
             })
         
-        return {"success": True, "reminders": formatted_reminders}
+        return {"success": True, "reminders": formatted_reminders, "next_cursor": next_cursor}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -625,7 +680,7 @@ async def get_reminders(memorial_id: str):
 async def delete_reminder(reminder_id: int):
     """删除指定的提醒"""
     try:
-        success = db.delete_reminder(reminder_id)
+        success = await async_db.delete_reminder(reminder_id)
         if success:
             return {"success": True, "message": "提醒删除成功"}
         else:
@@ -644,31 +699,34 @@ async def add_mood_diary(
 ):
     """添加心情日记"""
     try:
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]
-        db.save_mood_diary(pet_id, mood_type, mood_score, diary_content, weather)
+        await async_db.save_mood_diary(pet_id, mood_type, mood_score, diary_content, weather)
         
         return {"success": True, "message": "心情日记添加成功"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/api/mood-diaries/{memorial_id}")
-async def get_mood_diaries(memorial_id: str):
-    """获取纪念馆的心情日记"""
+async def get_mood_diaries(memorial_id: str, limit: int = 10, cursor: str = None):
+    """获取纪念馆的心情日记（游标分页，next_cursor为空表示没有更多）"""
     try:
-        pet_info = db.get_pet_by_memorial_id(memorial_id)
+        pet_info = await async_db.get_pet_by_memorial_id(memorial_id)
         if not pet_info:
             return {"success": False, "error": "纪念馆不存在"}
         
         pet_id = pet_info[0]
-        diaries = db.get_mood_diaries(pet_id)
+        limit = clamp_limit(limit, default=10)
+        rows = await async_db.get_mood_diaries(pet_id, limit=limit + 1, after=decode_cursor(cursor))
+        diaries, next_cursor = paginate(rows, limit, sort_index=4, id_index=5)
         
         formatted_diaries = []
         for diary in diaries:
             formatted_diaries.append({
+                "id": diary[5],
                 "mood_type": diary[0],
                 "mood_score": diary[1],
                 "diary_content": diary[2],
@@ -676,7 +734,7 @@ async def get_mood_diaries(memorial_id: str):
                 "created_at": diary[4]
             })
         
-        return {"success": True, "diaries": formatted_diaries}
+        return {"success": True, "diaries": formatted_diaries, "next_cursor": next_cursor}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -691,18 +749,19 @@ async def record_visit(
         client_ip = request.client.host if request else "unknown"
         user_agent = request.headers.get("user-agent", "unknown") if request else "unknown"
         
-        db.save_visit_stat(memorial_id, client_ip, user_agent)
+        # 写入缓冲，由后台批量落库
+        stats_buffer.record_visit(memorial_id, client_ip, user_agent)
         return {"success": True, "message": "访问记录成功"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/api/visit-stats/{memorial_id}")
-async def get_visit_stats(memorial_id: str):
-    """获取纪念馆访问统计"""
+async def get_visit_stats(memorial_id: str, days: int = 0):
+    """获取纪念馆访问统计（days>0 时附带最近days天的每日统计）"""
     try:
-        stats = db.get_visit_stats(memorial_id)
+        stats = await async_db.get_visit_stats(memorial_id)
         if stats:
-            return {
+            result = {
                 "success": True,
                 "stats": {
                     "total_visits": stats[0],
@@ -710,6 +769,9 @@ async def get_visit_stats(memorial_id: str):
                     "last_visit": stats[2]
                 }
             }
+            if days > 0:
+                result["daily"] = await async_db.get_visit_daily_stats(memorial_id, min(days, 366))
+            return result
         else:
             return {
                 "success": True,
@@ -730,13 +792,14 @@ async def get_user_permissions(session_token: str = Header(None, alias="x-sessio
     try:
         print(f"🔍 权限API - session_token: {session_token[:20] if session_token else 'None'}...")
         
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             print("❌ 权限API - 用户未登录")
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        dashboard_data = auth_service.get_user_dashboard_data(user_id)
+        result = await async_db.run(auth_service.get_user_permissions, user_id)
+        dashboard_data = result["dashboard"]
         
         if not dashboard_data["success"]:
             return dashboard_data
@@ -744,9 +807,7 @@ async def get_user_permissions(session_token: str = Header(None, alias="x-sessio
         return {
             "success": True,
             "permissions": {
-                "can_create_memorial": auth_service.can_create_memorial(user_id),
-                "can_use_ai": auth_service.can_use_ai_feature(user_id),
-                "can_export": auth_service.can_export_data(user_id),
+                **result["permissions"],
                 "email_verified": user.get("email_verified", False)
             },
             "user_info": dashboard_data["user"]
@@ -759,12 +820,12 @@ async def get_user_permissions(session_token: str = Header(None, alias="x-sessio
 async def check_memorial_permission(request: Request, session_token: str = Header(None, alias="x-session-token")):
     """检查纪念馆创建权限"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        permission = auth_service.can_create_memorial(user_id)
+        permission = await async_db.run(auth_service.can_create_memorial, user_id)
         
         return {
             "success": True,
@@ -784,12 +845,12 @@ async def check_photo_permission(request: Request, session_token: str = Header(N
         if not memorial_id:
             return {"success": False, "message": "纪念馆ID不能为空"}
         
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        permission = auth_service.can_upload_photo(user_id, memorial_id)
+        permission = await async_db.run(auth_service.can_upload_photo, user_id, memorial_id)
         
         return {
             "success": True,
@@ -803,12 +864,12 @@ async def check_photo_permission(request: Request, session_token: str = Header(N
 async def check_ai_permission(session_token: str = Header(None, alias="x-session-token")):
     """检查AI功能使用权限"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        permission = auth_service.can_use_ai_feature(user_id)
+        permission = await async_db.run(auth_service.can_use_ai_feature, user_id)
         
         return {
             "success": True,
@@ -828,12 +889,12 @@ async def upgrade_user_level(request: Request, session_token: str = Header(None,
         if new_level is None:
             return {"success": False, "message": "目标等级不能为空"}
         
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        result = auth_service.upgrade_user_level(user_id, new_level)
+        result = await async_db.run(auth_service.upgrade_user_level, user_id, new_level)
         
         return result
     except Exception as e:
@@ -857,13 +918,7 @@ async def get_user_levels():
 @app.get("/payment", response_class=HTMLResponse)
 async def payment_page(request: Request):
     """充值页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "payment.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("payment.html", request.headers)
 
 @app.get("/api/payment/plans")
 async def get_payment_plans():
@@ -910,17 +965,17 @@ async def get_payment_plans():
 async def get_user_balance(session_token: str = Header(None, alias="x-session-token")):
     """获取用户余额信息"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
         
         # 初始化用户余额（如果不存在）
-        db.init_user_balance(user_id)
+        await async_db.init_user_balance(user_id)
         
         # 获取余额信息
-        balance_info = db.get_user_balance(user_id)
+        balance_info = await async_db.get_user_balance(user_id)
         if not balance_info:
             balance_info = {
                 "balance": 0.0,
@@ -930,7 +985,7 @@ async def get_user_balance(session_token: str = Header(None, alias="x-session-to
             }
         
         # 获取用户等级信息
-        level_info = db.get_user_level_info(user["user_level"])
+        level_info = await async_db.get_user_level_info(user["user_level"])
         
         return {
             "success": True,
@@ -951,7 +1006,7 @@ async def get_user_balance(session_token: str = Header(None, alias="x-session-to
 async def create_payment_order(request: Request, session_token: str = Header(None, alias="x-session-token")):
     """创建支付订单"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
@@ -976,7 +1031,7 @@ async def create_payment_order(request: Request, session_token: str = Header(Non
         user_id = user["id"]
         
         # 创建支付订单
-        order_id = db.create_payment_order(
+        order_id = await async_db.create_payment_order(
             user_id=user_id,
             order_type=f"upgrade_{plan_id}",
             amount=plan["amount"],
@@ -990,7 +1045,7 @@ async def create_payment_order(request: Request, session_token: str = Header(Non
         # 使用真实支付服务创建订单
         notify_url = f"{os.getenv('SERVER_BASE_URL', 'http://localhost:8000')}/api/payment/{payment_method}/notify"
         
-        payment_result = payment_service.create_payment_order(
+        payment_result = await payment_service.create_payment_order(
             payment_method=payment_method,
             order_id=order_id,
             amount=plan["amount"],
@@ -1022,7 +1077,7 @@ async def payment_process(request: Request, order_id: str):
     """支付处理页面"""
     try:
         # 获取订单信息
-        order = db.get_payment_order(order_id)
+        order = await async_db.get_payment_order(order_id)
         if not order:
             return HTMLResponse(content="<h1>订单不存在</h1>", status_code=404)
         
@@ -1108,6 +1163,17 @@ async def payment_process(request: Request, order_id: str):
     except Exception as e:
         return HTMLResponse(content=f"<h1>支付处理错误</h1><p>{str(e)}</p>", status_code=500)
 
+async def settle_paid_order(order_id: str, transaction_id: Optional[str], payment_method: Optional[str]) -> str:
+    """支付成功入账，返回 Database.settle_payment_order 的结果"""
+    if not order_id:
+        return "not_found"
+    result = await async_db.settle_payment_order(order_id, transaction_id, payment_method)
+    if result == "settled":
+        print(f"💰 订单已入账: {order_id}")
+    elif result in ("not_found", "conflict"):
+        print(f"⚠️ 订单入账失败 {order_id}: {result}")
+    return result
+
 # 微信支付回调
 @app.post("/api/payment/wechat/notify")
 async def wechat_payment_notify(request: Request):
@@ -1119,7 +1185,7 @@ async def wechat_payment_notify(request: Request):
         body_str = body.decode('utf-8')
         
         # 验证微信支付通知
-        verify_result = payment_service.verify_payment_notify(
+        verify_result = await payment_service.verify_payment_notify(
             payment_method='wechat',
             headers=headers,
             body=body_str
@@ -1133,24 +1199,10 @@ async def wechat_payment_notify(request: Request):
         trade_state = notify_data.get("trade_state")
         
         if trade_state == "SUCCESS":
-            # 支付成功，更新订单状态
-            success = db.update_payment_status(order_id, "paid", notify_data.get("transaction_id"))
+            # 支付成功入账（重复通知直接返回成功）
+            result = await settle_paid_order(order_id, notify_data.get("transaction_id"), "wechat")
             
-            if success:
-                # 处理支付成功逻辑
-                order = db.get_payment_order(order_id)
-                if order:
-                    user_id = order["user_id"]
-                    
-                    # 根据订单类型处理
-                    if order["order_type"] == "upgrade_monthly":
-                        db.upgrade_user_level(user_id, 1, order_id)
-                    elif order["order_type"] == "upgrade_yearly":
-                        db.upgrade_user_level(user_id, 1, order_id)
-                    
-                    # 记录充值
-                    db.add_user_balance(user_id, order["amount"], order_id, "upgrade")
-                
+            if result in ("settled", "duplicate"):
                 return {"code": "SUCCESS", "message": "OK"}
             else:
                 return {"code": "FAIL", "message": "更新订单状态失败"}
@@ -1171,7 +1223,7 @@ async def alipay_payment_notify(request: Request):
         data = dict(form_data)
         
         # 验证支付宝通知
-        verify_result = payment_service.verify_payment_notify(
+        verify_result = await payment_service.verify_payment_notify(
             payment_method='alipay',
             data=data
         )
@@ -1184,24 +1236,10 @@ async def alipay_payment_notify(request: Request):
         trade_status = notify_data.get("trade_status")
         
         if trade_status == "TRADE_SUCCESS" or trade_status == "TRADE_FINISHED":
-            # 支付成功，更新订单状态
-            success = db.update_payment_status(order_id, "paid", notify_data.get("trade_no"))
+            # 支付成功入账（TRADE_SUCCESS 之后还会收到 TRADE_FINISHED，重复通知直接返回成功）
+            result = await settle_paid_order(order_id, notify_data.get("trade_no"), "alipay")
             
-            if success:
-                # 处理支付成功逻辑
-                order = db.get_payment_order(order_id)
-                if order:
-                    user_id = order["user_id"]
-                    
-                    # 根据订单类型处理
-                    if order["order_type"] == "upgrade_monthly":
-                        db.upgrade_user_level(user_id, 1, order_id)
-                    elif order["order_type"] == "upgrade_yearly":
-                        db.upgrade_user_level(user_id, 1, order_id)
-                    
-                    # 记录充值
-                    db.add_user_balance(user_id, order["amount"], order_id, "upgrade")
-                
+            if result in ("settled", "duplicate"):
                 return "success"
             else:
                 return "failure"
@@ -1224,28 +1262,21 @@ async def payment_callback(request: Request):
         if not order_id or not status:
             return {"success": False, "message": "参数不完整"}
         
+        if status == "paid":
+            result = await settle_paid_order(order_id, platform_order_id, data.get("payment_method"))
+            if result == "not_found":
+                return {"success": False, "message": "订单不存在"}
+            if result == "conflict":
+                return {"success": False, "message": "交易号已用于其他订单"}
+            return {"success": True, "message": "支付状态更新成功"}
+        
         # 获取订单信息
-        order = db.get_payment_order(order_id)
+        order = await async_db.get_payment_order(order_id)
         if not order:
             return {"success": False, "message": "订单不存在"}
         
         # 更新支付状态
-        success = db.update_payment_status(order_id, status, platform_order_id)
-        
-        if success and status == "paid":
-            # 处理支付成功逻辑
-            user_id = order["user_id"]
-            
-            # 根据订单类型处理
-            if order["order_type"] == "upgrade_monthly":
-                # 升级到高级用户（1个月）
-                db.upgrade_user_level(user_id, 1, order_id)
-            elif order["order_type"] == "upgrade_yearly":
-                # 升级到高级用户（1年）
-                db.upgrade_user_level(user_id, 1, order_id)
-            
-            # 记录充值
-            db.add_user_balance(user_id, order["amount"], order_id, "upgrade")
+        await async_db.update_payment_status(order_id, status, platform_order_id)
         
         return {"success": True, "message": "支付状态更新成功"}
         
@@ -1255,78 +1286,67 @@ async def payment_callback(request: Request):
 @app.get("/memorials", response_class=HTMLResponse)
 async def memorials_page(request: Request):
     """纪念馆列表页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "memorials.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("memorials.html", request.headers)
 
 @app.get("/memorial/edit/{memorial_id}", response_class=HTMLResponse)
 async def memorial_edit_page(request: Request, memorial_id: str):
     """纪念馆编辑页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "memorial_edit.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("memorial_edit.html", request.headers)
 
 @app.get("/orders", response_class=HTMLResponse)
 async def orders_page(request: Request):
     """订单管理页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "orders.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("orders.html", request.headers)
 
 @app.get("/api/user/orders")
 async def get_user_orders(
     request: Request,
     page: int = 1,
     status: str = "all",
+    limit: int = 10,
+    cursor: Optional[str] = None,
     session_token: str = Header(None, alias="x-session-token")
 ):
-    """获取用户订单列表"""
+    """获取用户订单列表（筛选和分页在数据库中完成，传入 cursor 时按游标翻页）"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         user_id = user["id"]
-        limit = 10
-        offset = (page - 1) * limit
-        
-        # 获取订单列表
-        orders = db.get_user_payment_orders(user_id, limit * 2)  # 获取更多数据用于筛选
-        
-        # 筛选订单
-        if status != "all":
-            orders = [order for order in orders if order["payment_status"] == status]
-        
-        # 分页
-        total_orders = len(orders)
-        orders = orders[offset:offset + limit]
+        limit = clamp_limit(limit, default=10)
+        page = max(page, 1)
+        status_filter = None if status == "all" else status
+        
+        orders = await async_db.get_user_payment_orders(
+            user_id,
+            limit=limit + 1,
+            status=status_filter,
+            offset=(page - 1) * limit,
+            after=decode_cursor(cursor, id_type=str)
+        )
+        orders, next_cursor = paginate(orders, limit, sort_index="created_at", id_index="id")
         
-        # 计算统计信息
-        all_orders = db.get_user_payment_orders(user_id, 1000)  # 获取所有订单用于统计
+        # 按状态汇总的统计信息
+        status_stats = await async_db.get_user_payment_order_stats(user_id)
+        paid = status_stats.get("paid", {"count": 0, "amount": 0})
         stats = {
-            "total_orders": len(all_orders),
-            "total_amount": sum(order["amount"] for order in all_orders if order["payment_status"] == "paid"),
-            "success_orders": len([order for order in all_orders if order["payment_status"] == "paid"]),
-            "pending_orders": len([order for order in all_orders if order["payment_status"] == "pending"])
+            "total_orders": sum(item["count"] for item in status_stats.values()),
+            "total_amount": paid["amount"],
+            "success_orders": paid["count"],
+            "pending_orders": status_stats.get("pending", {"count": 0})["count"]
         }
         
         # 分页信息
+        if status_filter:
+            total_orders = status_stats.get(status_filter, {"count": 0})["count"]
+        else:
+            total_orders = stats["total_orders"]
         pagination = {
             "current_page": page,
             "total_pages": (total_orders + limit - 1) // limit,
-            "total_items": total_orders
+            "total_items": total_orders,
+            "next_cursor": next_cursor
         }
         
         return {
@@ -1343,7 +1363,7 @@ async def get_user_orders(
 async def cancel_payment_order(request: Request, session_token: str = Header(None, alias="x-session-token")):
     """取消支付订单"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
@@ -1354,7 +1374,7 @@ async def cancel_payment_order(request: Request, session_token: str = Header(Non
             return {"success": False, "message": "订单ID不能为空"}
         
         # 获取订单信息
-        order = db.get_payment_order(order_id)
+        order = await async_db.get_payment_order(order_id)
         if not order:
             return {"success": False, "message": "订单不存在"}
         
@@ -1367,7 +1387,7 @@ async def cancel_payment_order(request: Request, session_token: str = Header(Non
             return {"success": False, "message": "只能取消待支付的订单"}
         
         # 更新订单状态
-        success = db.update_payment_status(order_id, "cancelled")
+        success = await async_db.update_payment_status(order_id, "cancelled")
         
         if success:
             return {"success": True, "message": "订单已取消"}
@@ -1394,7 +1414,7 @@ async def user_center(request: Request):
                 "error_message": "请先登录"
             })
         
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         print(f"🔍 用户验证结果: {user}")
         if not user:
             print("❌ 用户验证失败，返回登录页面")
@@ -1405,15 +1425,10 @@ async def user_center(request: Request):
         
         user_id = user["id"]
         
-        # 获取用户权限信息
-        permissions = {
-            "can_create_memorial": auth_service.can_create_memorial(user_id),
-            "can_use_ai": auth_service.can_use_ai_feature(user_id),
-            "can_export": auth_service.can_export_data(user_id)
-        }
-        
-        # 获取用户仪表板数据
-        dashboard_data = auth_service.get_user_dashboard_data(user_id)
+        # 获取用户权限信息和仪表板数据（同一份用户快照）
+        result = await async_db.run(auth_service.get_user_permissions, user_id)
+        permissions = result["permissions"]
+        dashboard_data = result["dashboard"]
         if not dashboard_data["success"]:
             return templates.TemplateResponse("error.html", {
                 "request": request,
@@ -1440,17 +1455,17 @@ async def user_center(request: Request):
 async def get_user_memorials(session_token: str = Header(None, alias="x-session-token")):
     """获取用户纪念馆列表"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
-        memorials = db.get_user_memorials(user["id"])
+        memorials = await async_db.get_user_memorials(user["id"])
         
         # 为每个纪念馆添加统计信息
         for memorial in memorials:
-            memorial["photos"] = db.get_memorial_photos(memorial["id"]) or []
-            memorial["views"] = db.get_memorial_views(memorial["id"]) or 0
-            memorial["likes"] = db.get_memorial_likes(memorial["id"]) or 0
+            memorial["photos"] = await async_db.get_memorial_photos(memorial["id"]) or []
+            memorial["views"] = await async_db.get_memorial_views(memorial["id"]) or 0
+            memorial["likes"] = await async_db.get_memorial_likes(memorial["id"]) or 0
         
         return {
             "success": True,
@@ -1460,15 +1475,33 @@ async def get_user_memorials(session_token: str = Header(None, alias="x-session-
     except Exception as e:
         return {"success": False, "message": f"获取纪念馆列表失败: {str(e)}"}
 
+@app.get("/api/memorial/download/{memorial_id}")
+async def download_memorial(memorial_id: str, session_token: str = Header(None, alias="x-session-token")):
+    """下载纪念馆（页面、数据和照片的ZIP包）"""
+    user = await async_db.run(auth_service.get_current_user, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="用户未登录")
+    
+    memorial = await async_db.get_memorial_by_id(memorial_id)
+    if not memorial:
+        raise HTTPException(status_code=404, detail="纪念馆不存在")
+    if memorial["user_id"] != user["id"]:
+        raise HTTPException(status_code=403, detail="无权下载此纪念馆")
+    
+    response = await async_db.run(memorial_service.create_download_package, memorial_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="纪念馆不存在")
+    return response
+
 @app.get("/api/memorial/get/{memorial_id}")
 async def get_memorial_detail(memorial_id: str, session_token: str = Header(None, alias="x-session-token")):
     """获取纪念馆详情"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
-        memorial = db.get_memorial_by_id(memorial_id)
+        memorial = await async_db.get_memorial_by_id(memorial_id)
         if not memorial:
             return {"success": False, "message": "纪念馆不存在"}
         
@@ -1477,7 +1510,7 @@ async def get_memorial_detail(memorial_id: str, session_token: str = Header(None
             return {"success": False, "message": "无权访问此纪念馆"}
         
         # 添加照片信息
-        memorial["photos"] = db.get_memorial_photos(memorial_id) or []
+        memorial["photos"] = await async_db.get_memorial_photos(memorial_id) or []
         
         return {
             "success": True,
@@ -1491,19 +1524,19 @@ async def get_memorial_detail(memorial_id: str, session_token: str = Header(None
 async def update_memorial(memorial_id: str, request: Request, session_token: str = Header(None, alias="x-session-token")):
     """更新纪念馆信息"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 检查纪念馆是否存在且属于当前用户
-        memorial = db.get_memorial_by_id(memorial_id)
+        memorial = await async_db.get_memorial_by_id(memorial_id)
         if not memorial or memorial["user_id"] != user["id"]:
             return {"success": False, "message": "纪念馆不存在或无权限"}
         
         data = await request.json()
         
         # 更新纪念馆信息
-        success = db.update_memorial(
+        success = await async_db.update_memorial(
             memorial_id=memorial_id,
             pet_name=data.get("pet_name"),
             species=data.get("species"),
@@ -1518,6 +1551,7 @@ async def update_memorial(memorial_id: str, request: Request, session_token: str
         )
         
         if success:
+            rerender_queue.mark_dirty(memorial_id)
             return {"success": True, "message": "纪念馆更新成功"}
         else:
             return {"success": False, "message": "纪念馆更新失败"}
@@ -1529,17 +1563,17 @@ async def update_memorial(memorial_id: str, request: Request, session_token: str
 async def delete_memorial(memorial_id: str, session_token: str = Header(None, alias="x-session-token")):
     """删除纪念馆"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 检查纪念馆是否存在且属于当前用户
-        memorial = db.get_memorial_by_id(memorial_id)
+        memorial = await async_db.get_memorial_by_id(memorial_id)
         if not memorial or memorial["user_id"] != user["id"]:
             return {"success": False, "message": "纪念馆不存在或无权限"}
         
         # 删除纪念馆
-        success = db.delete_memorial(memorial_id)
+        success = await async_db.delete_memorial(memorial_id)
         
         if success:
             return {"success": True, "message": "纪念馆删除成功"}
@@ -1557,40 +1591,31 @@ async def upload_memorial_photos(
 ):
     """上传纪念馆照片"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 检查纪念馆是否存在且属于当前用户
-        memorial = db.get_memorial_by_id(memorial_id)
+        memorial = await async_db.get_memorial_by_id(memorial_id)
         if not memorial or memorial["user_id"] != user["id"]:
             return {"success": False, "message": "纪念馆不存在或无权限"}
         
         # 检查照片上传权限
-        if not auth_service.can_upload_photo(user["id"]):
+        if not await async_db.run(auth_service.can_upload_photo, user["id"]):
             return {"success": False, "message": "已达到照片上传上限，请升级会员"}
         
-        uploaded_photos = []
-        
-        for photo in photos:
-            if photo.content_type.startswith('image/'):
-                # 生成唯一文件名
-                filename = f"{uuid.uuid4().hex}.jpg"
-                
-                # 保存照片
-                storage_base = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
-                photo_path = os.path.join(storage_base, "photos", filename)
-                
-                with open(photo_path, "wb") as f:
-                    f.write(await photo.read())
-                
-                # 添加到纪念馆
-                photo_url = f"/storage/photos/{filename}"
-                db.add_memorial_photo(memorial_id, photo_url)
-                uploaded_photos.append(photo_url)
+        # 保存照片
+        uploaded_photos = await photo_uploader.save_photos(photos, images_only=True)
+        photo_variants.schedule(uploaded_photos)
+        
+        # 添加到纪念馆
+        for photo_url in uploaded_photos:
+            await async_db.add_memorial_photo(memorial_id, photo_url)
+        
+        rerender_queue.mark_dirty(memorial_id)
         
         # 获取更新后的照片列表
-        all_photos = db.get_memorial_photos(memorial_id) or []
+        all_photos = await async_db.get_memorial_photos(memorial_id) or []
         
         return {
             "success": True,
@@ -1609,12 +1634,12 @@ async def delete_memorial_photo(
 ):
     """删除纪念馆照片"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 检查纪念馆是否存在且属于当前用户
-        memorial = db.get_memorial_by_id(memorial_id)
+        memorial = await async_db.get_memorial_by_id(memorial_id)
         if not memorial or memorial["user_id"] != user["id"]:
             return {"success": False, "message": "纪念馆不存在或无权限"}
         
@@ -1625,16 +1650,17 @@ async def delete_memorial_photo(
             return {"success": False, "message": "照片索引无效"}
         
         # 获取照片列表
-        photos = db.get_memorial_photos(memorial_id) or []
+        photos = await async_db.get_memorial_photos(memorial_id) or []
         
         if photo_index < 0 or photo_index >= len(photos):
             return {"success": False, "message": "照片索引超出范围"}
         
         # 删除照片
         photo_url = photos[photo_index]
-        success = db.delete_memorial_photo(memorial_id, photo_url)
+        success = await async_db.delete_memorial_photo(memorial_id, photo_url)
         
         if success:
+            rerender_queue.mark_dirty(memorial_id)
             return {"success": True, "message": "照片删除成功"}
         else:
             return {"success": False, "message": "照片删除失败"}
@@ -1647,32 +1673,33 @@ async def delete_memorial_photo(
 @app.get("/photo-manager", response_class=HTMLResponse)
 async def photo_manager_page(request: Request):
     """照片管理页面"""
-    try:
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "photo_manager.html")
-        with open(template_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    except Exception as e:
-        return HTMLResponse(content=f"<h1>页面加载错误</h1><p>{str(e)}</p>", status_code=500)
+    return static_pages.response("photo_manager.html", request.headers)
 
 @app.get("/api/user/photos")
-async def get_user_photos(session_token: str = Header(None, alias="x-session-token")):
+async def get_user_photos(request: Request, session_token: str = Header(None, alias="x-session-token")):
     """获取用户照片列表"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 获取用户所有纪念馆的照片
-        memorials = db.get_user_memorials(user["id"])
+        memorials = await async_db.get_user_memorials(user["id"])
         all_photos = []
+        memorial_photos = [(memorial, await async_db.get_memorial_photos(memorial["id"])) for memorial in memorials]
         
-        for memorial in memorials:
-            photos = db.get_memorial_photos(memorial["id"])
+        # 缩略图和中等尺寸版本，客户端支持时（?webp=1 或 Accept 含 image/webp）优先返回WebP
+        variants = await async_db.get_photo_variants([url for _, photos in memorial_photos for url in photos])
+        accept_webp = request.query_params.get("webp") == "1" or "image/webp" in request.headers.get("accept", "")
+        
+        for memorial, photos in memorial_photos:
             for photo_url in photos:
+                photo_variant = variants.get(photo_url, {})
                 all_photos.append({
                     "id": f"photo_{len(all_photos)}",
                     "url": photo_url,
+                    "thumbnail_url": photo_variants.pick(photo_variant, "thumb", accept_webp) or photo_url,
+                    "medium_url": photo_variants.pick(photo_variant, "medium", accept_webp) or photo_url,
                     "memorial_id": memorial["id"],
                     "memorial_name": memorial.get("pet_name", "未命名"),
                     "created_at": memorial.get("created_at", ""),
@@ -1697,30 +1724,17 @@ async def upload_photos(
 ):
     """上传照片"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
         # 检查照片上传权限
-        if not auth_service.can_upload_photo(user["id"]):
+        if not await async_db.run(auth_service.can_upload_photo, user["id"]):
             return {"success": False, "message": "已达到照片上传上限，请升级会员"}
         
-        uploaded_photos = []
-        
-        for photo in photos:
-            if photo.content_type.startswith('image/'):
-                # 生成唯一文件名
-                filename = f"{uuid.uuid4().hex}.jpg"
-                
-                # 保存照片
-                storage_base = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
-                photo_path = os.path.join(storage_base, "photos", filename)
-                
-                with open(photo_path, "wb") as f:
-                    f.write(await photo.read())
-                
-                photo_url = f"/storage/photos/{filename}"
-                uploaded_photos.append(photo_url)
+        # 保存照片
+        uploaded_photos = await photo_uploader.save_photos(photos, images_only=True)
+        photo_variants.schedule(uploaded_photos)
         
         return {
             "success": True,
@@ -1735,7 +1749,7 @@ async def upload_photos(
 async def delete_photo(photo_id: str, session_token: str = Header(None, alias="x-session-token")):
     """删除照片"""
     try:
-        user = auth_service.get_current_user(session_token)
+        user = await async_db.run(auth_service.get_current_user, session_token)
         if not user:
             return {"success": False, "message": "用户未登录"}
         
@@ -0,0 +1,206 @@
+"""
+纪念馆下载包
+按 memorial_photos 中登记的照片组装ZIP（纪念馆页面、页面CSS/JS、纪念馆数据JSON和照片），
+早期页面中尚未回填到 memorial_photos 的照片按页面内容一并打包；
+边生成边发送，内存中只保留一个文件块；JPEG等已压缩格式直接存储不再压缩。
+生成的同时写入 storage/downloads 缓存，内容版本不变时直接返回缓存文件
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi.responses import FileResponse, StreamingResponse
+
+from legacy_pages import legacy_page_photos
+
+DEFAULT_STORAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
+
+# 已压缩的格式直接存储
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip'}
+
+# 页面引用的带指纹资源
+ASSET_PATTERN = re.compile(r'/static/assets/([\w-]+\.[0-9a-f]{12}\.(?:css|js))')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkBuffer:
+    """ZipFile 的只写输出，生成器每写完一块就取走数据"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        if data:
+            self.chunks.append(bytes(data))
+            self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class MemorialExporter:
+    """纪念馆下载包生成器"""
+
+    def __init__(self, db, storage_dir: str = DEFAULT_STORAGE_DIR, cache_dir: str = None):
+        self.db = db
+        self.storage_dir = os.path.abspath(storage_dir)
+        self.assets_dir = os.path.join(self.storage_dir, "assets")
+        self.memorials_dir = os.path.join(self.storage_dir, "memorials")
+        self.cache_dir = cache_dir or os.path.join(self.storage_dir, "downloads")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.cache_hits = 0
+        self.builds = 0
+
+    def _storage_path(self, url: str) -> Optional[str]:
+        """/storage/... URL 对应的本地文件，不在存储目录中时返回None"""
+        if not url or not url.startswith("/storage/"):
+            return None
+        path = os.path.abspath(os.path.join(self.storage_dir, url[len("/storage/"):]))
+        if not path.startswith(self.storage_dir + os.sep):
+            return None
+        return path
+
+    def _collect(self, memorial_id: str) -> Optional[Tuple[str, List[Tuple[str, str]], bytes]]:
+        """
+        收集下载包内容，纪念馆不存在时返回None
+        返回 (内容版本, [(包内路径, 本地文件)], 纪念馆数据JSON)
+        """
+        data = self.db.get_memorial_render_data(memorial_id)
+        if not data:
+            return None
+
+        # 早期页面中有、memorial_photos 中没有的照片（创建时上传的照片）排在前面
+        registered = set(data['photos'])
+        data['photos'] = [
+            url for url in legacy_page_photos(memorial_id, self.memorials_dir) if url not in registered
+        ] + data['photos']
+
+        files = []
+        html_path = os.path.join(self.memorials_dir, f"{memorial_id}.html")
+        if os.path.exists(html_path):
+            files.append((f"{memorial_id}.html", html_path))
+            with open(html_path, "r", encoding="utf-8") as f:
+                assets = sorted(set(ASSET_PATTERN.findall(f.read())))
+            for name in assets:
+                asset_path = os.path.join(self.assets_dir, name)
+                if os.path.exists(asset_path):
+                    files.append((f"static/assets/{name}", asset_path))
+
+        seen = set()
+        for photo_url in data['photos']:
+            path = self._storage_path(photo_url)
+            name = os.path.basename(photo_url)
+            if path is None or name in seen or not os.path.exists(path):
+                continue
+            seen.add(name)
+            files.append((f"photos/{name}", path))
+
+        manifest = json.dumps({"memorial_id": memorial_id, **data}, ensure_ascii=False, indent=2).encode("utf-8")
+
+        # 内容版本：数据JSON + 各文件的路径、大小和修改时间
+        digest = hashlib.sha256(manifest)
+        for arcname, path in files:
+            stat = os.stat(path)
+            digest.update(f"{arcname}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()[:16], files, manifest
+
+    def _cache_path(self, memorial_id: str, version: str) -> str:
+        return os.path.join(self.cache_dir, f"{memorial_id}.{version}.zip")
+
+    def _iter_zip(self, files: List[Tuple[str, str]], manifest: bytes) -> Iterator[bytes]:
+        """逐块生成ZIP内容"""
+        buffer = _ChunkBuffer()
+        with zipfile.ZipFile(buffer, "w") as zipf:
+            info = zipfile.ZipInfo("memorial.json", time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zipf.writestr(info, manifest)
+            yield buffer.take()
+
+            for arcname, path in files:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                stored = os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                with open(path, "rb") as src, zipf.open(info, "w", force_zip64=True) as dst:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield buffer.take()
+                yield buffer.take()
+        yield buffer.take()
+
+    def _stream_and_cache(self, memorial_id: str, version: str, files, manifest) -> Iterator[bytes]:
+        """发送ZIP的同时写入缓存文件，完整生成后才替换为正式缓存"""
+        cache_path = self._cache_path(memorial_id, version)
+        temp_path = os.path.join(self.cache_dir, f".{memorial_id}.{uuid.uuid4().hex}.tmp")
+        completed = False
+        try:
+            with open(temp_path, "wb") as cache_file:
+                for data in self._iter_zip(files, manifest):
+                    if data:
+                        cache_file.write(data)
+                        yield data
+            os.replace(temp_path, cache_path)
+            completed = True
+            self.builds += 1
+            self._remove_old_versions(memorial_id, keep=cache_path)
+        finally:
+            # 客户端中途断开时丢弃不完整的缓存
+            if not completed and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _remove_old_versions(self, memorial_id: str, keep: str):
+        prefix = f"{memorial_id}."
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and name.endswith(".zip") and path != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def response(self, memorial_id: str):
+        """返回下载包响应，纪念馆不存在时返回None"""
+        collected = self._collect(memorial_id)
+        if collected is None:
+            return None
+        version, files, manifest = collected
+        filename = f"{memorial_id}_memorial.zip"
+        headers = {"ETag": f'"{version}"'}
+
+        cache_path = self._cache_path(memorial_id, version)
+        if os.path.exists(cache_path):
+            self.cache_hits += 1
+            return FileResponse(cache_path, media_type="application/zip", filename=filename, headers=headers)
+
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return StreamingResponse(
+            self._stream_and_cache(memorial_id, version, files, manifest),
+            media_type="application/zip",
+            headers=headers
+        )
+
+    def get_stats(self):
+        """获取下载包统计信息"""
+        return {
+            "builds": self.builds,
+            "cache_hits": self.cache_hits
+        }
@@ -0,0 +1,327 @@
+"""
+页面缓存
+把 storage/memorials/{id}.html 缓存在内存中，按文件mtime失效；
+templates 中的静态页面启动时预加载到页面注册表。
+两者都预先生成gzip/brotli压缩版本，支持ETag/Last-Modified条件请求
+"""
+import asyncio
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi.responses import HTMLResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 压缩级别：页面在请求路径上压缩（缓存未命中、生成页面时），取压缩率和耗时的折中
+GZIP_LEVEL = int(os.getenv('PAGE_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('PAGE_BROTLI_QUALITY', '5'))
+
+
+class CachedPage:
+    """单个页面的缓存条目"""
+
+    def __init__(self, body: bytes, mtime_ns: int, size: int):
+        self.body = body
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = formatdate(mtime_ns / 1e9, usegmt=True)
+
+        # 预压缩版本
+        self.variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=GZIP_LEVEL)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(data) for data in self.variants.values())
+
+    def etag(self, encoding: str = "identity") -> str:
+        """强ETag，不同编码使用不同的值"""
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def matches_etag(self, if_none_match: str) -> bool:
+        """判断If-None-Match是否命中当前内容"""
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-")[0] == self.digest:
+                return True
+        return False
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """解析Accept-Encoding，返回 {编码: q值}"""
+    result = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[str]) -> str:
+    """按q值选择编码（q=0表示不接受），相同q值时优先br"""
+    accepted = parse_accept_encoding(accept_encoding)
+    default_q = accepted.get("*", 0.0)
+    best, best_q = "identity", 0.0
+    for encoding in ("br", "gzip"):
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, default_q)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def build_page_response(page: CachedPage, headers, max_age: int,
+                        media_type: str = "text/html; charset=utf-8", immutable: bool = False) -> Response:
+    """根据请求头生成200或304响应，immutable 用于带内容指纹的静态资源"""
+    encoding = choose_encoding(headers.get("accept-encoding", ""), page.variants)
+
+    response_headers = {
+        "ETag": page.etag(encoding),
+        "Last-Modified": page.last_modified,
+        "Cache-Control": f"public, max-age={max_age}{', immutable' if immutable else ''}" if max_age > 0 else "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+
+    if_none_match = headers.get("if-none-match")
+    if if_none_match:
+        if page.matches_etag(if_none_match):
+            return Response(status_code=304, headers=response_headers)
+    else:
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+                if int(page.mtime_ns / 1e9) <= since:
+                    return Response(status_code=304, headers=response_headers)
+            except (TypeError, ValueError):
+                pass
+
+    if encoding != "identity":
+        response_headers["Content-Encoding"] = encoding
+    return Response(
+        content=page.variants[encoding],
+        media_type=media_type,
+        headers=response_headers
+    )
+
+
+class MemorialPageCache:
+    """按memorial_id缓存页面，总字节数有上限，超出时淘汰最久未访问的页面"""
+
+    def __init__(self, memorials_dir: str, max_bytes: int = None, max_age: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('MEMORIAL_PAGE_CACHE_BYTES', str(64 * 1024 * 1024)))
+        if max_age is None:
+            max_age = int(os.getenv('MEMORIAL_PAGE_MAX_AGE', '60'))
+        self.memorials_dir = memorials_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, memorial_id: str) -> Optional[str]:
+        if not memorial_id or memorial_id.startswith(".") or "/" in memorial_id or "\\" in memorial_id:
+            return None
+        return os.path.join(self.memorials_dir, f"{memorial_id}.html")
+
+    def _store(self, memorial_id: str, page: CachedPage):
+        with self._lock:
+            old = self._pages.pop(memorial_id, None)
+            if old is not None:
+                self._total_bytes -= old.nbytes
+            if page.nbytes > self.max_bytes:
+                return
+            self._pages[memorial_id] = page
+            self._total_bytes += page.nbytes
+            while self._total_bytes > self.max_bytes and self._pages:
+                _, evicted = self._pages.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+    def get(self, memorial_id: str) -> Optional[CachedPage]:
+        """获取页面，文件不存在时返回None，文件变化时重新加载"""
+        path = self._path(memorial_id)
+        if path is None:
+            return None
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(memorial_id)
+            return None
+
+        with self._lock:
+            page = self._pages.get(memorial_id)
+            if page is not None and page.mtime_ns == stat.st_mtime_ns and page.size == stat.st_size:
+                self._pages.move_to_end(memorial_id)
+                self.hits += 1
+                return page
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            body = f.read()
+        page = CachedPage(body, stat.st_mtime_ns, stat.st_size)
+        self._store(memorial_id, page)
+        return page
+
+    def put(self, memorial_id: str, html_content: str):
+        """页面文件写入后直接预热缓存"""
+        path = self._path(memorial_id)
+        if path is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        body = html_content.encode("utf-8")
+        if len(body) != stat.st_size:
+            # 文件内容与传入内容不一致（例如被并发覆盖），下次访问时从磁盘加载
+            self.invalidate(memorial_id)
+            return
+        self._store(memorial_id, CachedPage(body, stat.st_mtime_ns, stat.st_size))
+
+    def invalidate(self, memorial_id: str):
+        """移除缓存条目"""
+        with self._lock:
+            page = self._pages.pop(memorial_id, None)
+            if page is not None:
+                self._total_bytes -= page.nbytes
+
+    def build_response(self, page: CachedPage, headers) -> Response:
+        """根据请求头生成200或304响应"""
+        return build_page_response(page, headers, self.max_age)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "pages": len(self._pages),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "brotli": brotli is not None
+            }
+
+
+class StaticPageRegistry:
+    """
+    templates 目录中的静态页面注册表
+    启动时一次性加载，开发模式下定时检查文件变化并重新加载
+    """
+
+    def __init__(self, templates_dir: str, max_age: int = None, reload: bool = None,
+                 watch_interval: float = None):
+        if reload is None:
+            reload = os.getenv('STATIC_PAGE_RELOAD', 'false' if os.getenv('ENVIRONMENT') == 'production' else 'true').lower() == 'true'
+        if max_age is None:
+            # 开发模式下每次都重新验证
+            max_age = int(os.getenv('STATIC_PAGE_MAX_AGE', '300')) if not reload else 0
+        self.templates_dir = templates_dir
+        self.max_age = max_age
+        self.reload = reload
+        self.watch_interval = watch_interval or float(os.getenv('STATIC_PAGE_WATCH_INTERVAL', '1'))
+        self._pages: Dict[str, CachedPage] = {}
+        self._worker = None
+        self.reloads = 0
+
+    def _load(self, filename: str) -> CachedPage:
+        path = os.path.join(self.templates_dir, filename)
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            body = f.read()
+        return CachedPage(body, stat.st_mtime_ns, stat.st_size)
+
+    def load(self, filenames: Iterable[str]):
+        """加载页面，加载失败的页面在请求时返回错误页"""
+        for filename in filenames:
+            try:
+                self._pages[filename] = self._load(filename)
+            except OSError as e:
+                print(f"❌ 页面加载失败 {filename}: {e}")
+        print(f"📄 已加载 {len(self._pages)} 个静态页面")
+
+    def get(self, filename: str) -> Optional[CachedPage]:
+        return self._pages.get(filename)
+
+    def response(self, filename: str, headers) -> Response:
+        """返回页面响应（支持压缩和条件请求）"""
+        page = self._pages.get(filename)
+        if page is None:
+            return HTMLResponse(content=f"<h1>页面加载错误</h1><p>页面不存在: {filename}</p>", status_code=500)
+        return build_page_response(page, headers, self.max_age)
+
+    async def start(self):
+        """开发模式下启动文件检查协程"""
+        if not self.reload or self._worker:
+            return
+        self._worker = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        """停止文件检查协程"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                self.check_changes()
+            except Exception as e:
+                print(f"❌ 页面重新加载失败: {e}")
+
+    def check_changes(self) -> int:
+        """重新加载有变化的页面，返回重新加载的数量"""
+        reloaded = 0
+        for filename, page in list(self._pages.items()):
+            try:
+                stat = os.stat(os.path.join(self.templates_dir, filename))
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime_ns != page.mtime_ns or stat.st_size != page.size:
+                self._pages[filename] = self._load(filename)
+                reloaded += 1
+                print(f"🔄 页面已重新加载: {filename}")
+        self.reloads += reloaded
+        return reloaded
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取注册表统计信息"""
+        return {
+            "pages": len(self._pages),
+            "bytes": sum(page.nbytes for page in self._pages.values()),
+            "reload": self.reload,
+            "reloads": self.reloads,
+            "max_age": self.max_age
+        }
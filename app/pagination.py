@@ -0,0 +1,47 @@
+"""
+游标分页
+列表接口按 (排序字段, id) 做keyset分页，游标是对最后一条记录排序键的不透明编码
+"""
+import base64
+import json
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def clamp_limit(limit: Optional[int], default: int = DEFAULT_PAGE_SIZE) -> int:
+    """把limit限制在 1..MAX_PAGE_SIZE 之间"""
+    if not limit or limit < 1:
+        return default
+    return min(int(limit), MAX_PAGE_SIZE)
+
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    """编码游标"""
+    raw = json.dumps([sort_value, row_id], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], id_type: Callable[[Any], Any] = int) -> Optional[Tuple[Any, Any]]:
+    """解码游标，为空时返回None，格式错误时抛出ValueError；id_type 为id列的类型"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        return sort_value, id_type(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("无效的分页游标") from e
+
+
+def paginate(rows: Sequence, limit: int, sort_index, id_index) -> Tuple[List, Optional[str]]:
+    """
+    rows 为按 limit+1 查询的结果，返回 (当前页, 下一页游标)
+    sort_index / id_index 为排序字段和id在行中的位置（行为字典时传字段名）
+    """
+    page = list(rows[:limit])
+    if len(rows) <= limit or not page:
+        return page, None
+    last = page[-1]
+    return page, encode_cursor(last[sort_index], last[id_index])
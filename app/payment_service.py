@@ -2,23 +2,118 @@
 支付服务模块
 支持微信支付和支付宝支付
 """
+import abc
 import os
 import json
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import hmac
 import base64
 from datetime import datetime
 from typing import Dict, Any, Optional
-import requests
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.backends import default_backend
 
+from http_client import HttpClient, get_http_client
+
+class CachedKeyFile(abc.ABC):
+    """
+    缓存从文件解析出的密钥，文件修改（证书轮换）后自动重新加载
+    check_interval 秒内不重复检查文件状态
+    """
+    
+    def __init__(self, path: str, check_interval: float = None):
+        self.path = path
+        self.check_interval = check_interval if check_interval is not None else float(os.getenv('PAYMENT_KEY_CHECK_INTERVAL', '5'))
+        self._lock = threading.Lock()
+        self._key = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.load_count = 0
+    
+    @abc.abstractmethod
+    def _parse(self, data: bytes):
+        """把文件内容解析为密钥对象"""
+    
+    def get_key(self):
+        """获取密钥，必要时（首次或文件变化）重新解析"""
+        now = time.monotonic()
+        if self._key is not None and now - self._checked_at < self.check_interval:
+            return self._key
+        
+        with self._lock:
+            if self._key is not None and now - self._checked_at < self.check_interval:
+                return self._key
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._key is None or signature != self._signature:
+                with open(self.path, 'rb') as f:
+                    self._key = self._parse(f.read())
+                self._signature = signature
+                self.load_count += 1
+            self._checked_at = now
+            return self._key
+    
+    def preload(self) -> bool:
+        """启动时预先加载密钥，失败只打印日志"""
+        if not self.path:
+            return False
+        try:
+            self.get_key()
+            return True
+        except Exception as e:
+            print(f"⚠️ 加载密钥失败 {self.path}: {e}")
+            return False
+
+
+class RSASigner(CachedKeyFile):
+    """商户私钥签名（SHA256withRSA）"""
+    
+    def _parse(self, data: bytes):
+        return serialization.load_pem_private_key(data, password=None, backend=default_backend())
+    
+    def sign(self, message: str) -> str:
+        signature = self.get_key().sign(message.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+        return base64.b64encode(signature).decode('utf-8')
+
+
+class RSAVerifier(CachedKeyFile):
+    """平台证书（或PEM公钥）验签（SHA256withRSA）"""
+    
+    def _parse(self, data: bytes):
+        if b'BEGIN CERTIFICATE' in data:
+            return x509.load_pem_x509_certificate(data, default_backend()).public_key()
+        return serialization.load_pem_public_key(data, backend=default_backend())
+    
+    def verify(self, message: str, signature: str) -> bool:
+        try:
+            self.get_key().verify(base64.b64decode(signature), message.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+            return True
+        except (InvalidSignature, ValueError):
+            return False
+
+
+async def run_crypto(executor: Optional[ThreadPoolExecutor], func, *args):
+    """执行签名/验签，配置了线程池时放到线程池中，避免占用事件循环"""
+    if executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
 class WeChatPayService:
     """微信支付服务"""
     
-    def __init__(self):
+    def __init__(self, http_client: Optional[HttpClient] = None,
+                 crypto_executor: Optional[ThreadPoolExecutor] = None):
+        self.http_client = http_client or get_http_client()
+        self.crypto_executor = crypto_executor
+        
         # 微信支付配置
         self.app_id = os.getenv('WECHAT_APP_ID', '')
         self.mch_id = os.getenv('WECHAT_MCH_ID', '')
@@ -26,14 +121,20 @@ class WeChatPayService:
         self.cert_serial_no = os.getenv('WECHAT_CERT_SERIAL_NO', '')
         self.private_key_path = os.getenv('WECHAT_PRIVATE_KEY_PATH', '')
         self.cert_path = os.getenv('WECHAT_CERT_PATH', '')
+        # 微信支付平台证书，配置后校验回调通知签名
+        self.platform_cert_path = os.getenv('WECHAT_PLATFORM_CERT_PATH', '')
+        
+        # 私钥只在首次使用或文件变化时解析
+        self.signer = RSASigner(self.private_key_path)
+        self.notify_verifier = RSAVerifier(self.platform_cert_path) if self.platform_cert_path else None
         
-        # API地址
-        self.base_url = 'https://api.mch.weixin.qq.com'
+        # API地址（可指向本地模拟服务测试）
+        self.base_url = os.getenv('WECHAT_PAY_BASE_URL', 'https://api.mch.weixin.qq.com').rstrip('/')
         self.unified_order_url = f'{self.base_url}/v3/pay/transactions/jsapi'
         self.query_order_url = f'{self.base_url}/v3/pay/transactions/out-trade-no'
         self.close_order_url = f'{self.base_url}/v3/pay/transactions/out-trade-no'
         
-    def create_jsapi_order(self, order_id: str, amount: int, description: str, 
+    async def create_jsapi_order(self, order_id: str, amount: int, description: str, 
                           openid: str, notify_url: str) -> Dict[str, Any]:
         """创建JSAPI支付订单"""
         try:
@@ -62,7 +163,7 @@ class WeChatPayService:
             
             # 构建签名字符串
             sign_str = f"{method}\n{url_path}\n{timestamp}\n{nonce_str}\n{body}\n"
-            signature = self._generate_signature(sign_str)
+            signature = await self._generate_signature(sign_str)
             
             # 构建请求头
             headers = {
@@ -71,19 +172,19 @@ class WeChatPayService:
                 'Authorization': f'WECHATPAY2-SHA256-RSA2048 mchid="{self.mch_id}",nonce_str="{nonce_str}",signature="{signature}",timestamp="{timestamp}",serial_no="{self.cert_serial_no}"'
             }
             
-            # 发送请求
-            response = requests.post(
+            # 发送请求（请求体与签名使用同一份字节；商户订单号相同的下单请求可以安全重试）
+            response = await self.http_client.post(
                 self.unified_order_url,
                 headers=headers,
-                json=data,
-                timeout=30
+                content=body.encode('utf-8'),
+                retry_unsafe=True
             )
             
             if response.status_code == 200:
                 result = response.json()
                 if 'prepay_id' in result:
                     # 生成前端调用的支付参数
-                    pay_params = self._generate_jsapi_pay_params(result['prepay_id'])
+                    pay_params = await self._generate_jsapi_pay_params(result['prepay_id'])
                     return {
                         'success': True,
                         'prepay_id': result['prepay_id'],
@@ -106,7 +207,7 @@ class WeChatPayService:
                 'message': f'创建微信支付订单失败: {str(e)}'
             }
     
-    def query_order(self, order_id: str) -> Dict[str, Any]:
+    async def query_order(self, order_id: str) -> Dict[str, Any]:
         """查询订单状态"""
         try:
             url = f"{self.query_order_url}/{order_id}?mchid={self.mch_id}"
@@ -118,14 +219,14 @@ class WeChatPayService:
             url_path = f'/v3/pay/transactions/out-trade-no/{order_id}'
             
             sign_str = f"{method}\n{url_path}\n{timestamp}\n{nonce_str}\n"
-            signature = self._generate_signature(sign_str)
+            signature = await self._generate_signature(sign_str)
             
             headers = {
                 'Accept': 'application/json',
                 'Authorization': f'WECHATPAY2-SHA256-RSA2048 mchid="{self.mch_id}",nonce_str="{nonce_str}",signature="{signature}",timestamp="{timestamp}",serial_no="{self.cert_serial_no}"'
             }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = await self.http_client.get(url, headers=headers)
             
             if response.status_code == 200:
                 result = response.json()
@@ -151,32 +252,15 @@ class WeChatPayService:
         import string
         return ''.join(random.choices(string.ascii_letters + string.digits, k=32))
     
-    def _generate_signature(self, sign_str: str) -> str:
+    async def _generate_signature(self, sign_str: str) -> str:
         """生成签名"""
         try:
-            # 读取私钥
-            with open(self.private_key_path, 'rb') as f:
-                private_key = serialization.load_pem_private_key(
-                    f.read(),
-                    password=None,
-                    backend=default_backend()
-                )
-            
-            # 使用私钥签名
-            signature = private_key.sign(
-                sign_str.encode('utf-8'),
-                padding.PKCS1v15(),
-                hashes.SHA256()
-            )
-            
-            # Base64编码
-            return base64.b64encode(signature).decode('utf-8')
-            
+            return await run_crypto(self.crypto_executor, self.signer.sign, sign_str)
         except Exception as e:
             print(f"生成签名失败: {e}")
             return ""
     
-    def _generate_jsapi_pay_params(self, prepay_id: str) -> Dict[str, str]:
+    async def _generate_jsapi_pay_params(self, prepay_id: str) -> Dict[str, str]:
         """生成JSAPI支付参数"""
         timestamp = str(int(time.time()))
         nonce_str = self._generate_nonce()
@@ -184,7 +268,7 @@ class WeChatPayService:
         
         # 构建签名字符串
         sign_str = f"{self.app_id}\n{timestamp}\n{nonce_str}\n{package}\n"
-        pay_sign = self._generate_signature(sign_str)
+        pay_sign = await self._generate_signature(sign_str)
         
         return {
             'appId': self.app_id,
@@ -195,20 +279,27 @@ class WeChatPayService:
             'paySign': pay_sign
         }
     
-    def verify_notify(self, headers: Dict[str, str], body: str) -> Dict[str, Any]:
+    async def verify_notify(self, headers: Dict[str, str], body: str) -> Dict[str, Any]:
         """验证支付通知"""
         try:
-            # 验证签名
-            timestamp = headers.get('Wechatpay-Timestamp', '')
-            nonce = headers.get('Wechatpay-Nonce', '')
-            signature = headers.get('Wechatpay-Signature', '')
-            serial = headers.get('Wechatpay-Serial', '')
+            # 验证签名（请求头名称不区分大小写）
+            headers = {key.lower(): value for key, value in headers.items()}
+            timestamp = headers.get('wechatpay-timestamp', '')
+            nonce = headers.get('wechatpay-nonce', '')
+            signature = headers.get('wechatpay-signature', '')
+            serial = headers.get('wechatpay-serial', '')
             
             # 构建验签字符串
             sign_str = f"{timestamp}\n{nonce}\n{body}\n"
             
-            # 验证签名（这里需要实现签名验证逻辑）
-            # 实际项目中需要根据微信支付文档实现
+            # 配置了平台证书时校验签名
+            if self.notify_verifier is not None:
+                verified = await run_crypto(self.crypto_executor, self.notify_verifier.verify, sign_str, signature)
+                if not verified:
+                    return {
+                        'success': False,
+                        'message': '签名验证失败'
+                    }
             
             # 解析通知数据
             notify_data = json.loads(body)
@@ -228,7 +319,12 @@ class WeChatPayService:
 class AlipayService:
     """支付宝支付服务"""
     
-    def __init__(self):
+    def __init__(self, http_client: Optional[HttpClient] = None,
+                 crypto_executor: Optional[ThreadPoolExecutor] = None):
+        self.http_client = http_client or get_http_client()
+        self.crypto_executor = crypto_executor
+        self._client = None
+        
         # 支付宝配置
         self.app_id = os.getenv('ALIPAY_APP_ID', '')
         self.private_key_path = os.getenv('ALIPAY_PRIVATE_KEY_PATH', '')
@@ -238,15 +334,15 @@ class AlipayService:
         
         # 环境配置
         self.sandbox = os.getenv('ALIPAY_SANDBOX', 'true').lower() == 'true'
-        self.base_url = 'https://openapi.alipaydev.com/gateway.do' if self.sandbox else 'https://openapi.alipay.com/gateway.do'
+        default_gateway = 'https://openapi.alipaydev.com/gateway.do' if self.sandbox else 'https://openapi.alipay.com/gateway.do'
+        self.base_url = os.getenv('ALIPAY_GATEWAY_URL', default_gateway)
     
-    def create_app_pay_order(self, order_id: str, amount: float, subject: str) -> Dict[str, Any]:
-        """创建APP支付订单"""
-        try:
+    def _get_client(self):
+        """支付宝SDK客户端只负责签名和验签，创建一次后复用"""
+        if self._client is None:
             from alipay import AliPay
             
-            # 初始化支付宝客户端
-            alipay = AliPay(
+            self._client = AliPay(
                 appid=self.app_id,
                 app_notify_url=self.notify_url,
                 app_private_key_path=self.private_key_path,
@@ -254,6 +350,12 @@ class AlipayService:
                 sign_type="RSA2",
                 debug=self.sandbox
             )
+        return self._client
+    
+    def create_app_pay_order(self, order_id: str, amount: float, subject: str) -> Dict[str, Any]:
+        """创建APP支付订单"""
+        try:
+            alipay = self._get_client()
             
             # 构建订单参数
             order_string = alipay.api_alipay_trade_app_pay(
@@ -277,17 +379,7 @@ class AlipayService:
     def create_web_pay_order(self, order_id: str, amount: float, subject: str) -> Dict[str, Any]:
         """创建网页支付订单"""
         try:
-            from alipay import AliPay
-            
-            # 初始化支付宝客户端
-            alipay = AliPay(
-                appid=self.app_id,
-                app_notify_url=self.notify_url,
-                app_private_key_path=self.private_key_path,
-                alipay_public_key_path=self.alipay_public_key_path,
-                sign_type="RSA2",
-                debug=self.sandbox
-            )
+            alipay = self._get_client()
             
             # 构建订单参数
             order_string = alipay.api_alipay_trade_page_pay(
@@ -313,21 +405,13 @@ class AlipayService:
                 'message': f'创建支付宝订单失败: {str(e)}'
             }
     
-    def query_order(self, order_id: str) -> Dict[str, Any]:
+    async def query_order(self, order_id: str) -> Dict[str, Any]:
         """查询订单状态"""
         try:
-            from alipay import AliPay
-            
-            alipay = AliPay(
-                appid=self.app_id,
-                app_notify_url=self.notify_url,
-                app_private_key_path=self.private_key_path,
-                alipay_public_key_path=self.alipay_public_key_path,
-                sign_type="RSA2",
-                debug=self.sandbox
-            )
+            alipay = self._get_client()
             
-            result = alipay.api_alipay_trade_query(out_trade_no=order_id)
+            # SDK同步完成签名、请求和验签，放到线程中执行，不阻塞事件循环
+            result = await asyncio.to_thread(alipay.api_alipay_trade_query, out_trade_no=order_id)
             
             return {
                 'success': True,
@@ -340,22 +424,13 @@ class AlipayService:
                 'message': f'查询订单失败: {str(e)}'
             }
     
-    def verify_notify(self, data: Dict[str, str]) -> Dict[str, Any]:
+    async def verify_notify(self, data: Dict[str, str]) -> Dict[str, Any]:
         """验证支付通知"""
         try:
-            from alipay import AliPay
-            
-            alipay = AliPay(
-                appid=self.app_id,
-                app_notify_url=self.notify_url,
-                app_private_key_path=self.private_key_path,
-                alipay_public_key_path=self.alipay_public_key_path,
-                sign_type="RSA2",
-                debug=self.sandbox
-            )
+            alipay = self._get_client()
             
             # 验证签名
-            success = alipay.verify(data, data.get('sign'))
+            success = await run_crypto(self.crypto_executor, alipay.verify, data, data.get('sign'))
             
             if success:
                 return {
@@ -378,11 +453,27 @@ class AlipayService:
 class PaymentService:
     """统一支付服务"""
     
-    def __init__(self):
-        self.wechat_pay = WeChatPayService()
-        self.alipay = AlipayService()
+    def __init__(self, http_client: Optional[HttpClient] = None, crypto_workers: int = None):
+        # 签名/验签线程池，为0时在事件循环中直接执行
+        crypto_workers = crypto_workers if crypto_workers is not None else int(os.getenv('PAYMENT_CRYPTO_WORKERS', '0'))
+        self.crypto_executor = ThreadPoolExecutor(max_workers=crypto_workers, thread_name_prefix="payment-crypto") if crypto_workers > 0 else None
+        self.wechat_pay = WeChatPayService(http_client, self.crypto_executor)
+        self.alipay = AlipayService(http_client, self.crypto_executor)
+    
+    def preload_keys(self):
+        """启动时加载支付密钥"""
+        if self.wechat_pay.signer.preload():
+            print("🔑 微信支付商户私钥已加载")
+        if self.wechat_pay.notify_verifier is not None and self.wechat_pay.notify_verifier.preload():
+            print("🔑 微信支付平台证书已加载")
+    
+    def close(self):
+        """关闭签名线程池"""
+        if self.crypto_executor is not None:
+            self.crypto_executor.shutdown(wait=True)
+            self.crypto_executor = None
     
-    def create_payment_order(self, payment_method: str, order_id: str, amount: float, 
+    async def create_payment_order(self, payment_method: str, order_id: str, amount: float, 
                            description: str, **kwargs) -> Dict[str, Any]:
         """创建支付订单"""
         try:
@@ -395,7 +486,7 @@ class PaymentService:
                 if not openid:
                     return {'success': False, 'message': '微信支付需要openid'}
                 
-                return self.wechat_pay.create_jsapi_order(
+                return await self.wechat_pay.create_jsapi_order(
                     order_id=order_id,
                     amount=amount_cents,
                     description=description,
@@ -418,30 +509,30 @@ class PaymentService:
         except Exception as e:
             return {'success': False, 'message': f'创建支付订单失败: {str(e)}'}
     
-    def query_payment_order(self, payment_method: str, order_id: str) -> Dict[str, Any]:
+    async def query_payment_order(self, payment_method: str, order_id: str) -> Dict[str, Any]:
         """查询支付订单"""
         try:
             if payment_method == 'wechat':
-                return self.wechat_pay.query_order(order_id)
+                return await self.wechat_pay.query_order(order_id)
             elif payment_method == 'alipay':
-                return self.alipay.query_order(order_id)
+                return await self.alipay.query_order(order_id)
             else:
                 return {'success': False, 'message': '不支持的支付方式'}
                 
         except Exception as e:
             return {'success': False, 'message': f'查询订单失败: {str(e)}'}
     
-    def verify_payment_notify(self, payment_method: str, **kwargs) -> Dict[str, Any]:
+    async def verify_payment_notify(self, payment_method: str, **kwargs) -> Dict[str, Any]:
         """验证支付通知"""
         try:
             if payment_method == 'wechat':
                 headers = kwargs.get('headers', {})
                 body = kwargs.get('body', '')
-                return self.wechat_pay.verify_notify(headers, body)
+                return await self.wechat_pay.verify_notify(headers, body)
             
             elif payment_method == 'alipay':
                 data = kwargs.get('data', {})
-                return self.alipay.verify_notify(data)
+                return await self.alipay.verify_notify(data)
             
             else:
                 return {'success': False, 'message': '不支持的支付方式'}
@@ -1,15 +1,19 @@
 import os
-import requests
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional
 import sys
 
+import httpx
+
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
+from http_client import HttpClient, get_http_client
 
 class PersonalityService:
-    def __init__(self):
+    def __init__(self, http_client: Optional[HttpClient] = None):
+        self.http_client = http_client or get_http_client()
+        
         # 性格测试问题定义
         self.questions = {
             1: "当遇到陌生人时，你的宠物通常会：",
@@ -129,64 +133,97 @@ class PersonalityService:
         }
         return descriptions.get(personality_type, "这是一个独特的性格类型。")
     
-    def _call_deepseek_api(self, prompt: str) -> str:
+    def _build_deepseek_request(self, prompt: str):
+        """构建DeepSeek API请求，返回 (url, headers, data)"""
+        # 从配置文件读取DeepSeek API配置
+        api_key = Config.DEEPSEEK_API_KEY
+        api_url = os.getenv('DEEPSEEK_API_URL', Config.DEEPSEEK_API_URL)
+        
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": "deepseek-chat",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的宠物情感表达专家，擅长以宠物的身份写温暖感人的信件。"
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            "top_p": 0.9
+        }
+        return api_url, headers, data
+    
+    def _parse_deepseek_response(self, response: httpx.Response) -> str:
+        """解析DeepSeek API响应"""
+        response.raise_for_status()
+        
+        result = response.json()
+        if "choices" in result and len(result["choices"]) > 0:
+            content = result["choices"][0]["message"]["content"]
+            return content.strip()
+        else:
+            raise Exception("API响应格式错误")
+    
+    async def _call_deepseek_api(self, prompt: str) -> str:
         """调用DeepSeek API生成AI信件"""
+        api_url, headers, data = self._build_deepseek_request(prompt)
         try:
-            # 从配置文件读取DeepSeek API配置
-            api_key = Config.DEEPSEEK_API_KEY
-            api_url = Config.DEEPSEEK_API_URL
-            
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的宠物情感表达专家，擅长以宠物的身份写温暖感人的信件。"
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.7,
-                "top_p": 0.9
-            }
-            
-            response = requests.post(api_url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-                return content.strip()
-            else:
-                raise Exception("API响应格式错误")
-                
-        except requests.exceptions.RequestException as e:
+            # 由AI信件后台任务调用，失败后按任务的退避策略整体重试，这里不再重试（每次调用都计费）
+            response = await self.http_client.post(api_url, headers=headers, json=data, retries=0)
+            return self._parse_deepseek_response(response)
+        except Exception as e:
+            raise self._wrap_deepseek_error(e)
+    
+    def _call_deepseek_api_sync(self, prompt: str) -> str:
+        """同步调用DeepSeek API（未启用后台任务时使用）"""
+        api_url, headers, data = self._build_deepseek_request(prompt)
+        try:
+            # 没有外层任务重试，生成信件没有副作用，超时等错误也在这里重试
+            response = self.http_client.request_sync("POST", api_url, headers=headers, json=data, retry_unsafe=True)
+            return self._parse_deepseek_response(response)
+        except Exception as e:
+            raise self._wrap_deepseek_error(e)
+    
+    @staticmethod
+    def _wrap_deepseek_error(e: Exception) -> Exception:
+        if isinstance(e, httpx.HTTPError):
             print(f"网络请求错误: {e}")
-            raise Exception(f"网络请求失败: {e}")
-        except json.JSONDecodeError as e:
+            return Exception(f"网络请求失败: {e}")
+        if isinstance(e, json.JSONDecodeError):
             print(f"JSON解析错误: {e}")
-            raise Exception(f"响应解析失败: {e}")
+            return Exception(f"响应解析失败: {e}")
+        print(f"DeepSeek API调用异常: {e}")
+        return Exception(f"API调用失败: {e}")
+    
+    async def request_ai_letter(self, pet_info: Dict, personality_type: str, answers: Dict[int, str]) -> str:
+        """调用DeepSeek生成AI信件，失败时抛出异常（供后台任务重试）"""
+        prompt = self._build_letter_prompt(pet_info, personality_type, answers)
+        return await self._call_deepseek_api(prompt)
+    
+    def generate_template_letter(self, pet_info: Dict, personality_type: str, answers: Dict[int, str]) -> str:
+        """生成模板信件，AI信件生成完成前作为占位内容"""
+        try:
+            return self._generate_template_letter(pet_info, personality_type, answers)
         except Exception as e:
-            print(f"DeepSeek API调用异常: {e}")
-            raise Exception(f"API调用失败: {e}")
+            print(f"模板信件生成失败: {e}")
+            return self._generate_fallback_letter(pet_info, personality_type)
     
     def generate_ai_letter(self, pet_info: Dict, personality_type: str, answers: Dict[int, str]) -> str:
         """使用DeepSeek生成AI信件"""
         try:
-            # 构建提示词
-            prompt = self._build_letter_prompt(pet_info, personality_type, answers)
-            
             # 尝试调用DeepSeek API
             try:
-                return self._call_deepseek_api(prompt)
+                prompt = self._build_letter_prompt(pet_info, personality_type, answers)
+                return self._call_deepseek_api_sync(prompt)
             except Exception as api_error:
                 print(f"DeepSeek API调用失败: {api_error}")
                 # 如果API调用失败，返回模板信件
@@ -0,0 +1,120 @@
+"""
+照片文件清理
+定期按 memorial_photos 校正 photo_blobs 引用计数，
+删除超过宽限期仍无引用的照片文件及其缩略图，以及上传中断遗留的临时文件
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from uploads import BLOB_LOCK
+
+
+class PhotoSweeper:
+    """无引用照片文件清理任务"""
+
+    def __init__(self, db, photos_dir: str, url_prefix: str = "/storage/photos",
+                 interval: float = None, grace_seconds: int = None):
+        self.db = db
+        self.photos_dir = photos_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.interval = interval or float(os.getenv('PHOTO_SWEEP_INTERVAL', '3600'))
+        self.grace_seconds = grace_seconds or int(os.getenv('PHOTO_ORPHAN_GRACE', '86400'))
+
+        self._worker = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    async def start(self):
+        """启动定时清理协程"""
+        if self._worker:
+            return
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止清理协程"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"❌ 照片清理异常: {e}")
+
+    def _path_for_url(self, url: str) -> Optional[str]:
+        if not url.startswith(self.url_prefix + "/"):
+            return None
+        relative = url[len(self.url_prefix) + 1:]
+        if relative.startswith(".") or ".." in relative:
+            return None
+        return os.path.join(self.photos_dir, *relative.split("/"))
+
+    @staticmethod
+    def _remove(path: Optional[str]) -> int:
+        """删除文件，返回释放的字节数"""
+        if not path:
+            return 0
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def sweep(self) -> Dict[str, Any]:
+        """执行一次清理，返回统计信息"""
+        started = time.monotonic()
+        stats = {"reconciled": self.db.reconcile_photo_refcounts(), "blobs": 0, "temp_files": 0, "bytes": 0}
+
+        while True:
+            orphans = self.db.get_orphan_photo_blobs(self.grace_seconds)
+            if not orphans:
+                break
+            removed_any = False
+            for blob in orphans:
+                variant_urls = [
+                    url
+                    for formats in self.db.get_photo_variants([blob["photo_url"]]).get(blob["photo_url"], {}).values()
+                    for url in formats.values()
+                ]
+                # 数据库记录删除成功（期间没有新引用）后再删文件，与上传登记互斥
+                with BLOB_LOCK:
+                    if not self.db.delete_photo_blob(blob["sha256"], self.grace_seconds):
+                        continue
+                    stats["bytes"] += self._remove(self._path_for_url(blob["photo_url"]))
+                    for url in variant_urls:
+                        stats["bytes"] += self._remove(self._path_for_url(url))
+                removed_any = True
+                stats["blobs"] += 1
+            if not removed_any:
+                break
+
+        # 上传中断遗留的临时文件
+        cutoff = time.time() - self.grace_seconds
+        for directory in (self.photos_dir, os.path.join(self.photos_dir, "variants")):
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.startswith(".") and name.endswith(".part") and os.path.getmtime(path) < cutoff:
+                    stats["bytes"] += self._remove(path)
+                    stats["temp_files"] += 1
+
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        self.last_run = stats
+        if stats["blobs"] or stats["temp_files"]:
+            print(f"🧹 照片清理: 删除 {stats['blobs']} 个文件、{stats['temp_files']} 个临时文件，释放 {stats['bytes']} 字节")
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取最近一次清理的统计信息"""
+        return {
+            "interval": self.interval,
+            "grace_seconds": self.grace_seconds,
+            "last_run": self.last_run
+        }
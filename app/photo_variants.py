@@ -0,0 +1,190 @@
+"""
+照片缩略图生成
+上传完成后在进程池中为每张照片生成缩略图和中等尺寸版本（WebP + JPEG），
+生成结果记录在 photo_variants 表中，页面和接口按需选择合适的尺寸
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+# 版本名 -> 最长边像素
+VARIANT_SIZES = {
+    "thumb": 320,
+    "medium": 1280,
+}
+
+# 输出格式 -> (扩展名, Pillow保存参数)
+VARIANT_FORMATS = {
+    "webp": ("webp", {"format": "WEBP", "quality": 80, "method": 4}),
+    "jpeg": ("jpg", {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def render_variants(source_path: str, output_dir: str, stem: str) -> List[Dict[str, Any]]:
+    """
+    生成一张照片的所有版本，在子进程中执行
+    返回 [{"variant", "format", "filename", "width", "height", "bytes"}, ...]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        for variant, max_side in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            for fmt, (ext, save_kwargs) in VARIANT_FORMATS.items():
+                filename = f"{stem}_{variant}.{ext}"
+                final_path = os.path.join(output_dir, filename)
+                temp_path = os.path.join(output_dir, f".{filename}.part")
+                resized.save(temp_path, **save_kwargs)
+                os.replace(temp_path, final_path)
+                results.append({
+                    "variant": variant,
+                    "format": fmt,
+                    "filename": filename,
+                    "width": resized.width,
+                    "height": resized.height,
+                    "bytes": os.path.getsize(final_path)
+                })
+
+    return results
+
+
+class PhotoVariantGenerator:
+    """照片多尺寸版本生成器"""
+
+    def __init__(self, db, photos_dir: str, url_prefix: str = "/storage/photos", workers: int = None):
+        self.db = db
+        self.photos_dir = photos_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.variants_dir = os.path.join(photos_dir, "variants")
+        self.workers = workers or int(os.getenv('PHOTO_VARIANT_WORKERS', '2'))
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = set()
+        # 纪念馆页面重新生成队列，设置后照片版本生成完成时重新生成引用该照片的页面
+        self.rerender_queue = None
+
+        if Image is None:
+            print("⚠️ 未安装Pillow，跳过照片缩略图生成")
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _source_path(self, photo_url: str) -> Optional[str]:
+        if not photo_url.startswith(self.url_prefix + "/"):
+            return None
+        name = photo_url[len(self.url_prefix) + 1:]
+        if "/" in name or name.startswith("."):
+            return None
+        return os.path.join(self.photos_dir, name)
+
+    def _record(self, photo_url: str, results: List[Dict[str, Any]]):
+        for item in results:
+            item["url"] = f"{self.url_prefix}/variants/{item.pop('filename')}"
+        self.db.save_photo_variants(photo_url, results)
+
+    def schedule(self, photo_urls: List[str]):
+        """在后台为新上传的照片生成各尺寸版本，需在事件循环中调用"""
+        if not self.enabled:
+            return
+        self._track(self._schedule_async(list(dict.fromkeys(photo_urls))))
+
+    def _track(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _schedule_async(self, photo_urls: List[str]):
+        # 照片按内容寻址，重复上传的照片已有版本时无需重新生成
+        try:
+            existing = await asyncio.to_thread(self.db.get_photo_variants, photo_urls)
+        except Exception as e:
+            print(f"⚠️ 查询照片版本失败: {e}")
+            return
+        for photo_url in photo_urls:
+            if photo_url not in existing:
+                self._track(self._generate_async(photo_url))
+
+    async def _generate_async(self, photo_url: str):
+        source_path = self._source_path(photo_url)
+        if source_path is None:
+            return
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), render_variants, source_path, self.variants_dir, stem
+            )
+            await asyncio.to_thread(self._record, photo_url, results)
+            if self.rerender_queue is not None:
+                # 页面生成时还没有缩略图，记录后重新生成才能用上
+                memorial_ids = await asyncio.to_thread(self.db.get_photo_memorial_ids, [photo_url])
+                for memorial_id in memorial_ids:
+                    self.rerender_queue.mark_dirty(memorial_id)
+        except Exception as e:
+            print(f"⚠️ 照片缩略图生成失败 {photo_url}: {e}")
+
+    def generate_many(self, photo_urls: List[str]) -> Dict[str, int]:
+        """同步为一批照片生成各尺寸版本（用于补全历史照片），返回成功/失败数量"""
+        stats = {"done": 0, "failed": 0}
+        if not self.enabled:
+            return stats
+
+        executor = self._get_executor()
+        futures = {}
+        for photo_url in photo_urls:
+            source_path = self._source_path(photo_url)
+            if source_path is None or not os.path.exists(source_path):
+                stats["failed"] += 1
+                continue
+            stem = os.path.splitext(os.path.basename(source_path))[0]
+            futures[executor.submit(render_variants, source_path, self.variants_dir, stem)] = photo_url
+
+        for future in as_completed(futures):
+            photo_url = futures[future]
+            try:
+                self._record(photo_url, future.result())
+                stats["done"] += 1
+            except Exception as e:
+                print(f"⚠️ 照片缩略图生成失败 {photo_url}: {e}")
+                stats["failed"] += 1
+        return stats
+
+    def pick(self, variants: Dict[str, Dict[str, str]], variant: str, accept_webp: bool) -> Optional[str]:
+        """从 get_photo_variants 的结果中选择一个尺寸的URL"""
+        formats = variants.get(variant) or {}
+        if accept_webp and formats.get("webp"):
+            return formats["webp"]
+        return formats.get("jpeg")
+
+    def close(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def stop(self):
+        """等待进行中的任务完成并关闭进程池"""
+        # 查询任务完成后才会提交生成任务，循环等待直到全部完成
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        self.close()
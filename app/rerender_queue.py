@@ -0,0 +1,111 @@
+"""
+纪念馆页面重新生成队列
+纪念馆数据变化时只把ID标记为脏，后台协程合并短时间内的多次修改，
+到期后按数据库中的最新数据重新生成一次页面
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class MemorialRerenderQueue:
+    """纪念馆页面脏队列"""
+
+    def __init__(self, memorial_service, delay: float = None, max_delay: float = None):
+        self.memorial_service = memorial_service
+        # 最后一次修改后等待 delay 秒再生成，持续修改时最多推迟 max_delay 秒
+        self.delay = delay if delay is not None else float(os.getenv('MEMORIAL_RERENDER_DELAY', '2'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('MEMORIAL_RERENDER_MAX_DELAY', '10'))
+
+        self._lock = threading.Lock()
+        # memorial_id -> (首次标记时间, 到期时间)
+        self._dirty: Dict[str, tuple] = {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker = None
+
+        self.marked = 0
+        self.rendered = 0
+        self.failed = 0
+
+    async def start(self):
+        """启动生成协程"""
+        if self._worker:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止生成协程，并立即生成剩余的脏页面"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        with self._lock:
+            pending, self._dirty = list(self._dirty), {}
+        for memorial_id in pending:
+            await asyncio.to_thread(self._render, memorial_id)
+
+    def mark_dirty(self, memorial_id: str):
+        """标记纪念馆页面需要重新生成，可在任意线程调用"""
+        now = time.monotonic()
+        with self._lock:
+            first, _ = self._dirty.get(memorial_id, (now, None))
+            self._dirty[memorial_id] = (first, min(now + self.delay, first + self.max_delay))
+            self.marked += 1
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take_due(self):
+        """取出已到期的ID，返回 (ID列表, 距下一个到期的秒数)"""
+        now = time.monotonic()
+        due = []
+        next_wait = None
+        with self._lock:
+            for memorial_id, (_, deadline) in list(self._dirty.items()):
+                if deadline <= now:
+                    due.append(memorial_id)
+                    del self._dirty[memorial_id]
+                else:
+                    wait = deadline - now
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+        return due, next_wait
+
+    async def _run(self):
+        while True:
+            due, next_wait = self._take_due()
+            for memorial_id in due:
+                await asyncio.to_thread(self._render, memorial_id)
+            if due:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_wait)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _render(self, memorial_id: str):
+        # 生成期间再次被标记的纪念馆会留在队列中，稍后再生成一次
+        try:
+            if self.memorial_service.rerender_memorial(memorial_id):
+                self.rendered += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ 纪念馆页面重新生成失败 {memorial_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        with self._lock:
+            pending = len(self._dirty)
+        return {
+            "pending": pending,
+            "marked": self.marked,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "delay": self.delay,
+            "max_delay": self.max_delay
+        }
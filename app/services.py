@@ -1,20 +1,32 @@
 import os
 import uuid
-import zipfile
 import qrcode
 import io
-from jinja2 import Environment, FileSystemLoader
-from fastapi.responses import FileResponse, StreamingResponse, HTMLResponse
+import threading
+from fastapi.responses import StreamingResponse, HTMLResponse
 
 from datetime import datetime
 from pathlib import Path
 from personality_service import PersonalityService
+from static_assets import StaticAssets
+from template_env import get_template_env
+from memorial_export import MemorialExporter
+from legacy_pages import legacy_page_photos
 
 class MemorialService:
-    def __init__(self, db):
+    def __init__(self, db, page_cache=None, assets=None, env=None):
         self.db = db
-        self.env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")))
+        self.page_cache = page_cache
+        # 页面引用的带指纹CSS/JS
+        self.assets = assets or StaticAssets()
+        # AI信件后台任务队列，未设置时同步生成AI信件
+        self.letter_jobs = None
+        # 共享的模板环境（字节码缓存），与 main.py 中的 Jinja2Templates 相同
+        self.env = env or get_template_env()
+        self.env.globals['asset_url'] = self.assets.url
         self.personality_service = PersonalityService()
+        # 纪念馆下载包（按内容版本缓存）
+        self.exporter = MemorialExporter(db)
         
         # 创建必要的存储目录
         storage_base = os.path.join(os.path.dirname(__file__), "..", "storage")
@@ -53,23 +65,17 @@ class MemorialService:
         personality_type = self.personality_service.analyze_personality(personality_answers)
         self.db.update_pet_personality(pet_id, personality_type)
         
-        # 生成AI信件
-        ai_letter = self.personality_service.generate_ai_letter(pet_info, personality_type, personality_answers)
-        
-        # 生成纪念馆HTML
-        memorial_url = self._generate_html_advanced(
-            memorial_id=memorial_id,
-            pet_info=pet_info,
-            personality_type=personality_type,
-            ai_letter=ai_letter,
-            photos=photos
-        )
+        # 生成AI信件：启用后台任务时先使用模板信件，AI信件生成后再更新页面
+        if self.letter_jobs:
+            ai_letter = self.personality_service.generate_template_letter(pet_info, personality_type, personality_answers)
+        else:
+            ai_letter = self.personality_service.generate_ai_letter(pet_info, personality_type, personality_answers)
         
         # 创建纪念馆记录
         self.db.create_memorial_record(
             memorial_id=memorial_id,
             pet_id=pet_id,
-            memorial_url=memorial_url,
+            memorial_url=f"/memorial/{memorial_id}",
             ai_letter=ai_letter
         )
         
@@ -77,6 +83,24 @@ class MemorialService:
         if user_id:
             self.db.link_memorial_to_user(user_id, memorial_id)
         
+        # 记录纪念馆照片（同时增加照片文件引用计数）；先于页面生成记录，
+        # 生成页面之后才完成的照片缩略图可以按照片找到这个纪念馆并重新生成
+        for photo_url in photos:
+            self.db.add_memorial_photo(memorial_id, photo_url)
+        
+        # 生成纪念馆HTML
+        memorial_url = self._generate_html_advanced(
+            memorial_id=memorial_id,
+            pet_info=pet_info,
+            personality_type=personality_type,
+            ai_letter=ai_letter,
+            photos=photos
+        )
+        
+        # 提交AI信件后台任务
+        if self.letter_jobs:
+            self.letter_jobs.enqueue(memorial_id, pet_info, personality_type, personality_answers, photos)
+        
         return memorial_url, personality_type, ai_letter
     
     def get_personality_questions(self):
@@ -129,32 +153,8 @@ class MemorialService:
         return HTMLResponse(content=content)
     
     def create_download_package(self, memorial_id):
-        """创建纪念馆下载包"""
-        storage_base = os.path.join(os.path.dirname(__file__), "..", "storage")
-        # 创建ZIP文件
-        zip_path = os.path.join(storage_base, "downloads", f"{memorial_id}.zip")
-        
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            # 添加纪念馆HTML
-            html_path = os.path.join(storage_base, "memorials", f"{memorial_id}.html")
-            if os.path.exists(html_path):
-                zipf.write(html_path, f"{memorial_id}.html")
-            
-            # 添加照片
-            photos_dir = os.path.join(storage_base, "photos")
-            for root, _, files in os.walk(photos_dir):
-                for file in files:
-                    if memorial_id in file:  # 简单的关联判断
-                        file_path = os.path.join(root, file)
-                        zipf.write(file_path, f"photos/{file}")
-            
-
-        
-        return FileResponse(
-            zip_path,
-            media_type='application/zip',
-            filename=f"{memorial_id}_memorial.zip"
-        )
+        """创建纪念馆下载包（流式ZIP），纪念馆不存在时返回None"""
+        return self.exporter.response(memorial_id)
     
     def generate_qrcode(self, memorial_id):
         """生成纪念馆二维码"""
@@ -180,6 +180,58 @@ class MemorialService:
         )
     
 
+    def _write_page(self, memorial_id, html_content):
+        """保存HTML文件（先写临时文件再原子替换，访问者不会读到写了一半的页面）"""
+        filename = f"{memorial_id}.html"
+        storage_base = os.path.join(os.path.dirname(__file__), "..", "storage")
+        path = os.path.join(storage_base, "memorials", filename)
+        temp_path = os.path.join(storage_base, "memorials", f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(html_content)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        # 预热页面缓存
+        if self.page_cache:
+            self.page_cache.put(memorial_id, html_content)
+        
+        return f"/memorial/{memorial_id}"
+    
+    def rerender_memorial(self, memorial_id):
+        """按数据库中的最新数据重新生成纪念馆页面，纪念馆不存在或页面被保留时返回False"""
+        data = self.db.get_memorial_render_data(memorial_id)
+        if not data:
+            return False
+        return self.write_memorial_page(memorial_id, data) is not None
+    
+    def has_unmigrated_photos(self, memorial_id, photos):
+        """现有页面是早期版本且其中有 memorial_photos 中没有的照片（照片尚未完整回填）"""
+        registered = set(photos)
+        return any(url not in registered for url in legacy_page_photos(memorial_id))
+    
+    def write_memorial_page(self, memorial_id, data):
+        """
+        按 get_memorial_render_data / get_memorial_render_batch 返回的数据生成并保存纪念馆页面
+        现有早期页面中有照片记录里没有的照片时保留现有页面并返回None，避免重新生成后照片丢失
+        （运行 migrate_memorial_tables.py 从页面回填照片后即可正常生成）
+        """
+        if self.has_unmigrated_photos(memorial_id, data['photos']):
+            print(f"⚠️ 纪念馆 {memorial_id} 的照片尚未回填到 memorial_photos，保留现有页面")
+            return None
+        return self._generate_html_advanced(
+            memorial_id=memorial_id,
+            pet_info=data['pet_info'],
+            personality_type=data['personality_type'],
+            ai_letter=data['ai_letter'],
+            photos=data['photos'],
+            personality_description=data['personality'],
+            photo_variants=data.get('photo_variants')
+        )
+    
     def _generate_html(self, memorial_id, pet_name, species, memorial_date, photos):
         """生成纪念馆HTML页面"""
         template = self.env.get_template('memorial.html')
@@ -189,22 +241,20 @@ class MemorialService:
             species=species,
             memorial_date=memorial_date,
             photos=photos,
+            photo_variants=self.db.get_photo_variants(photos),
             current_year=datetime.now().year
         )
         
-        # 保存HTML文件
-        filename = f"{memorial_id}.html"
-        storage_base = os.path.join(os.path.dirname(__file__), "..", "storage")
-        path = os.path.join(storage_base, "memorials", filename)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        
-        return f"/memorial/{memorial_id}"
+        return self._write_page(memorial_id, html_content)
 
 
 
-    def _generate_html_advanced(self, memorial_id, pet_info, personality_type, ai_letter, photos):
-        """生成纪念馆HTML页面（包含性格测试和AI信件）"""
+    def _generate_html_advanced(self, memorial_id, pet_info, personality_type, ai_letter, photos,
+                                personality_description=None, photo_variants=None):
+        """
+        生成纪念馆HTML页面（包含性格测试和AI信件），personality_description 为用户编辑的性格描述
+        photo_variants 已批量查询时传入，未传入时从数据库读取
+        """
         template = self.env.get_template('memorial.html')
         
         html_content = template.render(
@@ -218,20 +268,14 @@ class MemorialService:
             memorial_date=pet_info.get('memorial_date', ''),
             pet_status=pet_info.get('status', 'alive'),
             personality_type=personality_type,
-            personality_description=self.get_personality_description(personality_type),
+            personality_description=personality_description or self.get_personality_description(personality_type),
             ai_letter=ai_letter,
             photos=photos,
+            photo_variants=photo_variants if photo_variants is not None else self.db.get_photo_variants(photos),
             current_year=datetime.now().year
         )
         
-        # 保存HTML文件
-        filename = f"{memorial_id}.html"
-        storage_base = os.path.join(os.path.dirname(__file__), "..", "storage")
-        path = os.path.join(storage_base, "memorials", filename)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        
-        return f"/memorial/{memorial_id}"
+        return self._write_page(memorial_id, html_content)
 
 
 class EmailService:
@@ -253,6 +297,9 @@ class EmailService:
         if os.getenv('SENDER_PASSWORD'):
             self.sender_password = os.getenv('SENDER_PASSWORD')
         
+        # 邮件发送队列，设置后邮件只入队，由后台协程发送
+        self.dispatcher = None
+        
         print(f"📧 邮件服务配置:")
         print(f"   SMTP服务器: {self.smtp_server}")
         print(f"   SMTP端口: {self.smtp_port}")
@@ -444,6 +491,11 @@ class EmailService:
     
     def _send_email(self, to_email, subject, html_content):
         """发送邮件"""
+        if self.dispatcher:
+            self.dispatcher.enqueue(to_email, subject, html_content)
+            print(f"📨 邮件已加入发送队列: {to_email}")
+            return True
+        
         try:
             import smtplib
             from email.mime.text import MIMEText
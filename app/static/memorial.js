@@ -0,0 +1,603 @@
+// 纪念馆页面脚本（构建时生成带内容指纹的文件）
+// 创建星星背景
+function createStars() {
+    const container = document.getElementById('stars');
+    const starCount = 50;
+
+    for (let i = 0; i < starCount; i++) {
+        const star = document.createElement('div');
+        star.classList.add('star');
+
+        // 随机位置和大小
+        const size = Math.random() * 3 + 1;
+        star.style.width = `${size}px`;
+        star.style.height = `${size}px`;
+        star.style.left = `${Math.random() * 100}%`;
+        star.style.top = `${Math.random() * 100}%`;
+
+        // 随机动画参数
+        const duration = Math.random() * 3 + 2;
+        const delay = Math.random() * 5;
+        star.style.animation = `twinkle ${duration}s infinite ${delay}s`;
+
+        container.appendChild(star);
+    }
+}
+
+// 页面加载完成后创建星星
+window.addEventListener('load', createStars);
+
+// 页面加载完成后加载留言
+window.addEventListener('load', loadMessages);
+
+// 页面加载完成后初始化新功能
+window.addEventListener('load', function() {
+    initMoodDiary();
+    initPhotoCarousel();
+    loadVisitStats();
+    recordVisit();
+});
+
+// 获取纪念馆ID
+function getMemorialId() {
+    const path = window.location.pathname;
+    const match = path.match(/\/memorial\/(.+)/);
+    return match ? match[1] : null;
+}
+
+// 留言分页状态
+let messagesCursor = null;
+let loadedMessages = [];
+
+// 加载留言（从第一页开始）
+async function loadMessages() {
+    messagesCursor = null;
+    loadedMessages = [];
+    await fetchMessagesPage();
+}
+
+// 加载下一页留言
+async function loadMoreMessages() {
+    await fetchMessagesPage();
+}
+
+async function fetchMessagesPage() {
+    const memorialId = getMemorialId();
+    if (!memorialId) return;
+
+    try {
+        const cursorParam = messagesCursor ? `?cursor=${encodeURIComponent(messagesCursor)}` : '';
+        const response = await fetch(`/api/messages/${memorialId}${cursorParam}`);
+        const data = await response.json();
+
+        if (data.success) {
+            loadedMessages = loadedMessages.concat(data.messages);
+            messagesCursor = data.next_cursor || null;
+            displayMessages(loadedMessages);
+        }
+    } catch (error) {
+        console.error('加载留言失败:', error);
+    }
+}
+
+// 显示留言
+function displayMessages(messages) {
+    const messagesList = document.getElementById('messagesList');
+    if (!messagesList) return;
+
+    if (messages.length === 0) {
+        messagesList.innerHTML = '<p style="text-align: center; color: #999; padding: 20px;">还没有留言，快来留下您的思念吧...</p>';
+        return;
+    }
+
+    messagesList.innerHTML = messages.map(msg => `
+        <div class="message-item">
+            <div class="message-header">
+                <span class="visitor-name">${msg.visitor_name}</span>
+                <span class="message-time">${formatTime(msg.created_at)}</span>
+            </div>
+            <div class="message-content">${msg.message}</div>
+        </div>
+    `).join('') + (messagesCursor ? `
+        <div style="text-align: center; padding: 10px;">
+            <button type="button" class="btn" onclick="loadMoreMessages()">加载更多留言</button>
+        </div>
+    ` : '');
+}
+
+// 提交留言
+async function submitMessage() {
+    const visitorName = document.getElementById('visitorName').value.trim();
+    const messageText = document.getElementById('messageText').value.trim();
+    const memorialId = getMemorialId();
+
+    if (!visitorName || !messageText) {
+        alert('请填写姓名和留言内容');
+        return;
+    }
+
+    if (!memorialId) {
+        alert('无法获取纪念馆信息');
+        return;
+    }
+
+    try {
+        const formData = new FormData();
+        formData.append('memorial_id', memorialId);
+        formData.append('visitor_name', visitorName);
+        formData.append('message', messageText);
+
+        const response = await fetch('/api/message', {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            alert('留言发表成功！');
+            document.getElementById('visitorName').value = '';
+            document.getElementById('messageText').value = '';
+            loadMessages(); // 重新加载留言
+        } else {
+            alert('留言发表失败：' + data.error);
+        }
+    } catch (error) {
+        console.error('提交留言失败:', error);
+        alert('留言发表失败，请稍后重试');
+    }
+}
+
+// 格式化时间
+function formatTime(timeStr) {
+    if (!timeStr) return '';
+    const date = new Date(timeStr);
+    return date.toLocaleString('zh-CN');
+}
+
+// 社交分享功能
+function shareToWechat() {
+    // 生成二维码或提示用户手动分享
+    alert('请截图分享到微信');
+}
+
+function shareToQQ() {
+    const url = window.location.href;
+    const title = document.title;
+    const shareUrl = `https://connect.qq.com/widget/shareqq/index.html?url=${encodeURIComponent(url)}&title=${encodeURIComponent(title)}`;
+    window.open(shareUrl, '_blank');
+}
+
+function shareToWeibo() {
+    const url = window.location.href;
+    const title = document.title;
+    const shareUrl = `https://service.weibo.com/share/share.php?url=${encodeURIComponent(url)}&title=${encodeURIComponent(title)}`;
+    window.open(shareUrl, '_blank');
+}
+
+function copyLink() {
+    const url = window.location.href;
+    navigator.clipboard.writeText(url).then(() => {
+        alert('链接已复制到剪贴板！');
+    }).catch(() => {
+        // 降级方案
+        const textArea = document.createElement('textarea');
+        textArea.value = url;
+        document.body.appendChild(textArea);
+        textArea.select();
+        document.execCommand('copy');
+        document.body.removeChild(textArea);
+        alert('链接已复制到剪贴板！');
+    });
+}
+
+// 应用主题
+function applyTheme(themeName) {
+    // 移除所有主题的选中状态
+    document.querySelectorAll('.theme-option').forEach(option => {
+        option.classList.remove('selected');
+    });
+
+    // 添加当前主题的选中状态
+    event.currentTarget.classList.add('selected');
+
+    // 保存选择的主题到localStorage
+    localStorage.setItem('selectedTheme', themeName);
+
+    // 应用主题样式
+    applyThemeStyles(themeName);
+
+    // 显示成功提示
+    showThemeSuccess(themeName);
+
+    // 更新主题状态显示
+    updateThemeStatus(themeName);
+}
+
+// 应用主题样式
+function applyThemeStyles(themeName) {
+    const container = document.querySelector('.memorial-container');
+
+    // 移除所有主题类
+    container.classList.remove('theme-warm', 'theme-elegant', 'theme-nature', 'theme-modern', 'theme-classic', 'theme-simple');
+
+    // 添加新主题类
+    container.classList.add(`theme-${themeName}`);
+}
+
+// 显示主题应用成功提示
+function showThemeSuccess(themeName) {
+    const themeNames = {
+        'warm': '温馨回忆',
+        'elegant': '优雅永恒',
+        'nature': '自然和谐',
+        'modern': '现代简约',
+        'classic': '经典永恒',
+        'simple': '极简主义'
+    };
+
+    // 创建提示元素
+    const notification = document.createElement('div');
+    notification.style.cssText = `
+        position: fixed;
+        top: 20px;
+        right: 20px;
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        color: white;
+        padding: 15px 25px;
+        border-radius: 10px;
+        box-shadow: 0 10px 25px rgba(0,0,0,0.2);
+        z-index: 1000;
+        font-size: 14px;
+        transform: translateX(100%);
+        transition: transform 0.3s ease;
+    `;
+    notification.textContent = `✅ 已应用"${themeNames[themeName]}"主题`;
+
+    document.body.appendChild(notification);
+
+    // 显示动画
+    setTimeout(() => {
+        notification.style.transform = 'translateX(0)';
+    }, 100);
+
+    // 自动隐藏
+    setTimeout(() => {
+        notification.style.transform = 'translateX(100%)';
+        setTimeout(() => {
+            document.body.removeChild(notification);
+        }, 300);
+    }, 3000);
+}
+
+// 更新主题状态显示
+function updateThemeStatus(themeName) {
+    const statusBtn = document.getElementById('themeStatusBtn');
+    if (statusBtn) {
+        statusBtn.innerHTML = `✅ 已应用"${getThemeDisplayName(themeName)}"主题`;
+        statusBtn.className = `theme-status-btn theme-${themeName}`;
+    }
+}
+
+// 获取主题显示名称
+function getThemeDisplayName(themeName) {
+    const themeNames = {
+        'warm': '温馨回忆',
+        'elegant': '优雅永恒',
+        'nature': '自然和谐',
+        'modern': '现代简约',
+        'classic': '经典永恒',
+        'simple': '极简主义'
+    };
+    return themeNames[themeName] || themeName;
+}
+
+// 页面加载时应用保存的主题
+window.addEventListener('load', function() {
+    const savedTheme = localStorage.getItem('selectedTheme');
+    if (savedTheme) {
+        applyThemeStyles(savedTheme);
+        // 标记对应的主题选项为选中状态
+        const themeOption = document.querySelector(`[onclick="applyTheme('${savedTheme}')"]`);
+        if (themeOption) {
+            themeOption.classList.add('selected');
+        }
+        // 更新主题状态显示
+        updateThemeStatus(savedTheme);
+    }
+});
+
+// 打开提醒设置页面
+function openReminderSetup() {
+    const memorialId = getMemorialId();
+    if (memorialId) {
+        window.open(`/reminder-setup?memorial_id=${memorialId}`, '_blank');
+    } else {
+        alert('无法获取纪念馆信息');
+    }
+}
+
+// ========== 心情日记功能 ==========
+function initMoodDiary() {
+    // 初始化心情评分滑块显示
+    const moodSlider = document.getElementById('moodScore');
+    const moodScoreDisplay = document.getElementById('moodScoreDisplay');
+
+    if (moodSlider && moodScoreDisplay) {
+        moodSlider.addEventListener('input', function() {
+            moodScoreDisplay.textContent = this.value;
+        });
+    }
+
+    // 加载心情日记
+    loadMoodDiaries();
+}
+
+async function addMoodDiary() {
+    const moodType = document.getElementById('moodType').value;
+    const moodScore = document.getElementById('moodScore').value;
+    const diaryContent = document.getElementById('diaryContent').value.trim();
+    const weather = document.getElementById('weather').value.trim();
+    const memorialId = getMemorialId();
+
+    if (!diaryContent) {
+        alert('请填写心情内容');
+        return;
+    }
+
+    if (!memorialId) {
+        alert('无法获取纪念馆信息');
+        return;
+    }
+
+    try {
+        const formData = new FormData();
+        formData.append('memorial_id', memorialId);
+        formData.append('mood_type', moodType);
+        formData.append('mood_score', moodScore);
+        formData.append('diary_content', diaryContent);
+        formData.append('weather', weather);
+
+        const response = await fetch('/api/mood-diary', {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            alert('心情日记记录成功！');
+            document.getElementById('diaryContent').value = '';
+            document.getElementById('weather').value = '';
+            loadMoodDiaries(); // 重新加载日记
+        } else {
+            alert('记录失败：' + data.error);
+        }
+    } catch (error) {
+        console.error('记录心情日记失败:', error);
+        alert('记录失败，请稍后重试');
+    }
+}
+
+// 心情日记分页状态
+let diariesCursor = null;
+let loadedDiaries = [];
+
+async function loadMoodDiaries() {
+    diariesCursor = null;
+    loadedDiaries = [];
+    await fetchMoodDiariesPage();
+}
+
+async function loadMoreMoodDiaries() {
+    await fetchMoodDiariesPage();
+}
+
+async function fetchMoodDiariesPage() {
+    const memorialId = getMemorialId();
+    if (!memorialId) return;
+
+    try {
+        const cursorParam = diariesCursor ? `?cursor=${encodeURIComponent(diariesCursor)}` : '';
+        const response = await fetch(`/api/mood-diaries/${memorialId}${cursorParam}`);
+        const data = await response.json();
+
+        if (data.success) {
+            loadedDiaries = loadedDiaries.concat(data.diaries);
+            diariesCursor = data.next_cursor || null;
+            displayMoodDiaries(loadedDiaries);
+        }
+    } catch (error) {
+        console.error('加载心情日记失败:', error);
+    }
+}
+
+function displayMoodDiaries(diaries) {
+    const diariesList = document.getElementById('moodDiariesList');
+    if (!diariesList) return;
+
+    if (diaries.length === 0) {
+        diariesList.innerHTML = '<p style="text-align: center; color: #999; padding: 20px;">还没有心情日记，快来记录您的心情吧...</p>';
+        return;
+    }
+
+    const moodEmojis = {
+        'happy': '😊',
+        'sad': '😢',
+        'peaceful': '😌',
+        'nostalgic': '🥺',
+        'grateful': '🙏'
+    };
+
+    diariesList.innerHTML = diaries.map(diary => `
+        <div class="mood-diary-item">
+            <div class="mood-diary-header">
+                <div class="mood-info">
+                    <span class="mood-emoji">${moodEmojis[diary.mood_type] || '😊'}</span>
+                    <span class="mood-score">${diary.mood_score}/10</span>
+                </div>
+                <span class="diary-time">${formatTime(diary.created_at)}</span>
+            </div>
+            <div class="diary-content">${diary.diary_content}</div>
+            ${diary.weather ? `<div class="diary-weather">🌤️ ${diary.weather}</div>` : ''}
+        </div>
+    `).join('') + (diariesCursor ? `
+        <div style="text-align: center; padding: 10px;">
+            <button type="button" class="btn" onclick="loadMoreMoodDiaries()">加载更多日记</button>
+        </div>
+    ` : '');
+}
+
+// ========== 照片轮播功能 ==========
+let currentSlide = 0;
+let slides = [];
+
+function initPhotoCarousel() {
+    // 获取照片列表并初始化轮播
+    const photos = getPhotoList();
+    if (photos.length > 0) {
+        setupCarousel(photos);
+    }
+}
+
+function getPhotoList() {
+    // 从页面中获取照片列表
+    const photoElements = document.querySelectorAll('.photo-item img');
+    return Array.from(photoElements).map(img => img.dataset.medium || img.src);
+}
+
+function setupCarousel(photoUrls) {
+    slides = photoUrls;
+    const wrapper = document.getElementById('carouselWrapper');
+    const dotsContainer = document.getElementById('carouselDots');
+
+    if (!wrapper || !dotsContainer) return;
+
+    // 创建轮播幻灯片
+    wrapper.innerHTML = photoUrls.map(url => `
+        <div class="carousel-slide">
+            <img src="${url}" alt="宠物照片">
+        </div>
+    `).join('');
+
+    // 创建轮播点
+    dotsContainer.innerHTML = photoUrls.map((_, index) => `
+        <div class="carousel-dot ${index === 0 ? 'active' : ''}" onclick="goToSlide(${index})"></div>
+    `).join('');
+
+    // 自动轮播
+    if (photoUrls.length > 1) {
+        setInterval(() => {
+            changeSlide(1);
+        }, 5000);
+    }
+}
+
+function changeSlide(direction) {
+    if (slides.length <= 1) return;
+
+    currentSlide = (currentSlide + direction + slides.length) % slides.length;
+    updateCarousel();
+}
+
+function goToSlide(index) {
+    currentSlide = index;
+    updateCarousel();
+}
+
+function updateCarousel() {
+    const wrapper = document.getElementById('carouselWrapper');
+    const dots = document.querySelectorAll('.carousel-dot');
+
+    if (wrapper) {
+        wrapper.style.transform = `translateX(-${currentSlide * 100}%)`;
+    }
+
+    // 更新轮播点状态
+    dots.forEach((dot, index) => {
+        dot.classList.toggle('active', index === currentSlide);
+    });
+}
+
+// ========== 访问统计功能 ==========
+async function loadVisitStats() {
+    const memorialId = getMemorialId();
+    if (!memorialId) return;
+
+    try {
+        const response = await fetch(`/api/visit-stats/${memorialId}`);
+        const data = await response.json();
+
+        if (data.success) {
+            displayVisitStats(data.stats);
+        }
+    } catch (error) {
+        console.error('加载访问统计失败:', error);
+    }
+}
+
+function displayVisitStats(stats) {
+    document.getElementById('totalVisits').textContent = stats.total_visits;
+    document.getElementById('uniqueVisitors').textContent = stats.unique_visitors;
+
+    if (stats.last_visit) {
+        document.getElementById('lastVisit').textContent = formatTime(stats.last_visit);
+    } else {
+        document.getElementById('lastVisit').textContent = '-';
+    }
+}
+
+async function recordVisit() {
+    const memorialId = getMemorialId();
+    if (!memorialId) return;
+
+    try {
+        const formData = new FormData();
+        formData.append('memorial_id', memorialId);
+
+        await fetch('/api/visit-stat', {
+            method: 'POST',
+            body: formData
+        });
+    } catch (error) {
+        console.error('记录访问失败:', error);
+    }
+}
+
+
+
+// 辅助函数：格式化时间
+function formatTime(timestamp) {
+    if (!timestamp) return '';
+
+    const date = new Date(timestamp);
+    const now = new Date();
+    const diff = now - date;
+
+    if (diff < 60000) { // 1分钟内
+        return '刚刚';
+    } else if (diff < 3600000) { // 1小时内
+        return `${Math.floor(diff / 60000)}分钟前`;
+    } else if (diff < 86400000) { // 1天内
+        return `${Math.floor(diff / 3600000)}小时前`;
+    } else if (diff < 2592000000) { // 30天内
+        return `${Math.floor(diff / 86400000)}天前`;
+    } else {
+        return date.toLocaleDateString('zh-CN');
+    }
+}
+
+// 显示隐藏的信件
+function showHiddenLetter() {
+    if (confirm('确定要查看这封信吗？信件内容可能包含情感表达。')) {
+        const hiddenSection = document.getElementById('hiddenLetterSection');
+        const noticeSection = document.querySelector('.letter-notice-section');
+
+        if (hiddenSection) {
+            hiddenSection.style.display = 'block';
+        }
+        if (noticeSection) {
+            noticeSection.style.display = 'none';
+        }
+    }
+}
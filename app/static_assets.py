@@ -0,0 +1,104 @@
+"""
+纪念馆页面静态资源
+app/static 中的CSS/JS按内容哈希生成带指纹的文件（storage/assets/memorial.<hash>.css），
+页面引用指纹URL，浏览器可以长期缓存；旧版本文件保留，已生成的页面不会失效
+"""
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from page_cache import CachedPage, build_page_response
+
+DEFAULT_SOURCE_DIR = os.path.join(os.path.dirname(__file__), "static")
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "assets")
+
+MEMORIAL_ASSETS = ["memorial.css", "memorial.js"]
+
+MEDIA_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+# 指纹文件名：名称.12位哈希.扩展名
+FINGERPRINT_PATTERN = re.compile(r"^[\w-]+\.[0-9a-f]{12}\.(css|js)$")
+
+
+class StaticAssets:
+    """带内容指纹的静态资源"""
+
+    def __init__(self, source_dir: str = DEFAULT_SOURCE_DIR, output_dir: str = DEFAULT_OUTPUT_DIR,
+                 url_prefix: str = "/static/assets", max_age: int = None):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_age = max_age or int(os.getenv('STATIC_ASSET_MAX_AGE', str(365 * 24 * 3600)))
+        self._lock = threading.Lock()
+        # 资源名 -> 当前指纹文件名
+        self._current: Dict[str, str] = {}
+        # 指纹文件名 -> 缓存内容（包含压缩版本）
+        self._files: Dict[str, CachedPage] = {}
+
+    def build(self, names: Iterable[str] = MEMORIAL_ASSETS):
+        """生成指纹文件（已存在则跳过），并加载到内存"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name in names:
+            with open(os.path.join(self.source_dir, name), "rb") as f:
+                body = f.read()
+            page = CachedPage(body, 0, len(body))
+            stem, ext = os.path.splitext(name)
+            filename = f"{stem}.{page.digest[:12]}{ext}"
+            path = os.path.join(self.output_dir, filename)
+            if not os.path.exists(path):
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+            page = CachedPage(body, os.stat(path).st_mtime_ns, len(body))
+            with self._lock:
+                self._current[name] = filename
+                self._files[filename] = page
+        return dict(self._current)
+
+    def url(self, name: str) -> str:
+        """资源的指纹URL，模板中通过 asset_url() 调用"""
+        filename = self._current.get(name)
+        if filename is None:
+            self.build([name])
+            filename = self._current[name]
+        return f"{self.url_prefix}/{filename}"
+
+    def _get(self, filename: str) -> Optional[CachedPage]:
+        page = self._files.get(filename)
+        if page is not None:
+            return page
+        if not FINGERPRINT_PATTERN.match(filename):
+            return None
+        # 旧版本页面引用的历史指纹文件
+        path = os.path.join(self.output_dir, filename)
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        page = CachedPage(body, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            self._files[filename] = page
+        return page
+
+    def response(self, filename: str, headers):
+        """返回资源响应，不存在时返回None"""
+        page = self._get(filename)
+        if page is None:
+            return None
+        media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+        return build_page_response(page, headers, self.max_age, media_type=media_type, immutable=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取资源统计信息"""
+        return {
+            "current": dict(self._current),
+            "cached_files": len(self._files),
+            "max_age": self.max_age
+        }
@@ -0,0 +1,141 @@
+"""
+访问统计写缓冲
+访问记录先在内存中积累，定时或积累到一定行数后
+在一个事务中批量写入（同时累加到汇总表），关闭服务时把剩余数据全部写入；
+超过保留期的原始访问记录定期压缩删除
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+class StatsBuffer:
+    """访问统计写缓冲"""
+
+    def __init__(self, db, flush_interval_ms: int = None, max_rows: int = None):
+        self.db = db
+        self.flush_interval = (flush_interval_ms or int(os.getenv('STATS_FLUSH_INTERVAL_MS', '500'))) / 1000.0
+        self.max_rows = max_rows or int(os.getenv('STATS_FLUSH_MAX_ROWS', '500'))
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._visits = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker = None
+
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self):
+        """启动定时写入协程"""
+        if self._worker:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止写入协程，并写入缓冲中剩余的数据"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await asyncio.to_thread(self.flush)
+
+    def record_visit(self, memorial_id: str, visitor_ip: str, user_agent: str):
+        """记录一次访问"""
+        visit_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._visits.append((memorial_id, visitor_ip, user_agent, visit_time))
+            pending = len(self._visits)
+        if pending >= self.max_rows and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"❌ 访问统计写入失败: {e}")
+
+    def flush(self) -> int:
+        """把缓冲中的数据写入数据库，返回写入的行数"""
+        with self._flush_lock:
+            with self._lock:
+                visits, self._visits = self._visits, []
+
+            if not visits:
+                return 0
+
+            started = time.monotonic()
+            try:
+                self.db.flush_visit_stats(visits)
+            except Exception:
+                # 写入失败时放回缓冲，下次重试
+                with self._lock:
+                    self._visits[:0] = visits
+                raise
+
+            rows = len(visits)
+            self.flushed_rows += rows
+            self.flush_count += 1
+            self.last_flush_ms = round((time.monotonic() - started) * 1000, 2)
+            return rows
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓冲统计信息"""
+        with self._lock:
+            pending_visits = len(self._visits)
+        return {
+            "pending_visits": pending_visits,
+            "flushed_rows": self.flushed_rows,
+            "flush_count": self.flush_count,
+            "last_flush_ms": self.last_flush_ms,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "max_rows": self.max_rows
+        }
+
+
+class VisitStatsCompactor:
+    """定期删除超过保留期的原始访问记录，统计数据由汇总表提供"""
+
+    def __init__(self, db, retention_days: int = None, interval: float = None):
+        self.db = db
+        self.retention_days = retention_days or int(os.getenv('VISIT_RAW_RETENTION_DAYS', '90'))
+        self.interval = interval or float(os.getenv('VISIT_COMPACT_INTERVAL', '3600'))
+        self._worker = None
+        self.last_deleted = 0
+
+    async def start(self):
+        """启动定时压缩协程"""
+        if self._worker:
+            return
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止压缩协程"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_deleted = await asyncio.to_thread(self.db.compact_visit_stats, self.retention_days)
+                if self.last_deleted:
+                    print(f"🧹 已压缩 {self.last_deleted} 条超过 {self.retention_days} 天的访问记录")
+            except Exception as e:
+                print(f"❌ 访问记录压缩失败: {e}")
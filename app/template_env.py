@@ -0,0 +1,65 @@
+"""
+共享的Jinja模板环境
+纪念馆页面生成和 Jinja2Templates 使用同一个 Environment：编译结果写入文件字节码缓存，
+重启或多个工作进程都直接加载，不再重新编译；启动时预编译常用模板，生产环境关闭自动重载
+"""
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "template_cache")
+
+# 启动时预编译的模板（动态渲染的页面）
+PRECOMPILE_TEMPLATES = ["memorial.html", "error.html", "login.html", "user_center.html"]
+
+# 不自动转义的模板：纪念馆页面一直按原样输出，AI信件中的换行由模板替换为<br>
+RAW_TEMPLATES = {"memorial.html"}
+
+
+def _autoescape(name: Optional[str]) -> bool:
+    return name not in RAW_TEMPLATES
+
+
+def create_template_env(templates_dir: str = TEMPLATES_DIR, cache_dir: str = None,
+                        auto_reload: bool = None) -> Environment:
+    """创建带文件字节码缓存的模板环境"""
+    if auto_reload is None:
+        auto_reload = os.getenv('TEMPLATE_AUTO_RELOAD', 'false' if os.getenv('ENVIRONMENT') == 'production' else 'true').lower() == 'true'
+    cache_dir = cache_dir or os.getenv('TEMPLATE_CACHE_DIR', DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(templates_dir),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        auto_reload=auto_reload,
+        autoescape=_autoescape
+    )
+
+
+def precompile_templates(env: Environment, names: Iterable[str] = PRECOMPILE_TEMPLATES) -> int:
+    """加载并编译模板（已有字节码缓存时直接读取），返回模板数"""
+    started = time.monotonic()
+    count = 0
+    for name in names:
+        env.get_template(name)
+        count += 1
+    print(f"📄 已预编译 {count} 个模板，用时 {(time.monotonic() - started) * 1000:.0f} 毫秒")
+    return count
+
+
+# 进程内共享的模板环境
+_shared_env: Optional[Environment] = None
+_shared_lock = threading.Lock()
+
+
+def get_template_env() -> Environment:
+    """获取共享的模板环境"""
+    global _shared_env
+    if _shared_env is None:
+        with _shared_lock:
+            if _shared_env is None:
+                _shared_env = create_template_env()
+    return _shared_env
@@ -0,0 +1,120 @@
+"""
+照片上传管道
+把UploadFile分块流式写入临时文件，写完后原子重命名到照片目录，
+边写边检查单文件与单次请求的大小上限，一次请求中的多张照片并发处理。
+文件按内容SHA-256命名，相同照片只保存一份
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from typing import List, Optional
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+
+
+# 照片文件登记/落盘与清理任务删除文件互斥
+BLOB_LOCK = threading.Lock()
+
+
+class UploadTooLarge(ValueError):
+    """上传内容超过大小上限"""
+
+
+class PhotoUploader:
+    """照片上传管道"""
+
+    def __init__(self, photos_dir: str, db=None, url_prefix: str = "/storage/photos",
+                 max_file_bytes: int = None, max_request_bytes: int = None,
+                 chunk_size: int = 1024 * 1024, concurrency: int = None):
+        self.photos_dir = photos_dir
+        self.db = db
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_file_bytes = max_file_bytes or int(os.getenv('UPLOAD_MAX_FILE_BYTES', str(20 * 1024 * 1024)))
+        self.max_request_bytes = max_request_bytes or int(os.getenv('UPLOAD_MAX_REQUEST_BYTES', str(200 * 1024 * 1024)))
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency or int(os.getenv('UPLOAD_CONCURRENCY', '4'))
+        os.makedirs(self.photos_dir, exist_ok=True)
+
+    async def save_photos(self, photos: List[UploadFile], images_only: bool = False) -> List[str]:
+        """
+        保存一次请求中的所有照片，返回照片URL列表（顺序与上传顺序一致）
+        任意一张失败或超出上限时抛出异常，已写入的文件没有引用，由清理任务回收
+        """
+        if images_only:
+            photos = [photo for photo in photos if (photo.content_type or "").startswith("image/")]
+
+        # 客户端声明的大小可以提前拒绝，真实大小在写入时检查
+        declared = [getattr(photo, "size", None) for photo in photos]
+        for photo, size in zip(photos, declared):
+            if size is not None and size > self.max_file_bytes:
+                raise UploadTooLarge(f"照片 {photo.filename} 超过单张大小上限 {self._format_size(self.max_file_bytes)}")
+        if all(size is not None for size in declared) and sum(declared) > self.max_request_bytes:
+            raise UploadTooLarge(f"本次上传总大小超过上限 {self._format_size(self.max_request_bytes)}")
+
+        budget = {"remaining": self.max_request_bytes}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def save_one(photo: UploadFile) -> str:
+            async with semaphore:
+                return await self._save_one(photo, budget)
+
+        results = await asyncio.gather(*(save_one(photo) for photo in photos), return_exceptions=True)
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        return list(results)
+
+    async def _save_one(self, photo: UploadFile, budget: dict) -> str:
+        temp_path = os.path.join(self.photos_dir, f".{os.urandom(8).hex()}.part")
+        digest = hashlib.sha256()
+
+        written = 0
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                while True:
+                    chunk = await photo.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    budget["remaining"] -= len(chunk)
+                    if written > self.max_file_bytes:
+                        raise UploadTooLarge(f"照片 {photo.filename} 超过单张大小上限 {self._format_size(self.max_file_bytes)}")
+                    if budget["remaining"] < 0:
+                        raise UploadTooLarge(f"本次上传总大小超过上限 {self._format_size(self.max_request_bytes)}")
+                    digest.update(chunk)
+                    await f.write(chunk)
+
+            sha256 = digest.hexdigest()
+            photo_url = f"{self.url_prefix}/{sha256}.jpg"
+            await asyncio.to_thread(self._commit, temp_path, sha256, photo_url, written)
+        except BaseException:
+            await self._remove_quietly(temp_path)
+            raise
+        finally:
+            await photo.close()
+
+        return photo_url
+
+    def _commit(self, temp_path: str, sha256: str, photo_url: str, size: int):
+        """登记照片文件并移动到最终位置，内容相同则文件相同，直接覆盖即可"""
+        with BLOB_LOCK:
+            if self.db is not None:
+                self.db.register_photo_blob(sha256, photo_url, size)
+            os.replace(temp_path, os.path.join(self.photos_dir, f"{sha256}.jpg"))
+
+    @staticmethod
+    async def _remove_quietly(path: Optional[str]):
+        if not path:
+            return
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _format_size(num_bytes: int) -> str:
+        return f"{num_bytes / (1024 * 1024):.0f}MB"
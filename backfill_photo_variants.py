@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+照片缩略图补全脚本
+为 storage/photos 中尚未生成缩略图/中等尺寸版本的历史照片批量生成版本，
+并重新生成用到这些照片的纪念馆页面
+用法: python backfill_photo_variants.py [--force] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from database import Database
+from photo_variants import PhotoVariantGenerator
+from services import MemorialService
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+
+
+def backfill(force=False, workers=None, batch_size=50):
+    """补全历史照片的各尺寸版本"""
+    photos_dir = os.path.join(os.path.dirname(__file__), "storage", "photos")
+    if not os.path.isdir(photos_dir):
+        print(f"❌ 照片目录不存在: {photos_dir}")
+        return False
+    
+    db = Database()
+    generator = PhotoVariantGenerator(db, photos_dir, workers=workers)
+    if not generator.enabled:
+        print("❌ 未安装Pillow，无法生成缩略图")
+        return False
+    
+    try:
+        done_urls = set() if force else db.get_photo_urls_with_variants()
+        photo_urls = [
+            f"/storage/photos/{name}"
+            for name in sorted(os.listdir(photos_dir))
+            if name.lower().endswith(PHOTO_EXTENSIONS) and not name.startswith('.')
+        ]
+        pending = [url for url in photo_urls if url not in done_urls]
+        print(f"📷 共 {len(photo_urls)} 张照片，待处理 {len(pending)} 张")
+        
+        memorial_service = MemorialService(db)
+        started = time.monotonic()
+        totals = {"done": 0, "failed": 0, "pages": 0}
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            stats = generator.generate_many(batch)
+            totals["done"] += stats["done"]
+            totals["failed"] += stats["failed"]
+            
+            # 重新生成用到这批照片的纪念馆页面，使页面引用新生成的缩略图
+            for memorial_id in db.get_photo_memorial_ids(batch):
+                try:
+                    if memorial_service.rerender_memorial(memorial_id):
+                        totals["pages"] += 1
+                except Exception as e:
+                    print(f"  ⚠️ 纪念馆页面重新生成失败 {memorial_id}: {e}")
+            print(f"  ✅ 已处理 {start + len(batch)}/{len(pending)}")
+        
+        elapsed = time.monotonic() - started
+        print(f"\n📊 完成 {totals['done']} 张，失败 {totals['failed']} 张，"
+              f"重新生成 {totals['pages']} 个纪念馆页面，用时 {elapsed:.1f} 秒")
+        return totals["failed"] == 0
+    finally:
+        generator.close()
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="补全历史照片的缩略图和中等尺寸版本")
+    parser.add_argument("--force", action="store_true", help="重新生成已有版本的照片")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认读取 PHOTO_VARIANT_WORKERS")
+    args = parser.parse_args()
+    
+    print("🚀 照片缩略图补全工具")
+    print("=" * 50)
+    
+    success = backfill(force=args.force, workers=args.workers)
+    
+    if success:
+        print("\n✅ 补全完成！")
+    else:
+        print("\n❌ 部分照片处理失败，请检查错误信息")
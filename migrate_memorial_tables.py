@@ -1,10 +1,90 @@
 #!/usr/bin/env python3
 """
 纪念馆管理功能数据库迁移脚本
-添加纪念馆照片表和统计表，更新纪念馆表结构
+添加纪念馆照片表和统计表，更新纪念馆表结构，创建二级索引，
+并从已生成的纪念馆页面回填 memorial_photos（早期创建的纪念馆照片只记录在页面中）
 """
+import html
+import re
 import sqlite3
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from database import apply_indexes, INDEX_VERSION
+
+# 纪念馆页面照片墙中每张照片的第一个<img>
+GALLERY_IMG_PATTERN = re.compile(r'<div class="photo-item">.*?<img[^>]*?\ssrc="([^"]+)"', re.S)
+
+
+def extract_page_photos(cursor, page_html):
+    """从纪念馆页面提取原图URL，缩略图URL通过 photo_variants 映射回原图"""
+    photos = []
+    for src in GALLERY_IMG_PATTERN.findall(page_html):
+        url = html.unescape(src)
+        if "/variants/" in url:
+            try:
+                cursor.execute("SELECT photo_url FROM photo_variants WHERE url = ?", (url,))
+                row = cursor.fetchone()
+            except sqlite3.OperationalError:
+                row = None
+            if not row:
+                continue
+            url = row[0]
+        if url.startswith("/storage/photos/") and url not in photos:
+            photos.append(url)
+    return photos
+
+
+def backfill_memorial_photos(cursor, memorials_dir):
+    """
+    按页面内容补录 memorial_photos 中缺少的照片，返回 (纪念馆数, 照片数)
+    早期纪念馆创建时的照片只在页面中，之后上传的照片才有记录，所以每个纪念馆都要合并而不只是没有记录的
+    """
+    photos_dir = os.path.join(os.path.dirname(memorials_dir), "photos")
+    cursor.execute("SELECT id, created_at FROM memorials")
+    memorials = cursor.fetchall()
+    
+    memorial_count = 0
+    photo_count = 0
+    for memorial_id, created_at in memorials:
+        page_path = os.path.join(memorials_dir, f"{memorial_id}.html")
+        if not os.path.exists(page_path):
+            continue
+        with open(page_path, "r", encoding="utf-8") as f:
+            photos = extract_page_photos(cursor, f.read())
+        if not photos:
+            continue
+        
+        cursor.execute("SELECT photo_url FROM memorial_photos WHERE memorial_id = ?", (memorial_id,))
+        registered = {row[0] for row in cursor.fetchall()}
+        # 文件已不存在的照片不再补录
+        missing = [
+            photo_url for photo_url in photos
+            if photo_url not in registered
+            and os.path.exists(os.path.join(photos_dir, photo_url[len("/storage/photos/"):]))
+        ]
+        if not missing:
+            continue
+        
+        for photo_url in missing:
+            # 页面中的照片是创建纪念馆时上传的，使用纪念馆的创建时间排在之后上传的照片前面
+            cursor.execute('''
+            INSERT INTO memorial_photos (memorial_id, photo_url, created_at)
+            VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', (memorial_id, photo_url, created_at))
+            # 与 Database.add_memorial_photo 一致，增加照片文件引用计数
+            try:
+                cursor.execute('''
+                UPDATE photo_blobs 
+                SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE photo_url = ?
+                ''', (photo_url,))
+            except sqlite3.OperationalError:
+                pass
+        memorial_count += 1
+        photo_count += len(missing)
+    return memorial_count, photo_count
 
 def migrate_database():
     """执行数据库迁移"""
@@ -98,7 +178,19 @@ def migrate_database():
         stats_count = cursor.rowcount
         print(f"  ✅ 创建了 {stats_count} 条统计记录")
         
+        # 6. 从纪念馆页面回填照片记录
+        print("🖼️  从纪念馆页面回填照片记录...")
+        memorials_dir = os.path.join(os.path.dirname(__file__), "storage", "memorials")
+        backfilled_memorials, backfilled_photos = backfill_memorial_photos(cursor, memorials_dir)
+        print(f"  ✅ 为 {backfilled_memorials} 个纪念馆补录了 {backfilled_photos} 张照片")
+        
         conn.commit()
+        
+        # 7. 创建二级索引
+        print(f"🗂️  创建二级索引 (版本 {INDEX_VERSION})...")
+        index_count = apply_indexes(conn, force=True)
+        print(f"  ✅ 已确认 {index_count} 个索引")
+        
         print("🎉 纪念馆管理功能迁移完成！")
         
         # 显示统计信息
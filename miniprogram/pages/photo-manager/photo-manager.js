@@ -197,7 +197,7 @@ Page({
   previewPhoto(e) {
     const index = e.currentTarget.dataset.index
     const photos = this.data.photos
-    const urls = photos.map(p => p.url)
+    const urls = photos.map(p => p.medium_url || p.url)
     
     wx.previewImage({
       current: urls[index],
@@ -188,6 +188,60 @@ class ApiService {
     })
   }
 
+  // 留言、心情日记、提醒（游标分页，返回 next_cursor，为空表示没有更多）
+  async getMessages(memorialId, cursor = null, limit = 20) {
+    return this.request({
+      url: `/api/messages/${memorialId}`,
+      data: cursor ? { limit, cursor } : { limit }
+    })
+  }
+
+  async getMoodDiaries(memorialId, cursor = null, limit = 10) {
+    return this.request({
+      url: `/api/mood-diaries/${memorialId}`,
+      data: cursor ? { limit, cursor } : { limit }
+    })
+  }
+
+  async getReminders(memorialId, cursor = null, limit = 20) {
+    return this.request({
+      url: `/api/reminders/${memorialId}`,
+      data: cursor ? { limit, cursor } : { limit }
+    })
+  }
+
+  // 创建分页加载器，例如 createPager(cursor => api.getMessages(id, cursor), 'messages')
+  // 每次 loadMore() 返回下一页的数据，hasMore 为 false 时已全部加载
+  createPager(fetchPage, listKey) {
+    const pager = {
+      cursor: null,
+      hasMore: true,
+      loading: false,
+      async loadMore() {
+        if (!pager.hasMore || pager.loading) {
+          return []
+        }
+        pager.loading = true
+        try {
+          const res = await fetchPage(pager.cursor)
+          if (!res.success) {
+            throw new Error(res.message || '加载失败')
+          }
+          pager.cursor = res.next_cursor || null
+          pager.hasMore = !!pager.cursor
+          return res[listKey] || []
+        } finally {
+          pager.loading = false
+        }
+      },
+      reset() {
+        pager.cursor = null
+        pager.hasMore = true
+      }
+    }
+    return pager
+  }
+
   // 照片相关API
   async getPhotos() {
     return this.request({
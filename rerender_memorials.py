@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+纪念馆页面批量重新生成脚本
+修改 memorial.html 模板或页面资源后，按数据库中的最新数据重新生成所有纪念馆页面。
+主进程按ID顺序分批读取纪念馆数据，多个进程并行渲染，每个页面写临时文件后原子替换；
+每完成一批记录进度和失败的ID，中断后可用 --resume 先重试失败的页面再从上次的位置继续。
+照片尚未完整回填到 memorial_photos 的早期纪念馆会保留现有页面并计入跳过数，
+先运行 migrate_memorial_tables.py 回填照片后再重新生成
+用法: python rerender_memorials.py [--workers N] [--batch-size N] [--rate N] [--resume]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from database import Database
+from services import MemorialService
+from static_assets import StaticAssets
+from template_env import get_template_env, precompile_templates
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(__file__), "storage", ".rerender_memorials.json")
+
+# 工作进程中的页面生成服务（不访问数据库）
+_renderer = None
+
+
+def _init_worker():
+    global _renderer
+    assets = StaticAssets()
+    assets.build()
+    _renderer = MemorialService(None, assets=assets)
+
+
+def _render_chunk(items):
+    """在工作进程中生成一组页面，返回 (失败的 [(memorial_id, 错误信息)], 跳过的 [memorial_id])"""
+    failed = []
+    skipped = []
+    for memorial_id, data in items:
+        try:
+            if _renderer.write_memorial_page(memorial_id, data) is None:
+                skipped.append(memorial_id)
+        except Exception as e:
+            failed.append((memorial_id, str(e)))
+    return failed, skipped
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_checkpoint(path, state):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def rerender_all(workers=None, batch_size=200, chunk_size=20, rate=0, resume=False,
+                 checkpoint_path=DEFAULT_CHECKPOINT):
+    """重新生成所有纪念馆页面，rate 为每秒最多生成的页面数（0 表示不限制）"""
+    workers = workers or os.cpu_count() or 1
+    batch_size = max(1, min(batch_size, 500))
+    chunk_size = max(1, chunk_size)
+
+    state = {"last_id": None, "rendered": 0, "skipped": 0, "failed_ids": []}
+    if resume:
+        saved = load_checkpoint(checkpoint_path)
+        if saved:
+            state.update(saved)
+            print(f"⏩ 从上次进度继续: 已生成 {state['rendered']} 个，"
+                  f"待重试 {len(state['failed_ids'])} 个，最后ID {state['last_id']}")
+        else:
+            print("ℹ️ 没有找到进度文件，从头开始")
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+
+    # 工作进程从字节码缓存加载模板（fork 时直接继承已编译的模板）
+    precompile_templates(get_template_env(), ["memorial.html"])
+
+    db = Database()
+    submitted = 0
+    failed_count = 0
+    skipped_count = 0
+    started = time.monotonic()
+
+    def submit(pool, batch):
+        nonlocal submitted
+        futures = []
+        for start in range(0, len(batch), chunk_size):
+            chunk = batch[start:start + chunk_size]
+            if rate > 0:
+                # 限速：按已提交的页面数计算最早提交时间
+                wait = started + submitted / rate - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            futures.append(pool.submit(_render_chunk, chunk))
+            submitted += len(chunk)
+        return futures
+
+    def collect(futures, batch):
+        nonlocal failed_count, skipped_count
+        failed = []
+        skipped = []
+        for future in futures:
+            chunk_failed, chunk_skipped = future.result()
+            failed.extend(chunk_failed)
+            skipped.extend(chunk_skipped)
+        for memorial_id, error in failed:
+            print(f"  ❌ {memorial_id}: {error}")
+        failed_count += len(failed)
+        skipped_count += len(skipped)
+        state["rendered"] += len(batch) - len(failed) - len(skipped)
+        state["skipped"] += len(skipped)
+        return [memorial_id for memorial_id, _ in failed]
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # 先重试上次失败的页面
+            if state["failed_ids"]:
+                retry = []
+                for memorial_id in state["failed_ids"]:
+                    data = db.get_memorial_render_data(memorial_id)
+                    if data:
+                        data['photo_variants'] = db.get_photo_variants(data['photos'])
+                        retry.append((memorial_id, data))
+                state["failed_ids"] = collect(submit(pool, retry), retry)
+                save_checkpoint(checkpoint_path, state)
+
+            batch = db.get_memorial_render_batch(state["last_id"], batch_size)
+            while batch:
+                futures = submit(pool, batch)
+                # 工作进程渲染时预读下一批
+                next_batch = db.get_memorial_render_batch(batch[-1][0], batch_size)
+
+                state["failed_ids"].extend(collect(futures, batch))
+                state["last_id"] = batch[-1][0]
+                save_checkpoint(checkpoint_path, state)
+
+                elapsed = time.monotonic() - started
+                print(f"  ✅ 已生成 {state['rendered']} 个，跳过 {state['skipped']} 个，失败 {len(state['failed_ids'])} 个，"
+                      f"{submitted / elapsed if elapsed > 0 else 0:.1f} 个/秒")
+                batch = next_batch
+    finally:
+        db.close()
+
+    elapsed = time.monotonic() - started
+    print(f"\n📊 本次生成 {submitted - failed_count - skipped_count} 个，跳过 {skipped_count} 个，失败 {failed_count} 个，"
+          f"用时 {elapsed:.1f} 秒，{submitted / elapsed if elapsed > 0 else 0:.1f} 个/秒")
+    if skipped_count:
+        print("⚠️ 跳过的纪念馆照片尚未回填，已保留原页面；运行 migrate_memorial_tables.py 后重新执行本脚本")
+    if state["failed_ids"]:
+        return False
+    # 全部成功后删除进度文件，下次从头开始
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按最新模板重新生成所有纪念馆页面")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    parser.add_argument("--batch-size", type=int, default=200, help="每批从数据库读取的纪念馆数（最多500）")
+    parser.add_argument("--chunk-size", type=int, default=20, help="每个任务包含的纪念馆数")
+    parser.add_argument("--rate", type=float, default=0, help="每秒最多生成的页面数，0 表示不限制")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的位置继续")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="进度文件路径")
+    args = parser.parse_args()
+
+    print("🚀 纪念馆页面批量重新生成工具")
+    print("=" * 50)
+
+    success = rerender_all(
+        workers=args.workers,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        rate=args.rate,
+        resume=args.resume,
+        checkpoint_path=args.checkpoint
+    )
+
+    if success:
+        print("\n✅ 重新生成完成！")
+    else:
+        print("\n❌ 部分页面生成失败，修复后使用 --resume 重试失败的页面")
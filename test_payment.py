@@ -6,6 +6,7 @@
 import os
 import sys
 import json
+import asyncio
 import requests
 from datetime import datetime
 
@@ -13,13 +14,12 @@ from datetime import datetime
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
 from payment_service import PaymentService
+from http_client import HttpClient
 
-def test_wechat_pay():
+async def test_wechat_pay(payment_service):
     """测试微信支付"""
     print("🧪 测试微信支付...")
     
-    payment_service = PaymentService()
-    
     # 测试创建订单
     order_id = f"test_wechat_{int(datetime.now().timestamp())}"
     amount = 0.01  # 测试金额1分
@@ -27,7 +27,7 @@ def test_wechat_pay():
     openid = "test_openid_123"
     notify_url = "https://yourdomain.com/api/payment/wechat/notify"
     
-    result = payment_service.create_payment_order(
+    result = await payment_service.create_payment_order(
         payment_method='wechat',
         order_id=order_id,
         amount=amount,
@@ -43,18 +43,16 @@ def test_wechat_pay():
     else:
         print(f"❌ 微信支付订单创建失败: {result['message']}")
 
-def test_alipay():
+async def test_alipay(payment_service):
     """测试支付宝支付"""
     print("🧪 测试支付宝支付...")
     
-    payment_service = PaymentService()
-    
     # 测试创建订单
     order_id = f"test_alipay_{int(datetime.now().timestamp())}"
     amount = 0.01  # 测试金额1分
     description = "测试订单"
     
-    result = payment_service.create_payment_order(
+    result = await payment_service.create_payment_order(
         payment_method='alipay',
         order_id=order_id,
         amount=amount,
@@ -69,6 +67,18 @@ def test_alipay():
     else:
         print(f"❌ 支付宝订单创建失败: {result['message']}")
 
+async def test_payment_service():
+    """测试支付服务（创建订单是异步接口）"""
+    http_client = HttpClient()
+    payment_service = PaymentService(http_client)
+    try:
+        await test_wechat_pay(payment_service)
+        print()
+        await test_alipay(payment_service)
+    finally:
+        payment_service.close()
+        await http_client.close()
+
 def test_payment_config():
     """测试支付配置"""
     print("🔧 检查支付配置...")
@@ -149,9 +159,7 @@ def main():
     
     # 测试支付服务
     try:
-        test_wechat_pay()
-        print()
-        test_alipay()
+        asyncio.run(test_payment_service())
     except Exception as e:
         print(f"❌ 支付服务测试失败: {e}")
     